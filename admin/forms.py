@@ -1,6 +1,7 @@
 """Forms used in system administration"""
 
 from flask_wtf import FlaskForm
+from flask_wtf.file import FileField, FileRequired
 from wtforms import (
     PasswordField,
     SubmitField,
@@ -46,3 +47,10 @@ class EditUserForm(FlaskForm):
     update = SubmitField("Update")
     logout = SubmitField("Log Out")
     delete = SubmitField("Delete")
+
+
+class ImportUsersForm(FlaskForm):
+    """Form for an admin to import a roster of users"""
+
+    roster = FileField("Roster", validators=[FileRequired()])
+    submit = SubmitField("Import")
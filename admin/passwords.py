@@ -0,0 +1,129 @@
+"""Password hashing and checking. bcrypt is deliberately slow, so the work is
+done in a pool of processes with a limit on how many requests can wait for
+it. When the pool is saturated Busy is raised right away so the caller can
+ask the user to retry instead of queueing up behind everyone else."""
+
+import functools
+import multiprocessing
+import os
+import re
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import bcrypt
+from flask import current_app
+
+from metrics import PASSWORD
+
+WORKERS = int(os.getenv("PASSWORD_WORKERS", str(os.cpu_count() or 1)))
+QUEUE_LIMIT = int(os.getenv("PASSWORD_QUEUE", "16"))  # checks waiting for a worker
+DEFAULT_LOG_ROUNDS = 12  # bcrypt work factor, Flask-Bcrypt's default
+
+_executor = None
+_executor_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(WORKERS + QUEUE_LIMIT)
+_bulk_lock = threading.Lock()
+
+
+class Busy(Exception):
+    """Raised when too many password operations are already waiting"""
+
+
+def _get_executor():
+    """Starts the process pool the first time it's needed"""
+
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # by now the app's background threads are running, and a forked
+            # child could inherit one of their locks while it's held
+            _executor = ProcessPoolExecutor(
+                max_workers=WORKERS,
+                mp_context=multiprocessing.get_context("forkserver"),
+            )
+        return _executor
+
+
+def _hash(password, rounds):
+    """Hashes a password, run in a worker process"""
+
+    return bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt(rounds)).decode(
+        "utf-8"
+    )
+
+
+def _check(pw_hash, password):
+    """Checks a password against a hash, run in a worker process"""
+
+    return bcrypt.checkpw(password.encode("utf-8"), pw_hash.encode("utf-8"))
+
+
+def _run(function, *args):
+    """Runs a function in the pool and waits for the result, raising Busy if
+    there are no free slots"""
+
+    if not _slots.acquire(blocking=False):
+        raise Busy()
+    try:
+        with PASSWORD.time(function.__name__.strip("_")):
+            return _get_executor().submit(function, *args).result()
+    finally:
+        _slots.release()
+
+
+def log_rounds():
+    """The configured work factor, BCRYPT_LOG_ROUNDS"""
+
+    return current_app.config.get("BCRYPT_LOG_ROUNDS", DEFAULT_LOG_ROUNDS)
+
+
+def generate_hash(password):
+    """Hashes a password with the configured work factor"""
+
+    return _run(_hash, password, log_rounds())
+
+
+@functools.lru_cache(maxsize=4)
+def _dummy_hash(rounds):
+    """A hash to check the passwords of unknown users against"""
+
+    return _run(_hash, "", rounds)
+
+
+def check(pw_hash, password):
+    """Returns whether a password matches a hash. A hash of None, for a user
+    that doesn't exist, never matches but takes as long to check so it can't
+    be told apart from a wrong password."""
+
+    if pw_hash is None:
+        _run(_check, _dummy_hash(log_rounds()), password)
+        return False
+    return _run(_check, pw_hash, password)
+
+
+def hash_many(passwords, rounds):
+    """Hashes a list of passwords for admin bulk operations. They go through
+    the pool a batch of WORKERS at a time, each one holding a slot, so logins
+    never queue up behind more than one batch. This waits for slots instead
+    of raising Busy."""
+
+    hashes = []
+    with _bulk_lock:  # two imports each holding some of the slots could deadlock
+        for start in range(0, len(passwords), WORKERS):
+            batch = passwords[start : start + WORKERS]
+            for _ in batch:
+                _slots.acquire()
+            try:
+                hashes.extend(_get_executor().map(_hash, batch, [rounds] * len(batch)))
+            finally:
+                for _ in batch:
+                    _slots.release()
+    return hashes
+
+
+def needs_rehash(pw_hash):
+    """Returns whether a hash was made with a different work factor than the
+    one configured now"""
+
+    match = re.match(r"^\$2[abxy]?\$(\d+)\$", pw_hash)
+    return not match or int(match.group(1)) != log_rounds()
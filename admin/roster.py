@@ -0,0 +1,84 @@
+"""Functions for importing a whole class roster of users at once"""
+
+import csv
+import io
+import json
+import secrets
+
+import db
+from admin import passwords
+from admin.users import ROLE_ADMIN, ROLE_USER
+
+PASSWORD_CHARACTERS = "ABCDEFGHJKLMNPQRSTUVWXYZ23456789"
+PASSWORD_LENGTH = 8
+
+
+def parse_roster(filename, data):
+    """Parses a roster file into a list of dicts with username, password and
+    role keys. JSON files are a list of objects and anything else is read as
+    CSV with a header row. Only username is required."""
+
+    text = data.decode("utf-8-sig") if isinstance(data, bytes) else data
+    if filename.lower().endswith(".json"):
+        records = json.loads(text)
+        if not isinstance(records, list):
+            raise ValueError("JSON rosters must be a list of users")
+    else:
+        records = list(csv.DictReader(io.StringIO(text)))
+
+    roster = []
+    for record in records:
+        if not isinstance(record, dict):
+            raise ValueError("Each user in a roster must be an object")
+        role = str(record.get("role") or "").strip().lower()
+        roster.append(
+            {
+                "username": str(record.get("username") or "").strip(),
+                "password": str(record.get("password") or ""),
+                "role": ROLE_ADMIN if role in ("1", "admin", "administrator") else ROLE_USER,
+            }
+        )
+    return roster
+
+
+def generate_password():
+    """Makes a random password in the same style as the add user form"""
+
+    return "".join(secrets.choice(PASSWORD_CHARACTERS) for _ in range(PASSWORD_LENGTH))
+
+
+def import_roster(conn, roster, rounds):
+    """Adds every new user in a parsed roster. Returns a list of per row
+    results, dicts with username, password (only if it was generated) and
+    status. The caller needs to commit."""
+
+    results = []
+    seen = set()
+    for row in roster:
+        result = {"username": row["username"], "password": "", "status": "added"}
+        if not row["username"]:
+            result["status"] = "missing username"
+        elif row["username"] in seen:
+            result["status"] = "duplicate in roster"
+        seen.add(row["username"])
+        results.append(result)
+
+    existing = db.get_existing_user_names(conn, list(seen))
+    new = []
+    for row, result in zip(roster, results):
+        if result["status"] != "added":
+            continue
+        if row["username"] in existing:
+            result["status"] = "username already in use"
+            continue
+        if not row["password"]:
+            row["password"] = result["password"] = generate_password()
+        new.append(row)
+
+    hashes = passwords.hash_many([row["password"] for row in new], rounds)
+    db.add_users(
+        conn,
+        [(row["username"], pw_hash, row["role"]) for row, pw_hash in zip(new, hashes)],
+    )
+
+    return results
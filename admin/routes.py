@@ -1,24 +1,110 @@
 """Routes for systems administration"""
 
+import csv
+import hmac
+import os
+import sys
+
 from flask import (
     Blueprint,
     render_template,
     request,
     redirect,
     url_for,
-    current_app,
     abort,
+    make_response,
 )
+import click
 from flask_login import login_required, login_user, logout_user, current_user
-from flask_bcrypt import Bcrypt
 
 import db
-from admin.users import User, ROLE_ADMIN, ROLE_USER
-from admin.forms import LoginForm, ManageProfileForm, EditUserForm, AddUserForm
+import metrics
+from admin.users import User, ROLE_ADMIN, ROLE_USER, invalidate
+from admin.forms import (
+    LoginForm,
+    ManageProfileForm,
+    EditUserForm,
+    AddUserForm,
+    ImportUsersForm,
+)
+from admin import passwords, roster
+from challenges import admission, capacity, images, throttle
+from challenges.ports import PORTS
 
 admin_bp = Blueprint("admin", __name__, template_folder="templates")
 
 DURATION = 60  # how many minutes to keep a user logged in
+RETRY_AFTER = 5  # seconds to tell users to wait when logins are busy
+
+
+def active_challenges():
+    """Active challenges by name for the active_challenges gauge"""
+
+    counts = db.count_active_challenges(db.get_connection())
+    return {(name,): count for name, count in counts.items()}
+
+
+def capacity_used():
+    """Expected CPU and memory use by host for the capacity_used gauge"""
+
+    used = capacity.usage(db.get_connection())
+    values = {}
+    for host, resources in used.items():
+        values[(host or "unplaced", "cpus")] = resources.cpus
+        values[(host or "unplaced", "memory_mb")] = resources.memory
+    return values
+
+
+metrics.Gauge(
+    "active_challenges", "Challenges starting or running", active_challenges, ("challenge",)
+)
+metrics.Gauge(
+    "logged_in_users",
+    "Users that are logged in",
+    lambda: db.count_logged_in_users(db.get_connection()),
+)
+metrics.Gauge("admission_queue", "Users waiting for a challenge", admission.queue_length)
+metrics.Gauge("ports_allocated", "Host ports handed out to challenges", PORTS.in_use)
+metrics.Gauge(
+    "challenge_environments",
+    "Environments of ready challenges, running or paused for being idle",
+    lambda: {
+        (state,): count
+        for state, count in db.count_paused_envs(db.get_connection()).items()
+    },
+    ("state",),
+)
+metrics.Gauge(
+    "flag_submissions_rejected",
+    "Flag submissions turned away for coming too fast, since the range started",
+    lambda: {(name,): count for name, count in throttle.rejected().items()},
+    ("challenge",),
+)
+metrics.Gauge(
+    "capacity_used",
+    "Resources challenges are expected to use",
+    capacity_used,
+    ("host", "resource"),
+)
+metrics.Gauge(
+    "image_ready",
+    "Whether a challenge image is ready to run",
+    lambda: {
+        key: int(state == images.STATE_READY) for key, state in images.states().items()
+    },
+    ("host", "image"),
+)
+
+
+@admin_bp.errorhandler(passwords.Busy)
+def password_pool_busy(error):  # pylint: disable=unused-argument
+    """Asks the user to retry when too many passwords are being hashed"""
+
+    return (
+        "The server is busy, please try again in a few seconds",
+        503,
+        {"Retry-After": str(RETRY_AFTER)},
+    )
 
 
 @admin_bp.route("/login", methods=["GET", "POST"])
@@ -35,27 +121,47 @@ def login():
         conn = db.get_connection()
         user_row = db.get_user_by_name(conn, username)
 
-        # TODO: What if they don't exist?
         # TODO: What if they're already logged in?
 
-        user_id = user_row["id"]
-        name = user_row["name"]
-        pw_hash = user_row["password"]
-        role = user_row["role"]
-
-        bcrypt = Bcrypt(current_app)
-        if bcrypt.check_password_hash(pw_hash, password):
+        try:
+            # unknown users are checked too, so they take just as long
+            valid = passwords.check(
+                user_row["password"] if user_row else None, password
+            )
+        except passwords.Busy:
+            response = make_response(
+                render_template(
+                    "login.html",
+                    form=form,
+                    notification="Lots of people are logging in right now, please try again in a few seconds",
+                ),
+                503,
+            )
+            response.headers["Retry-After"] = str(RETRY_AFTER)
+            return response
+
+        if valid:
+            user_id = user_row["id"]
+            # upgrade the hash if the work factor has been changed
+            if passwords.needs_rehash(user_row["password"]):
+                try:
+                    pw_hash = passwords.generate_hash(password)
+                    db.update_user_password(conn, user_id, pw_hash)
+                except passwords.Busy:
+                    pass  # we'll get it next time
             db.set_auto_logout(conn, user_id, DURATION)
             conn.commit()
-            conn.close()
+            invalidate(user_id)
             user = User(
-                user_id=user_id, name=name, role=role, authenticated=True, active=True
+                user_id=user_id,
+                name=user_row["name"],
+                role=user_row["role"],
+                authenticated=True,
+                active=True,
             )
             login_user(user)
             return redirect(url_for("main.index"))
 
-        conn.close()
-
         notification = "Invalid username or password"
 
     return render_template("login.html", form=form, notification=notification)
@@ -74,18 +180,16 @@ def manage_profile():
         conn = db.get_connection()
         db.clear_auto_logout(conn, current_user.user_id)
         conn.commit()
-        conn.close()
+        invalidate(current_user.user_id)
         logout_user()
         return redirect(url_for("admin.login"))
 
     if form.validate_on_submit():
         conn = db.get_connection()
-        bcrypt = Bcrypt(current_app)
         password = form.password.data
-        pw_hash = bcrypt.generate_password_hash(password).decode("utf-8")
+        pw_hash = passwords.generate_hash(password)
         db.update_user_password(conn, current_user.user_id, pw_hash)
         conn.commit()
-        conn.close()
         notification = "Profile updated successfully"
 
     return render_template("manage_profile.html", form=form, notification=notification)
@@ -103,7 +207,6 @@ def edit_user_get():
 
     conn = db.get_connection()
     user = db.get_user(conn, user_id)
-    conn.close()
 
     form = EditUserForm(
         username=user["name"],
@@ -139,15 +242,14 @@ def edit_user_post():
             db.del_user(conn, user_id)
         else:
             if password:
-                bcrypt = Bcrypt(current_app)
-                pw_hash = bcrypt.generate_password_hash(password).decode("utf-8")
+                pw_hash = passwords.generate_hash(password)
                 db.update_user_password(conn, user_id, pw_hash)
             if time_remaining:
                 db.set_auto_logout(conn, user_id, time_remaining)
             db.update_user(conn, user_id, username, role)
 
         conn.commit()
-        conn.close()
+        invalidate(user_id)
 
         return redirect(url_for("admin.manage_users"))
 
@@ -179,16 +281,13 @@ def manage_users():
         if db.get_user_by_name(conn, username):
             form.username.errors.append("Username already in use")
         else:
-            bcrypt = Bcrypt(current_app)
-            pw_hash = bcrypt.generate_password_hash(password).decode("utf-8")
+            pw_hash = passwords.generate_hash(password)
             db.add_user(conn, username, pw_hash, role)
             conn.commit()
-            conn.close()
 
             return redirect(url_for("admin.manage_users"))
 
     user_row = db.get_all_users(conn)
-    conn.close()
 
     user_list = []
     for user in user_row:
@@ -217,3 +316,62 @@ def manage_users():
         )
 
     return render_template("manage_users.html", form=form, user_list=user_list)
+
+
+@admin_bp.route("/import_users", methods=["GET", "POST"])
+@login_required
+def import_users():
+    """This endpoint lets an admin upload a CSV or JSON roster of users and
+    shows the result for each row"""
+
+    if current_user.role != ROLE_ADMIN:
+        abort(403)
+
+    form = ImportUsersForm()
+    results = None
+
+    if form.validate_on_submit():
+        upload = form.roster.data
+        try:
+            users = roster.parse_roster(upload.filename, upload.read())
+        except (ValueError, UnicodeDecodeError, csv.Error) as error:
+            form.roster.errors.append(f"Couldn't read roster: {error}")
+        else:
+            conn = db.get_connection()
+            results = roster.import_roster(conn, users, passwords.log_rounds())
+            conn.commit()
+
+    return render_template("import_users.html", form=form, results=results)
+
+
+@admin_bp.cli.command("import-users")
+@click.argument("roster_file", type=click.File("rb"))
+def import_users_command(roster_file):
+    """Imports a CSV or JSON roster of users"""
+
+    users = roster.parse_roster(roster_file.name, roster_file.read())
+    conn = db.get_connection()
+    results = roster.import_roster(conn, users, passwords.log_rounds())
+    conn.commit()
+
+    writer = csv.writer(sys.stdout)
+    writer.writerow(["username", "password", "status"])
+    for result in results:
+        writer.writerow([result["username"], result["password"], result["status"]])
+
+
+@admin_bp.route("/metrics")
+def show_metrics():
+    """Metrics in the Prometheus text format for admins, or for a scraper that
+    sends METRICS_TOKEN as a bearer token"""
+
+    token = os.getenv("METRICS_TOKEN")
+    if not token or not hmac.compare_digest(
+        request.headers.get("Authorization", ""), f"Bearer {token}"
+    ):
+        if not current_user.is_authenticated:
+            abort(401)
+        if current_user.role != ROLE_ADMIN:
+            abort(403)
+
+    return metrics.render(), 200, {"Content-Type": "text/plain; version=0.0.4"}
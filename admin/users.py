@@ -1,10 +1,22 @@
 """Functions, classes, and constants for dealing with users"""
 
+import collections
+import threading
+import time
+
 import db
 
 ROLE_USER = 0
 ROLE_ADMIN = 1
 
+CACHE_TTL = 30  # seconds a loaded user is reused for
+CACHE_SIZE = 1024  # users to keep in the cache
+
+# user_id: (expires, user row as a dict or None), least recently used first
+_cache = collections.OrderedDict()
+_cache_lock = threading.Lock()
+_generation = 0  # bumped by invalidate() so a load that raced it isn't cached
+
 
 class User:
     """Class representing a user"""
@@ -49,32 +61,60 @@ class User:
         return self.user_id
 
 
+def invalidate(user_id):
+    """Drops a user from the cache so their next request reloads them. Call
+    this after committing anything load_user depends on."""
+
+    global _generation
+    with _cache_lock:
+        _cache.pop(int(user_id), None)
+        _generation += 1
+
+
+def auto_logout_changed(user_id, deadline):  # pylint: disable=unused-argument
+    """Listener for db.on_auto_logout_change, covers logouts done by the
+    scheduler"""
+
+    invalidate(user_id)
+
+
 def load_user(user_id):
     """Called by Flask-login to get information about a user when they request
-    an endpoint"""
-
-    conn = db.get_connection()
-    user = db.get_user(conn, user_id)
-
-    if user:
-        user_id = user["id"]
-        name = user["name"]
-        role = user["role"]
-        time_remaining = user["time_remaining"]
-        print(f"time_remaining={ time_remaining }")
-        # users that have NULL time remaining are logged out
-        if time_remaining:
-            challenge = db.get_challenge(conn, user_id)
-            if challenge:
-                active_challenge = challenge["name"]
-            else:
-                active_challenge = None
-            return User(
-                user_id=user_id,
-                name=name,
-                role=role,
-                time_remaining=time_remaining,
-                active_challenge=active_challenge,
-            )
-    conn.close()
-    return None
+    an endpoint. Users are cached for CACHE_TTL seconds so most requests don't
+    touch the DB."""
+
+    user_id = int(user_id)
+    now = time.time()
+
+    with _cache_lock:
+        cached = _cache.get(user_id)
+        if cached and cached[0] > now:
+            _cache.move_to_end(user_id)
+            user = cached[1]
+        else:
+            cached = None
+        generation = _generation
+
+    if cached is None:
+        conn = db.get_connection()
+        row = db.get_user_session(conn, user_id)
+        user = dict(row) if row else None
+        with _cache_lock:
+            # the row may be older than a change that was just invalidated
+            if generation == _generation:
+                _cache[user_id] = (now + CACHE_TTL, user)
+                _cache.move_to_end(user_id)
+                while len(_cache) > CACHE_SIZE:
+                    _cache.popitem(last=False)
+
+    # users that have NULL or past auto logout times are logged out
+    if not user or not user["auto_logout_time"] or user["auto_logout_time"] <= now:
+        return None
+
+    return User(
+        user_id=user["id"],
+        name=user["name"],
+        role=user["role"],
+        time_remaining=(user["auto_logout_time"] - int(now)) // 60,
+        active_challenge=user["active_challenge"],
+    )
@@ -5,16 +5,20 @@ import os
 from apscheduler.schedulers.background import BackgroundScheduler
 from dotenv import load_dotenv
 from flask import Flask
-from flask_bcrypt import Bcrypt
 from flask_login import LoginManager
 
-from admin.users import load_user, ROLE_ADMIN
+from admin import passwords
+from admin.users import load_user, auto_logout_changed, ROLE_ADMIN
 from admin.routes import admin_bp
-from challenges.routes import challenges_bp
+from challenges.routes import challenges_bp, AVAILABLE_CHALLENGES
+from challenges import admission, capacity, images, pool, throttle
+from challenges.ports import PORTS
+from challenges.idle import check_job, IDLE_CHECK_INTERVAL
+from challenges.reconcile import reconcile, reconcile_job, RECONCILE_INTERVAL
 from leaderboard.routes import leaderboard_bp
 import db
 from main.routes import main_bp
-from scheduler import cleanup
+from scheduler import cleanup, cleanup_job, DEADLINES, SAFETY_INTERVAL
 
 
 def create_app():
@@ -27,8 +31,10 @@ def create_app():
     app = Flask(__name__)
     app.secret_key = os.getenv("SECRET_KEY")
 
-    # set up Flask-Bcrypt
-    bcrypt = Bcrypt(app)
+    # set the bcrypt work factor, existing hashes are upgraded when users log in
+    app.config["BCRYPT_LOG_ROUNDS"] = int(
+        os.getenv("BCRYPT_LOG_ROUNDS", str(passwords.DEFAULT_LOG_ROUNDS))
+    )
 
     # set up Flask-Login
     login_manager = LoginManager()
@@ -36,10 +42,15 @@ def create_app():
     login_manager.user_loader(load_user)
     login_manager.login_view = "admin.login"
 
+    # forget cached users when their logout time changes
+    db.on_auto_logout_change(auto_logout_changed)
+
+    # set up the DB
+    db.init_app(app)
+
     # create the DB if it isn't there
-    db_file = os.getenv("DB_FILE")
+    db_file = app.config["DB_FILE"]
     with app.app_context():
-        app.config['DB_FILE'] = db_file
         if not os.path.isfile(db_file):
             print(f"{db_file} not found, initializing a new database")
             db_conn = db.get_connection()
@@ -48,22 +59,51 @@ def create_app():
             db.add_user(
                 db_conn,
                 "admin",
-                bcrypt.generate_password_hash(os.getenv("DEFAULT_ADMIN_PASSWORD")).decode(
-                    "utf-8"
-                ),
+                passwords.generate_hash(os.getenv("DEFAULT_ADMIN_PASSWORD")),
                 ROLE_ADMIN,
             )
             db_conn.commit()
-            db_conn.close()
+
+        # bring an existing DB up to date
+        db.migrate(db.get_connection())
+
+        # pick up the host ports that running challenges already have
+        PORTS.load(app)
 
         # run cleanup immediately incase users have expired since we shutdown
         cleanup()
 
-    # schedule cleanup() to run every minute
+        # and clean up after anything that was left running by a crash
+        reconcile(startup=True)
+
+    # run cleanup() as each user's time runs out
+    DEADLINES.start(app)
+
+    # and every so often as a safety net
     scheduler = BackgroundScheduler()
-    scheduler.add_job(func=cleanup, trigger="interval", seconds=60)
+    scheduler.add_job(
+        func=cleanup_job, args=[app], trigger="interval", seconds=SAFETY_INTERVAL
+    )
+    scheduler.add_job(
+        func=reconcile_job, args=[app], trigger="interval", seconds=RECONCILE_INTERVAL
+    )
+    scheduler.add_job(
+        func=check_job, args=[app], trigger="interval", seconds=IDLE_CHECK_INTERVAL
+    )
     scheduler.start()
 
+    # check the images challenges need and build any that are missing
+    images.configure(AVAILABLE_CHALLENGES)
+
+    # record what challenges' environments need before anything is started
+    capacity.configure(AVAILABLE_CHALLENGES)
+    throttle.configure(AVAILABLE_CHALLENGES)
+
+    # start warm pools for any challenges that want them
+    for challenge in AVAILABLE_CHALLENGES:
+        pool.configure(app, challenge)
+    admission.configure(app, AVAILABLE_CHALLENGES)
+
     app.register_blueprint(main_bp)
     app.register_blueprint(admin_bp)
     app.register_blueprint(challenges_bp)
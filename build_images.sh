@@ -1,6 +1,5 @@
 #!/bin/sh
 
-docker build -t challenge2 challenges/challenge2/
-docker build -t wg_vpn challenges/challenge3/wg_vpn/
-docker build -t dr_sneaky challenges/challenge3/dr_sneaky/
-docker build -t challenge5 challenges/challenge5
+# The range checks the images its challenges need when it starts and builds any
+# that are missing or out of date, this does the same ahead of time
+python -m challenges.images
@@ -0,0 +1,166 @@
+"""Admission control for challenges that run environments. A challenge module
+that sets MAX_ACTIVE can only have that many users starting or running it, and
+all of them together are held to MAX_ACTIVE_CHALLENGES. Challenges with
+resource requests also have to fit in what's left of the range's capacity, see
+challenges/capacity.py. Users that don't fit wait in a FIFO queue and are
+started automatically when a slot frees up."""
+
+import collections
+import math
+import os
+import threading
+import traceback
+
+import db
+from challenges import capacity, provision
+
+MAX_ACTIVE_CHALLENGES = int(os.getenv("MAX_ACTIVE_CHALLENGES", "100"))
+DEFAULT_EXPECTED_MINUTES = 20  # how long a user usually keeps a challenge
+CHECK_INTERVAL = 5  # seconds between checks even if nobody calls released()
+
+Waiter = collections.namedtuple("Waiter", "challenge hostname")
+
+BUDGETS = {}  # MAX_ACTIVE keyed by challenge name
+
+_queue = collections.OrderedDict()  # Waiters keyed by user_id, oldest first
+_lock = threading.Lock()
+_wakeup = threading.Event()
+_thread = None
+_app = None  # the most recently configured app
+
+
+def configure(app, challenges):
+    """Records the budgets of a list of challenge modules and starts the thread
+    that admits queued users. Challenges with resource requests but no
+    MAX_ACTIVE are only limited by capacity."""
+
+    global _app, _thread
+    for challenge in challenges:
+        max_active = getattr(challenge, "MAX_ACTIVE", None)
+        if max_active is not None:
+            BUDGETS[challenge.NAME] = max_active
+        elif challenge.NAME in capacity.REQUESTS:
+            BUDGETS[challenge.NAME] = math.inf
+    _app = app
+    if _thread is None:
+        _thread = threading.Thread(target=run, daemon=True)
+        _thread.start()
+
+
+def fits(counts, name):
+    """Returns whether one more of a challenge fits in both budgets"""
+
+    total = sum(count for other, count in counts.items() if other in BUDGETS)
+    return counts.get(name, 0) < BUDGETS[name] and total < MAX_ACTIVE_CHALLENGES
+
+
+def request(app, conn, user_id, challenge, hostname):
+    """Starts a challenge for a user if there is room for it, otherwise puts
+    them in the queue. Returns None if it was started or their position in the
+    queue. Raises provision.QueueFull like provision.launch()."""
+
+    if challenge.NAME not in BUDGETS:
+        provision.launch(app, conn, user_id, challenge, hostname)
+        return None
+
+    with _lock:
+        if user_id not in _queue:
+            _queue[user_id] = Waiter(challenge, hostname)
+        admit(app, conn)
+        return position(user_id)
+
+
+def admit(app, conn):
+    """Starts queued users in order, skipping any whose challenge is still
+    full. Must be called with _lock held."""
+
+    counts = collections.Counter(db.count_active_challenges(conn))
+    for user_id, waiter in list(_queue.items()):
+        name = waiter.challenge.NAME
+        if not fits(counts, name) or not capacity.has_room(conn, name):
+            continue
+        del _queue[user_id]
+
+        # they were logged out or started something else while they waited
+        user = db.get_user_session(conn, user_id)
+        if not user or user["auto_logout_time"] is None or user["active_challenge"]:
+            continue
+
+        try:
+            provision.launch(app, conn, user_id, waiter.challenge, waiter.hostname)
+        except provision.QueueFull:
+            # the provisioning workers are swamped, keep their place
+            _queue[user_id] = waiter
+            _queue.move_to_end(user_id, last=False)
+            break
+        counts[name] += 1
+
+
+def position(user_id):
+    """Returns a user's 1-based place in the queue or None if they aren't in
+    it"""
+
+    for place, queued in enumerate(_queue, 1):
+        if queued == user_id:
+            return place
+    return None
+
+
+def status(user_id):
+    """Returns a dict with the challenge name, queue position and estimated
+    wait in minutes for a queued user, or None if they aren't queued"""
+
+    with _lock:
+        waiter = _queue.get(user_id)
+        if waiter is None:
+            return None
+        name = waiter.challenge.NAME
+        ahead = 0
+        for queued, other in _queue.items():
+            if queued == user_id:
+                break
+            if other.challenge.NAME == name:
+                ahead += 1
+        minutes = getattr(
+            waiter.challenge, "EXPECTED_MINUTES", DEFAULT_EXPECTED_MINUTES
+        )
+        return {
+            "name": name,
+            "position": position(user_id),
+            "wait": max(1, math.ceil((ahead + 1) / max(BUDGETS[name], 1))) * minutes,
+        }
+
+
+def queue_length():
+    """Returns how many users are waiting"""
+
+    return len(_queue)
+
+
+def leave(user_id):
+    """Takes a user out of the queue"""
+
+    with _lock:
+        _queue.pop(user_id, None)
+
+
+def released():
+    """Called when a challenge stops so queued users are admitted right away"""
+
+    _wakeup.set()
+
+
+def run():
+    """Runs forever in a background thread, admitting queued users whenever
+    something is released"""
+
+    while True:
+        _wakeup.wait(CHECK_INTERVAL)
+        _wakeup.clear()
+        if not _queue:
+            continue
+        try:
+            with _app.app_context(), _lock:
+                admit(_app, db.get_connection())
+        except Exception:  # pylint: disable=broad-exception-caught
+            traceback.print_exc()
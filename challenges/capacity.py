@@ -0,0 +1,147 @@
+"""Resource requests and limits for challenge environments. A challenge module
+can set:
+
+    CPU_LIMIT       CPUs one environment may use, ex: 0.5
+    MEMORY_LIMIT    MB of memory one environment may use
+    PIDS_LIMIT      processes one environment may run
+    CPU_REQUEST     CPUs one environment is expected to use (CPU_LIMIT if unset)
+    MEMORY_REQUEST  MB one environment is expected to use (MEMORY_LIMIT if unset)
+
+Limits are applied to single containers when they're created. Requests are
+what's counted against each Docker engine's capacity, CAPACITY_FRACTION of the
+CPUs and memory it reports, so challenges are only admitted and placed where
+they fit."""
+
+import collections
+import os
+import threading
+import traceback
+
+import db
+from challenges import docker_api, hosts
+
+CAPACITY_FRACTION = float(os.getenv("CAPACITY_FRACTION", "0.8"))
+
+Limits = collections.namedtuple("Limits", "cpus memory pids")
+Resources = collections.namedtuple("Resources", "cpus memory")
+
+NOTHING = Resources(0, 0)
+
+REQUESTS = {}  # Resources keyed by challenge name
+RESERVED = {}  # Resources keyed by challenge name, held by its warm pools per host
+LIMITS = {}  # Limits keyed by image
+
+_capacities = {}  # Resources keyed by host name
+_lock = threading.Lock()
+
+
+def limits(challenge):
+    """Returns the Limits a challenge module sets, or None if it sets none"""
+
+    result = Limits(
+        getattr(challenge, "CPU_LIMIT", None),
+        getattr(challenge, "MEMORY_LIMIT", None),
+        getattr(challenge, "PIDS_LIMIT", None),
+    )
+    return result if any(value is not None for value in result) else None
+
+
+def requests(challenge):
+    """Returns the Resources one environment of a challenge is expected to use"""
+
+    return Resources(
+        getattr(challenge, "CPU_REQUEST", getattr(challenge, "CPU_LIMIT", 0)),
+        getattr(challenge, "MEMORY_REQUEST", getattr(challenge, "MEMORY_LIMIT", 0)),
+    )
+
+
+def configure(challenges):
+    """Records the requests and limits of a list of challenge modules"""
+
+    for challenge in challenges:
+        # limits apply even when nothing is counted against capacity
+        if hasattr(challenge, "IMAGE"):
+            LIMITS[challenge.IMAGE] = limits(challenge)
+        request = requests(challenge)
+        if request == NOTHING:
+            continue
+        REQUESTS[challenge.NAME] = request
+        size = getattr(challenge, "POOL_SIZE", 0)
+        RESERVED[challenge.NAME] = Resources(request.cpus * size, request.memory * size)
+
+
+def capacity(host):
+    """Returns the Resources of a host that challenges may use, or None if the
+    host can't be reached to ask"""
+
+    with _lock:
+        if host.name in _capacities:
+            return _capacities[host.name]
+    try:
+        info = host.client.info()
+    except (OSError, docker_api.DockerError):
+        traceback.print_exc()
+        return None
+    result = Resources(
+        info["NCPU"] * CAPACITY_FRACTION,
+        info["MemTotal"] / 2**20 * CAPACITY_FRACTION,
+    )
+    with _lock:
+        _capacities[host.name] = result
+    return result
+
+
+def usage(conn):
+    """Returns a dict of host name to the Resources its challenges and warm
+    pools are expected to use. Challenges that haven't been placed yet are
+    under None."""
+
+    result = collections.defaultdict(lambda: NOTHING)
+    for host in hosts.HOSTS:
+        for reserved in RESERVED.values():
+            result[host.name] = add(result[host.name], reserved)
+    for (host, name), count in db.count_placed_by_name(conn).items():
+        request = REQUESTS.get(name, NOTHING)
+        held = Resources(request.cpus * count, request.memory * count)
+        result[host] = add(result[host], held)
+    return result
+
+
+def add(first, second):
+    """Adds two Resources"""
+
+    return Resources(first.cpus + second.cpus, first.memory + second.memory)
+
+
+def fits(used, request, available):
+    """Returns whether a request fits next to what's used"""
+
+    if available is None:
+        return False
+    return (
+        used.cpus + request.cpus <= available.cpus
+        and used.memory + request.memory <= available.memory
+    )
+
+
+def has_room(conn, name, host=None):
+    """Returns whether one more environment of a challenge fits on a host, or
+    on the range as a whole if host is None"""
+
+    request = REQUESTS.get(name)
+    if request is None:
+        return True
+    used = usage(conn)
+
+    if host is not None:
+        return fits(used[host.name], request, capacity(host))
+
+    total = NOTHING
+    for candidate in hosts.HOSTS:
+        available = capacity(candidate)
+        if available is not None:
+            total = add(total, available)
+    used_total = NOTHING
+    for resources in used.values():
+        used_total = add(used_total, resources)
+    return fits(used_total, request, total)
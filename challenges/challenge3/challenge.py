@@ -1,22 +1,42 @@
 """A simple challenge endpoint that just uses an HTML template"""
 
-from flask import render_template
-
-from challenges import docker
+from challenges import docker, pool, prompts
 
 # Every challenge needs a unique NAME, FLAG, and DESCRIPTION
 NAME         = "Challenge 3"
 FLAG         = "WALLABY"
 DESCRIPTION  = "Oh boy, here comes a whole network with multiple hosts"
 
+# Keep POOL_SIZE compose environments from COMPOSE_DIR brought up ahead of time
+COMPOSE_DIR  = "challenges/challenge3"
+POOL_SIZE    = 2
+
+# The images the compose file uses and their build contexts
+IMAGES       = {
+    "wg_vpn": "challenges/challenge3/wg_vpn",
+    "dr_sneaky": "challenges/challenge3/dr_sneaky",
+}
+
+# Each environment is a whole network, so fewer of them can run at once
+MAX_ACTIVE   = 10
+
+# The limits for each service are in docker-compose.yml, this is what a whole
+# environment is expected to use (see challenges/capacity.py)
+CPU_REQUEST  = 0.1
+MEMORY_REQUEST = 64
+
 def start(conn, user_id, hostname):
     """The start function gets conn, user_id, hostname, and url and should
-    return the HTML prompt for the challenge, a command to run to end the
-    challenge, and the directory in which to run the command. This function
-    must run any containers and do any configuration required."""
+    return the prompt for the challenge (made with prompts.prompt()), a
+    command to run to end the challenge, and the directory in which to run
+    the command. This function must run any containers and do any
+    configuration required."""
 
-    cwd = "challenges/challenge3"
-    client_config, end_cmd = docker.compose_up_with_vpn(cwd, hostname)
-    prompt = render_template("challenge3.html", wgconf=client_config)
+    cwd = COMPOSE_DIR
+    port, client_config, end_cmd = pool.claim_env(
+        conn, NAME, cwd, docker.make_labels(NAME, user_id)
+    )
+    client_config = docker.add_endpoint(client_config, hostname, port)
+    prompt = prompts.prompt("challenge3.html", wgconf=client_config)
 
     return (prompt, end_cmd, cwd)
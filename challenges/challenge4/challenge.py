@@ -1,19 +1,23 @@
 """Another simple template challenge"""
 
-from flask import render_template
+from challenges import prompts
 
 # Every challenge needs a unique NAME, FLAG, and DESCRIPTION
 NAME         = "Challenge 4"
 FLAG         = "DomoArigatoMrRoboto"
 DESCRIPTION  = "Another HTML/JS challenge"
 
+# The prompt is the same for everyone so it's only rendered once
+STATIC       = True
+
 def start(conn, user_id, hostname):
     """The start function gets conn, user_id, hostname, and url and should
-    return the HTML prompt for the challenge, a command to run to end the
-    challenge, and the directory in which to run the command. This function
-    must run any containers and do any configuration required."""
+    return the prompt for the challenge (made with prompts.prompt()), a
+    command to run to end the challenge, and the directory in which to run
+    the command. This function must run any containers and do any
+    configuration required."""
 
-    prompt = render_template("challenge4.html")
+    prompt = prompts.prompt("challenge4.html")
     end_cmd = None
     cwd = None
 
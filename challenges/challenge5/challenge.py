@@ -1,22 +1,40 @@
 """Single container challenge involving a .htaccess file"""
 
-from flask import render_template
-
-from challenges import docker
+from challenges import docker, pool, prompts
 
 # Every challenge needs a unique NAME, FLAG, and DESCRIPTION
 NAME         = "Challenge 5"
 FLAG         = "RedTeamRewriteRule"
 DESCRIPTION  = "Client-side Security?"
 
+# Image to run and its warm pool settings (see challenges/pool.py)
+IMAGE        = "challenge5"
+PORT         = 80
+POOL_SIZE    = 2
+POOL_MAX_AGE = 30 * 60
+POOL_EVICT_INTERVAL = 60
+
+# At most MAX_ACTIVE students can have this running, the rest wait in line
+MAX_ACTIVE   = 40
+
+# Each container may use up to CPU_LIMIT CPUs, MEMORY_LIMIT MB and PIDS_LIMIT
+# processes but usually needs far less, CPU_REQUEST and MEMORY_REQUEST are
+# what's counted against a host's capacity (see challenges/capacity.py)
+CPU_LIMIT    = 0.5
+MEMORY_LIMIT = 128
+PIDS_LIMIT   = 128
+CPU_REQUEST  = 0.05
+MEMORY_REQUEST = 32
+
 def start(conn, user_id, hostname):
     """The start function gets conn, user_id, hostname, and url and should
-    return the HTML prompt for the challenge, a command to run to end the
-    challenge, and the directory in which to run the command. This function
-    must run any containers and do any configuration required."""
+    return the prompt for the challenge (made with prompts.prompt()), a
+    command to run to end the challenge, and the directory in which to run
+    the command. This function must run any containers and do any
+    configuration required."""
 
-    port, end_cmd = docker.run_with_port("challenge5", 80)
-    prompt = render_template("challenge5.html", hostname=hostname, port=port)
+    port, end_cmd = pool.run_with_port(IMAGE, PORT, docker.make_labels(NAME, user_id))
+    prompt = prompts.prompt("challenge5.html", hostname=hostname, port=port)
     cwd = None
 
     return (prompt, end_cmd, cwd)
@@ -1,99 +1,233 @@
 """Functions for running/managing Docker containers"""
 
+import os
+import shlex
 import subprocess
-import re
 import uuid
 
-PROCESS_TIMEOUT = 30
-
-
-def get_port(container_id):
-    """Uses the docker command to get the external port for a container
-
-    We rely on it being randomly assigned so we can run multiple containers
-    and have each use a different port."""
-
-    # get the random port assigned to the container
-    port_process = subprocess.run(
-        ["docker", "port", container_id],
-        check=True,
-        capture_output=True,
-        text=True,
-        timeout=PROCESS_TIMEOUT,
-    )
-    # we may get a line for IPv4 and IPv6, we only need one of them
-    first_line = port_process.stdout.partition("\n")[0]
-    # match everything after the last :
-    result = re.search("^.*:(.*)$", first_line)
-    port = result.group(1)
-
-    return port
+from challenges import docker_api, hosts
+from metrics import DOCKER_COMMAND
+from challenges.ports import PORTS, NoFreePorts
 
+PROCESS_TIMEOUT = 30
 
-def run_with_port(image, container_port):
-    """Starts a single container, returning its port and end_cmd"""
-
-    run_process = subprocess.run(
-        ["docker", "run", "--pull", "never", "-d", "-p", str(container_port), image],
-        check=True,
-        capture_output=True,
-        text=True,
-        timeout=PROCESS_TIMEOUT,
-    )
-    container_id = run_process.stdout[:12]
-
-    # get the random port assigned to the container
-    port = get_port(container_id)
-
-    end_cmd = f"docker stop {container_id}"
+# every container we start is labelled with the range it belongs to, so
+# several ranges can share a Docker host
+INSTANCE = os.getenv("RANGE_INSTANCE", "default")
+LABEL_INSTANCE = "cyber_range.instance"
+LABEL_CHALLENGE = "cyber_range.challenge"
+LABEL_USER_ID = "cyber_range.user_id"
+
+# everything that can go wrong talking to Docker
+ERRORS = (subprocess.SubprocessError, OSError, docker_api.DockerError, NoFreePorts)
+
+
+def command_name(args):
+    """Names a docker CLI command for metrics by its subcommands, leaving out
+    options and project names, ex: compose up"""
+
+    words = []
+    skip = False
+    for arg in args[1:]:
+        if skip:
+            skip = False
+        elif arg in ("-p", "--project-name", "-f", "--file"):
+            skip = True
+        elif not arg.startswith("-"):
+            words.append(arg)
+    return " ".join(words[:2])
+
+
+def run(args, **kwargs):
+    """subprocess.run() for docker CLI commands, timed in DOCKER_COMMAND"""
+
+    with DOCKER_COMMAND.time(command_name(args)):
+        return subprocess.run(args, **kwargs)  # pylint: disable=subprocess-run-check
+
+
+def make_labels(challenge=None, user_id=None):
+    """Makes the labels for a container or compose project. Warm containers
+    are started before anyone owns them, so they only have a challenge."""
+
+    result = {LABEL_INSTANCE: INSTANCE}
+    if challenge is not None:
+        result[LABEL_CHALLENGE] = challenge
+    if user_id is not None:
+        result[LABEL_USER_ID] = str(user_id)
+    return result
+
+
+def owner(end_cmd):
+    """Returns the container or compose project an end_cmd stops, or None if it
+    isn't one we know how to read"""
+
+    args = shlex.split(end_cmd)
+    if args[:2] == ["docker", "stop"] and len(args) == 3:
+        return args[2]
+    if args[:3] == ["docker", "compose", "-p"] and len(args) > 3:
+        return args[3]
+    return None
+
+
+def run_with_port(image, container_port, labels=None, host=None, limits=None):
+    """Starts a single container on a port from the port allocator, returning
+    the port and end_cmd. It runs on host, or the one from hosts.using(), with
+    the resource limits in limits."""
+
+    name = "range-" + uuid.uuid4().hex[:12]
+    port = PORTS.allocate(name)
+    client = (host or hosts.current()).client
+    try:
+        client.create_container(
+            image,
+            ports={container_port: port},
+            name=name,
+            labels=labels or make_labels(),
+            limits=limits,
+        )
+    except ERRORS:
+        PORTS.release(name)
+        raise
+    try:
+        client.start_container(name)
+    except ERRORS:
+        PORTS.release(name)
+        # don't leave a half started container behind, if this fails too the
+        # reconciler removes it
+        try:
+            client.remove_container(name, force=True)
+        except ERRORS:
+            pass
+        raise
+
+    end_cmd = f"docker stop {name}"
 
     return (port, end_cmd)
 
 
-def compose_up_with_vpn(directory, hostname):
-    """Runs docker compose up in a particular directory and returns the
-    WireGuard config needed to connect to a VPN service in the environment
-    and an end_cmd. Hostname is required for the config."""
+def compose_up_vpn(directory, labels=None, host=None):
+    """Runs docker compose up in a particular directory and returns the port
+    of the VPN service, the WireGuard config needed to connect to it (without
+    an Endpoint) and an end_cmd. Labels are passed to the compose file as
+    environment variables, cyber_range.instance becomes
+    CYBER_RANGE_INSTANCE. It runs on host, or the one from hosts.using()."""
+
+    host = host or hosts.current()
 
     # you can start multiple docker compose envs in the same directory by using
     # a unique prefix for each
     prefix = uuid.uuid4().hex[:12]
 
-    # bring the whole thing up
-    subprocess.run(
-        ["docker", "compose", "-p", prefix, "up", "-d"],
-        check=True,
-        timeout=PROCESS_TIMEOUT,
-        cwd=directory,
-    )
-
-    # figure out what port was allocated to the service
-    container_id = prefix + "-vpn-1"
-    port = get_port(container_id)
-
-    # grab the generated wireguard config for the client from the container
-    # logs (stdout)
-    log_process = subprocess.run(
-        ["docker", "logs", container_id],
-        capture_output=True,
-        check=True,
-        text=True,
-        timeout=PROCESS_TIMEOUT,
-    )
+    # bring the whole thing up with the VPN on a port from the allocator,
+    # the compose file publishes it as ${VPN_PORT}
+    port = PORTS.allocate(prefix)
+    env = dict(host.env(), VPN_PORT=str(port))
+    for label, value in (labels or make_labels()).items():
+        env[label.replace(".", "_").upper()] = value
+    try:
+        run(
+            ["docker", "compose", "-p", prefix, "up", "-d"],
+            check=True,
+            timeout=PROCESS_TIMEOUT,
+            cwd=directory,
+            env=env,
+        )
+        # grab the generated wireguard config for the client from the
+        # container logs (stdout)
+        logs = host.client.logs(prefix + "-vpn-1")
+    except ERRORS:
+        PORTS.release(prefix)
+        # don't leave part of the environment behind
+        try:
+            run(
+                ["docker", "compose", "-p", prefix, "down"],
+                check=False,
+                timeout=PROCESS_TIMEOUT,
+                cwd=directory,
+                env=env,
+            )
+        except ERRORS:
+            pass
+        raise
+
     # grab all the lines between <ClientConfig> and </ClientConfig>
     client_config = ""
     in_config = False
-    for line in log_process.stdout.splitlines():
+    for line in logs.splitlines():
         if line == "<ClientConfig>":
             in_config = True
         elif line == "</ClientConfig>":
             break
         elif in_config:
             client_config += line + "\n"
-    # add the endpoint on the config
-    # (requires a port num and IP which the container doesn't have)
-    client_config += f"Endpoint = {hostname}:{port}"
 
     end_cmd = f"docker compose -p {prefix} down"
 
-    return (client_config, end_cmd)
+    return (port, client_config, end_cmd)
+
+
+def add_endpoint(client_config, hostname, port):
+    """Adds the endpoint to a WireGuard client config (requires a port num and
+    IP which the container doesn't have)"""
+
+    return client_config + f"Endpoint = {hostname}:{port}"
+
+
+def compose_up_with_vpn(directory, hostname, labels=None, host=None):
+    """Runs docker compose up in a particular directory and returns the
+    WireGuard config needed to connect to a VPN service in the environment
+    and an end_cmd. Hostname is required for the config."""
+
+    port, client_config, end_cmd = compose_up_vpn(directory, labels, host)
+
+    return (add_endpoint(client_config, hostname, port), end_cmd)
+
+
+def set_paused(end_cmd, cwd, paused, host=None):
+    """Pauses or unpauses what an end_cmd would stop. A single container goes
+    through the Docker API and a compose project through docker compose. It
+    isn't an error if it's already in that state."""
+
+    host = host or hosts.current()
+    args = shlex.split(end_cmd)
+    if args[:2] == ["docker", "stop"] and len(args) == 3:
+        try:
+            if paused:
+                host.client.pause_container(args[2])
+            else:
+                host.client.unpause_container(args[2])
+        except docker_api.DockerError as error:
+            if error.status != 409:  # already paused or not paused
+                raise
+    elif args[:3] == ["docker", "compose", "-p"] and len(args) > 3:
+        run(
+            ["docker", "compose", "-p", args[3], "pause" if paused else "unpause"],
+            cwd=cwd,
+            timeout=PROCESS_TIMEOUT,
+            check=True,
+            env=host.env(),
+        )
+
+
+def end(end_cmd, cwd, host=None):
+    """Runs an end_cmd from the challenges table on the engine it was started
+    on. Stopping a single container goes through the Docker API (and removes
+    it), anything else is run as a command without a shell. Either way the
+    ports it used are freed."""
+
+    host = host or hosts.current()
+    args = shlex.split(end_cmd)
+    if args[:2] == ["docker", "stop"] and len(args) == 3:
+        client = host.client
+        try:
+            client.stop_container(args[2])
+            client.remove_container(args[2])
+        except docker_api.DockerError as error:
+            if error.status != 404:  # it's already gone
+                raise
+    else:
+        run(args, cwd=cwd, timeout=PROCESS_TIMEOUT, check=True, env=host.env())
+
+    name = owner(end_cmd)
+    if name:
+        PORTS.release(name)
@@ -0,0 +1,306 @@
+"""A small client for the Docker Engine API. It speaks HTTP directly to the
+Docker daemon's socket and keeps a pool of persistent connections, so managing
+containers doesn't cost a fork and exec of the docker CLI each time."""
+
+import http.client
+import json
+import os
+import queue
+import re
+import socket
+import struct
+import threading
+from urllib.parse import urlencode, urlparse
+
+from metrics import DOCKER_API
+
+API_VERSION = "v1.41"
+DEFAULT_HOST = "unix:///var/run/docker.sock"
+TIMEOUT = 30
+POOL_SIZE = 8  # idle connections kept open per client
+
+_client = None
+_client_lock = threading.Lock()
+
+
+class DockerError(Exception):
+    """Raised when the Docker Engine API returns an error status"""
+
+    def __init__(self, status, message):
+        super().__init__(f"{status}: {message}")
+        self.status = status
+        self.message = message
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """An HTTPConnection that connects to a unix socket instead of TCP"""
+
+    def __init__(self, socket_path, timeout=TIMEOUT):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self.socket_path)
+        self.sock = sock
+
+
+class Client:
+    """A thread safe Docker Engine API client. base_url is in the same format
+    as DOCKER_HOST, ex: unix:///var/run/docker.sock or tcp://10.0.0.2:2375"""
+
+    def __init__(self, base_url=DEFAULT_HOST, pool_size=POOL_SIZE, timeout=TIMEOUT):
+        url = urlparse(base_url)
+        if url.scheme == "unix":
+            self.socket_path = url.path
+            self.address = None
+        elif url.scheme in ("tcp", "http"):
+            self.socket_path = None
+            self.address = (url.hostname, url.port or 2375)
+        else:
+            raise ValueError(f"Unsupported Docker host: {base_url}")
+        self.base_url = base_url
+        self.timeout = timeout
+        self.idle = queue.LifoQueue(maxsize=pool_size)
+
+    def _connect(self):
+        """Opens a new connection to the daemon"""
+
+        if self.socket_path:
+            return UnixHTTPConnection(self.socket_path, timeout=self.timeout)
+        host, port = self.address
+        return http.client.HTTPConnection(host, port, timeout=self.timeout)
+
+    def _release(self, conn):
+        """Returns a connection to the idle pool, closing it if the pool is
+        full"""
+
+        try:
+            self.idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def close(self):
+        """Closes all idle connections"""
+
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+    def request(self, method, path, query=None, body=None):
+        """Makes an API request and returns the response status and body.
+        Raises DockerError for error statuses."""
+
+        with DOCKER_API.time(method, endpoint(path)):
+            return self._request(method, path, query, body)
+
+    def _request(self, method, path, query, body):
+        """Does the work for request()"""
+
+        url = f"/{API_VERSION}{path}"
+        if query:
+            url += "?" + urlencode(query)
+        headers = {}
+        payload = None
+        if body is not None:
+            payload = json.dumps(body).encode("utf-8")
+            headers["Content-Type"] = "application/json"
+
+        # an idle connection may have been closed by the daemon since we last
+        # used it, in which case we retry once on a new connection
+        try:
+            conn = self.idle.get_nowait()
+            reused = True
+        except queue.Empty:
+            conn = self._connect()
+            reused = False
+
+        while True:
+            try:
+                conn.request(method, url, body=payload, headers=headers)
+                response = conn.getresponse()
+                data = response.read()
+                break
+            except (http.client.HTTPException, OSError):
+                conn.close()
+                if not reused:
+                    raise
+                conn = self._connect()
+                reused = False
+
+        if response.will_close:
+            conn.close()
+        else:
+            self._release(conn)
+
+        if response.status >= 400:
+            try:
+                message = json.loads(data)["message"]
+            except (ValueError, KeyError, TypeError):
+                message = data.decode("utf-8", "replace")
+            raise DockerError(response.status, message)
+
+        return response.status, data
+
+    def get_json(self, path, query=None):
+        """Makes a GET request and decodes the JSON response"""
+
+        _, data = self.request("GET", path, query=query)
+        return json.loads(data)
+
+    def create_container(self, image, ports=(), name=None, labels=None, limits=None):
+        """Creates a container for a local image, publishing each container
+        port (ex: 80 or "51820/udp") on a random host port. ports can also be a
+        dict of container port to host port. limits is a capacity.Limits of
+        CPUs, MB of memory and processes. Returns the container id."""
+
+        if not isinstance(ports, dict):
+            ports = dict.fromkeys(ports, "")
+
+        exposed = {}
+        bindings = {}
+        for port, host_port in ports.items():
+            port = str(port)
+            if "/" not in port:
+                port += "/tcp"
+            exposed[port] = {}
+            bindings[port] = [{"HostPort": str(host_port)}]
+
+        host_config = {"PortBindings": bindings}
+        if limits:
+            if limits.cpus:
+                host_config["NanoCpus"] = int(limits.cpus * 1e9)
+            if limits.memory:
+                host_config["Memory"] = int(limits.memory * 2**20)
+            if limits.pids:
+                host_config["PidsLimit"] = limits.pids
+
+        body = {
+            "Image": image,
+            "ExposedPorts": exposed,
+            "Labels": labels or {},
+            "HostConfig": host_config,
+        }
+        query = {"name": name} if name else None
+        _, data = self.request("POST", "/containers/create", query=query, body=body)
+        return json.loads(data)["Id"]
+
+    def list_containers(self):
+        """Returns a summary (Id, Names, Labels, Created, State) of every
+        container, running or not"""
+
+        return self.get_json("/containers/json", query={"all": 1})
+
+    def info(self):
+        """Returns system information about the daemon, including its NCPU
+        and MemTotal"""
+
+        return self.get_json("/info")
+
+    def list_images(self):
+        """Returns a summary (Id, RepoTags, Labels, Created) of every local
+        image"""
+
+        return self.get_json("/images/json")
+
+    def start_container(self, container_id):
+        """Starts a created container"""
+
+        self.request("POST", f"/containers/{container_id}/start")
+
+    def inspect_container(self, container_id):
+        """Returns the low level information about a container"""
+
+        return self.get_json(f"/containers/{container_id}/json")
+
+    def get_ports(self, container_id):
+        """Returns a dict mapping container ports (ex: "80/tcp") to the host
+        port they are published on"""
+
+        info = self.inspect_container(container_id)
+        ports = {}
+        for port, bindings in (info["NetworkSettings"]["Ports"] or {}).items():
+            # we may get a binding for IPv4 and IPv6, we only need one of them
+            if bindings:
+                ports[port] = bindings[0]["HostPort"]
+        return ports
+
+    def logs(self, container_id):
+        """Returns the stdout of a container as text"""
+
+        _, data = self.request(
+            "GET", f"/containers/{container_id}/logs", query={"stdout": 1}
+        )
+        return demultiplex(data).decode("utf-8", "replace")
+
+    def pause_container(self, container_id):
+        """Freezes every process in a container"""
+
+        self.request("POST", f"/containers/{container_id}/pause")
+
+    def unpause_container(self, container_id):
+        """Thaws a paused container"""
+
+        self.request("POST", f"/containers/{container_id}/unpause")
+
+    def traffic(self, container_id):
+        """Returns the total bytes a container has received and sent on all of
+        its networks"""
+
+        stats = self.get_json(
+            f"/containers/{container_id}/stats",
+            query={"stream": "false", "one-shot": "true"},
+        )
+        return sum(
+            network["rx_bytes"] + network["tx_bytes"]
+            for network in (stats.get("networks") or {}).values()
+        )
+
+    def stop_container(self, container_id, timeout=None):
+        """Stops a container, it is not an error if it is already stopped"""
+
+        query = {"t": timeout} if timeout is not None else None
+        self.request("POST", f"/containers/{container_id}/stop", query=query)
+
+    def remove_container(self, container_id, force=False):
+        """Removes a container"""
+
+        query = {"force": 1} if force else None
+        self.request("DELETE", f"/containers/{container_id}", query=query)
+
+
+def endpoint(path):
+    """Replaces the container in a path with {id} so it can be used as a
+    metric label, ex: /containers/{id}/start"""
+
+    return re.sub(r"^/containers/(?!create$|json$)[^/]+", "/containers/{id}", path)
+
+
+def demultiplex(data):
+    """Strips the stream headers from the logs of a container that wasn't
+    started with a TTY. Each frame is a one byte stream type, three bytes of
+    padding, a four byte big endian length and then the payload."""
+
+    if len(data) < 8 or data[0] not in (0, 1, 2) or data[1:4] != b"\x00\x00\x00":
+        return data  # TTY containers return raw output
+
+    output = bytearray()
+    offset = 0
+    while offset + 8 <= len(data):
+        _, length = struct.unpack(">BxxxL", data[offset : offset + 8])
+        output += data[offset + 8 : offset + 8 + length]
+        offset += 8 + length
+    return bytes(output)
+
+
+def get_client():
+    """Returns the shared client for the daemon in DOCKER_HOST"""
+
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = Client(os.getenv("DOCKER_HOST", DEFAULT_HOST))
+        return _client
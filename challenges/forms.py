@@ -9,3 +9,9 @@ class ChallengeForm(FlaskForm):
     flag = StringField("Flag")
     capture = SubmitField("Capture")
     stop = SubmitField("Stop this Challenge")
+
+
+class QueueForm(FlaskForm):
+    """Form for leaving the queue for a challenge"""
+
+    leave = SubmitField("Leave the Queue")
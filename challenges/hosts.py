@@ -0,0 +1,123 @@
+"""The Docker engines challenge environments run on. DOCKER_HOSTS lists them as
+comma separated name=url pairs, where name is the hostname students use to
+reach that engine's published ports and url is in the same format as
+DOCKER_HOST, ex:
+
+    DOCKER_HOSTS=range1.example.edu=tcp://10.0.0.11:2375,range2.example.edu=tcp://10.0.0.12:2375
+
+Without it everything runs on the engine in DOCKER_HOST. Each challenge is
+placed on the least loaded engine when it starts and the engine's name is
+recorded in its challenges row so it's torn down in the same place."""
+
+import os
+import threading
+from contextlib import contextmanager
+
+import db
+from challenges import docker_api
+
+LOCAL = "local"  # the name of the DOCKER_HOST engine when there's no DOCKER_HOSTS
+
+
+class NoHost(Exception):
+    """Raised when there's no engine a challenge can be placed on"""
+
+
+class Host:
+    """A Docker engine. public is the hostname students connect to, None if
+    it's the same one they reach the range on. url is None for DOCKER_HOST."""
+
+    def __init__(self, name, url=None, public=None):
+        self.name = name
+        self.url = url
+        self.public = public
+        self._client = None
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f"<Host {self.name}>"
+
+    @property
+    def client(self):
+        """The Docker Engine API client for this engine"""
+
+        if self.url is None:
+            return docker_api.get_client()
+        with self._lock:
+            if self._client is None:
+                self._client = docker_api.Client(self.url)
+            return self._client
+
+    def env(self):
+        """Environment variables that point the docker CLI at this engine"""
+
+        if self.url is None:
+            return dict(os.environ)
+        return dict(os.environ, DOCKER_HOST=self.url)
+
+
+def parse(spec):
+    """Parses a DOCKER_HOSTS value into a list of Hosts"""
+
+    if not spec:
+        return [Host(LOCAL)]
+    result = []
+    for entry in spec.split(","):
+        name, _, url = entry.strip().partition("=")
+        if not name or not url:
+            raise ValueError(f"DOCKER_HOSTS entries are name=url, not {entry!r}")
+        result.append(Host(name, url, name))
+    return result
+
+
+HOSTS = parse(os.getenv("DOCKER_HOSTS"))
+
+_current = threading.local()
+_place_lock = threading.Lock()
+
+
+def get(name):
+    """Returns a Host by name. Rows from before there were several engines (or
+    from an engine that's been removed) go to the first one."""
+
+    for host in HOSTS:
+        if host.name == name:
+            return host
+    return HOSTS[0]
+
+
+def current():
+    """Returns the Host that the challenge being started was placed on, the
+    first one outside of using()"""
+
+    return getattr(_current, "host", None) or HOSTS[0]
+
+
+@contextmanager
+def using(host):
+    """Makes docker calls in the body of a with statement go to a host"""
+
+    previous = getattr(_current, "host", None)
+    _current.host = host
+    try:
+        yield host
+    finally:
+        _current.host = previous
+
+
+def place(conn, challenge_id, candidates, has_room):
+    """Records the least loaded of the candidate Hosts that has_room(host) for
+    it as the one a provisioning challenge runs on and returns it. Load is the
+    number of challenges each engine has starting or running."""
+
+    if not candidates:
+        raise NoHost("None of the range's Docker engines can run this challenge")
+    with _place_lock:
+        candidates = [candidate for candidate in candidates if has_room(candidate)]
+        if not candidates:
+            raise NoHost("None of the range's Docker engines has room for this right now")
+        load = db.count_placed_challenges(conn)
+        host = min(candidates, key=lambda candidate: load.get(candidate.name, 0))
+        db.set_challenge_host(conn, challenge_id, host.name)
+        conn.commit()
+    return host
@@ -0,0 +1,125 @@
+"""Pauses challenge environments nobody is using and resumes them when their
+student comes back. A challenge counts as used when its page is viewed or when
+its containers send or receive any traffic, which is how students actually
+work on them. Paused containers keep their state but use no CPU, and their
+memory can be swapped out."""
+
+import collections
+import os
+import threading
+import time
+import traceback
+
+import db
+from challenges import docker, hosts
+from challenges.reconcile import container_owner
+
+IDLE_MINUTES = int(os.getenv("IDLE_MINUTES", "15"))
+IDLE_CHECK_INTERVAL = 60  # seconds between checks for idle environments
+TOUCH_INTERVAL = 60  # seconds between recording page views of the same challenge
+
+_traffic = {}  # total bytes keyed by the owner from docker.owner()
+_lock = threading.Lock()  # so a visit can't be undone by a check in progress
+
+
+def containers_by_owner(host):
+    """Returns a dict of owner to the ids of its running containers on a host"""
+
+    result = collections.defaultdict(list)
+    for container in host.client.list_containers():
+        if container.get("State") == "running":
+            result[container_owner(container)].append(container["Id"])
+    return result
+
+
+def traffic(host, container_ids):
+    """Returns the total bytes a set of containers have sent and received"""
+
+    return sum(host.client.traffic(container_id) for container_id in container_ids)
+
+
+def check():
+    """Pauses every environment that has had no page views or traffic for
+    IDLE_MINUTES. Traffic since the last check counts as activity."""
+
+    conn = db.get_connection()
+    rows = db.get_running_envs(conn)
+    cutoff = time.time() - IDLE_MINUTES * 60
+
+    for host in hosts.HOSTS:
+        host_rows = [row for row in rows if hosts.get(row["host"]) is host]
+        if not host_rows:
+            continue
+        try:
+            owners = containers_by_owner(host)
+        except docker.ERRORS:
+            traceback.print_exc()
+            continue
+
+        for row in host_rows:
+            owner = docker.owner(row["end_cmd"])
+            try:
+                total = traffic(host, owners.get(owner, ()))
+            except docker.ERRORS:
+                traceback.print_exc()
+                continue
+            if _traffic.get(owner) != total or row["last_active"] is None:
+                _traffic[owner] = total
+                db.touch_challenge(conn, row["id"])
+            elif row["last_active"] < cutoff:
+                pause(conn, row, cutoff, host)
+            conn.commit()
+
+    # forget environments that are gone or paused
+    running = {docker.owner(row["end_cmd"]) for row in rows}
+    for owner in list(_traffic):
+        if owner not in running:
+            del _traffic[owner]
+
+
+def pause(conn, row, cutoff, host):
+    """Pauses a challenge's environment unless it was visited since row was
+    read"""
+
+    with _lock:
+        if not db.pause_challenge(conn, row["id"], cutoff):
+            return
+        conn.commit()
+        try:
+            docker.set_paused(row["end_cmd"], row["cwd"], True, host)
+        except docker.ERRORS:
+            traceback.print_exc()
+            db.set_paused(conn, row["id"], False)
+
+
+def check_job(app):
+    """Runs check() in an app context for the background scheduler"""
+
+    with app.app_context():
+        check()
+
+
+def visited(conn, challenge_row):
+    """Called when a student views their challenge. Resumes its environment if
+    it was paused and records the activity."""
+
+    if challenge_row["paused"]:
+        with _lock:
+            try:
+                docker.set_paused(
+                    challenge_row["end_cmd"],
+                    challenge_row["cwd"],
+                    False,
+                    hosts.get(challenge_row["host"]),
+                )
+            except docker.ERRORS:
+                traceback.print_exc()
+                return
+            db.set_paused(conn, challenge_row["id"], False)
+            db.touch_challenge(conn, challenge_row["id"])
+            conn.commit()
+        return
+    if (challenge_row["last_active"] or 0) > time.time() - TOUCH_INTERVAL:
+        return
+    db.touch_challenge(conn, challenge_row["id"])
+    conn.commit()
@@ -0,0 +1,228 @@
+"""Makes sure the Docker images challenges need are built before anyone can
+start them. Every image is checked with a single listing when the app starts.
+Images that are missing, or that were built from a different version of their
+build context, are rebuilt in parallel in the background. This is done on
+every Docker engine in hosts.HOSTS, and a challenge is only listed once all of
+its images are ready on at least one of them."""
+
+import hashlib
+import os
+import threading
+import time
+import traceback
+import sys
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from challenges import docker, hosts
+from challenges.registry import discover
+
+BUILD_WORKERS = int(os.getenv("BUILD_WORKERS", "4"))
+BUILD_IMAGES = os.getenv("BUILD_IMAGES", "1") != "0"  # 0 to only check images
+BUILD_TIMEOUT = 600
+RETRY_DELAY = 30  # seconds between checks while Docker can't be reached
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# images are labelled with a hash of what they were built from
+LABEL_CONTEXT = "cyber_range.context_hash"
+
+# image states
+STATE_UNKNOWN = "unknown"  # Docker hasn't been reachable yet
+STATE_MISSING = "missing"
+STATE_BUILDING = "building"
+STATE_READY = "ready"
+STATE_FAILED = "failed"
+
+CONTEXTS = {}  # build context directory keyed by image
+REQUIRED = {}  # image names keyed by challenge name
+
+_states = {}  # state keyed by (host name, image)
+_building = {}  # futures of builds in progress keyed by (host name, image)
+_lock = threading.Lock()
+_executor = ThreadPoolExecutor(max_workers=BUILD_WORKERS, thread_name_prefix="build")
+_thread = None
+
+
+def required_images(challenge):
+    """Returns a dict of image name to build context for a challenge. IMAGES
+    lists them with contexts relative to the top of the repo, otherwise a
+    challenge with an IMAGE is built from its own directory."""
+
+    images = getattr(challenge, "IMAGES", None)
+    if images is not None:
+        return {image: os.path.join(ROOT, context) for image, context in images.items()}
+    if hasattr(challenge, "IMAGE"):
+        return {challenge.IMAGE: challenge.directory}
+    return {}
+
+
+def context_hash(directory):
+    """Hashes the names and contents of every file in a build context"""
+
+    digest = hashlib.sha256()
+    for parent, dirs, files in os.walk(directory):
+        dirs.sort()
+        for name in sorted(files):
+            path = os.path.join(parent, name)
+            digest.update(os.path.relpath(path, directory).encode("utf-8") + b"\0")
+            with open(path, "rb") as file:
+                digest.update(hashlib.sha256(file.read()).digest())
+    return digest.hexdigest()
+
+
+def local_images(host):
+    """Returns a dict of image name to its labels on a host, from one listing.
+    Only the latest tag counts since that's what challenges run."""
+
+    result = {}
+    for image in host.client.list_images():
+        for tag in image.get("RepoTags") or ():
+            name, _, version = tag.rpartition(":")
+            if version == "latest":
+                result[name] = image.get("Labels") or {}
+    return result
+
+
+def build(host, image, directory, digest):
+    """Builds an image on a host from its context, labelled with the context's
+    hash"""
+
+    key = (host.name, image)
+    try:
+        docker.run(
+            [
+                "docker",
+                "build",
+                "--tag",
+                image,
+                "--label",
+                f"{LABEL_CONTEXT}={digest}",
+                directory,
+            ],
+            check=True,
+            capture_output=True,
+            timeout=BUILD_TIMEOUT,
+            env=host.env(),
+        )
+    except docker.ERRORS:
+        traceback.print_exc()
+        with _lock:
+            _building.pop(key, None)
+            # a stale image that's still there is better than nothing
+            if _states[key] != STATE_READY:
+                _states[key] = STATE_FAILED
+        print(f"Building image {image} on {host.name} failed")
+        return
+
+    with _lock:
+        _building.pop(key, None)
+        _states[key] = STATE_READY
+    print(f"Built image {image} on {host.name}")
+
+
+def verify():
+    """Checks every required image against a single listing per host and
+    queues builds for the ones that are missing or out of date. Returns False
+    if any host couldn't be reached."""
+
+    digests = {image: context_hash(directory) for image, directory in CONTEXTS.items()}
+    reached = True
+    for host in hosts.HOSTS:
+        try:
+            present = local_images(host)
+        except docker.ERRORS:
+            traceback.print_exc()
+            reached = False
+            continue
+
+        for image, digest in digests.items():
+            key = (host.name, image)
+            labels = present.get(image)
+            with _lock:
+                if labels is not None:
+                    _states[key] = STATE_READY
+                elif _states.get(key) != STATE_BUILDING:
+                    _states[key] = STATE_MISSING
+                if labels is not None and labels.get(LABEL_CONTEXT) == digest:
+                    continue
+                if not BUILD_IMAGES or key in _building:
+                    continue
+                if _states[key] != STATE_READY:
+                    _states[key] = STATE_BUILDING
+                _building[key] = _executor.submit(
+                    build, host, image, CONTEXTS[image], digest
+                )
+    return reached
+
+
+def run():
+    """Runs in a background thread, checking again until every host answers"""
+
+    while not verify():
+        time.sleep(RETRY_DELAY)
+
+
+def require(challenges):
+    """Records the images a list of challenges need"""
+
+    for challenge in challenges:
+        images = required_images(challenge)
+        REQUIRED[challenge.NAME] = list(images)
+        CONTEXTS.update(images)
+        with _lock:
+            for host in hosts.HOSTS:
+                for image in images:
+                    _states.setdefault((host.name, image), STATE_UNKNOWN)
+
+
+def configure(challenges):
+    """Records the images a list of challenges need and checks them. If a host
+    can't be reached they are checked again in the background until it can."""
+
+    global _thread
+    require(challenges)
+    if not verify() and (_thread is None or not _thread.is_alive()):
+        _thread = threading.Thread(target=run, daemon=True)
+        _thread.start()
+
+
+def ready(image, host):
+    """Returns whether an image can be run on a host"""
+
+    return _states.get((host.name, image)) == STATE_READY
+
+
+def available(name, host=None):
+    """Returns whether every image a challenge needs is ready on a host, or on
+    any host if host is None"""
+
+    if host is None:
+        return any(available(name, candidate) for candidate in hosts.HOSTS)
+    return all(ready(image, host) for image in REQUIRED.get(name, ()))
+
+
+def states():
+    """Returns the state of every required image keyed by (host name, image)"""
+
+    with _lock:
+        return dict(_states)
+
+
+def main():
+    """Checks and builds every challenge's images from the command line,
+    exiting once the builds are done"""
+
+    require(discover())
+    if not verify():
+        sys.exit("Docker can't be reached")
+    with _lock:
+        futures = list(_building.values())
+    wait(futures)
+
+    for (host, image), state in sorted(states().items()):
+        print(f"{host} {image}: {state}")
+    if any(state != STATE_READY for state in states().values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,269 @@
+"""Warm pools of pre-started containers and compose environments so challenges
+can be handed out without waiting on Docker"""
+
+import atexit
+import collections
+import threading
+import time
+import traceback
+
+import db
+from challenges import capacity, docker, hosts, images
+
+RETRY_DELAY = 30  # seconds to back off when Docker refuses to start a container
+DEFAULT_MAX_AGE = 30 * 60  # seconds a warm container may sit unused
+DEFAULT_EVICT_INTERVAL = 60  # seconds between checks for stale containers
+
+POOLS = {}  # WarmPools keyed by (image, host name)
+COMPOSE_POOLS = {}  # ComposePools keyed by (challenge name, host name)
+
+
+class WarmPool:
+    """A set of running containers for a single image on a host, with their
+    ports already resolved. A background thread keeps the pool topped up to
+    size and stops containers that have been waiting longer than max_age."""
+
+    def __init__(
+        self, image, container_port, size, max_age, evict_interval, labels, host
+    ):
+        self.image = image
+        self.container_port = container_port
+        self.size = size
+        self.max_age = max_age
+        self.evict_interval = evict_interval
+        self.labels = labels
+        self.host = host
+        self.ready = collections.deque()  # (started, port, end_cmd), oldest first
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.thread = threading.Thread(target=self.refill, daemon=True)
+
+    def take(self):
+        """Hands out the oldest warm container as (port, end_cmd), or None if
+        the pool is empty. The refiller is woken up to replace it."""
+
+        with self.lock:
+            entry = self.ready.popleft() if self.ready else None
+        self.wakeup.set()
+
+        if entry is None:
+            return None
+        _, port, end_cmd = entry
+        return (port, end_cmd)
+
+    def evict(self):
+        """Stops any warm containers that are older than max_age"""
+
+        cutoff = time.monotonic() - self.max_age
+        with self.lock:
+            stale = [entry for entry in self.ready if entry[0] < cutoff]
+            for entry in stale:
+                self.ready.remove(entry)
+        for _, _, end_cmd in stale:
+            stop(end_cmd, self.host)
+
+    def drain(self):
+        """Stops every warm container in the pool"""
+
+        with self.lock:
+            entries = list(self.ready)
+            self.ready.clear()
+        for _, _, end_cmd in entries:
+            stop(end_cmd, self.host)
+
+    def top_up(self):
+        """Starts containers until the pool is back to size, returning the
+        seconds to wait before checking again"""
+
+        while len(self.ready) < self.size and images.ready(self.image, self.host):
+            try:
+                port, end_cmd = docker.run_with_port(
+                    self.image,
+                    self.container_port,
+                    self.labels,
+                    self.host,
+                    capacity.LIMITS.get(self.image),
+                )
+            except docker.ERRORS:
+                traceback.print_exc()
+                return min(self.evict_interval, RETRY_DELAY)
+            with self.lock:
+                self.ready.append((time.monotonic(), port, end_cmd))
+        return self.evict_interval
+
+    def refill(self):
+        """Runs forever in a background thread, evicting stale containers and
+        starting new ones until the pool is back to size"""
+
+        while True:
+            self.evict()
+            delay = self.top_up()
+            self.wakeup.wait(delay)
+            self.wakeup.clear()
+
+
+class ComposePool:
+    """A set of docker compose environments that have already been brought up
+    for a challenge, with their VPN port and client config stored in the
+    env_pool table. Claiming one is a single DB operation, see
+    db.claim_pooled_env. Pooled environments live in the DB so they survive a
+    restart of the app."""
+
+    def __init__(self, app, name, directory, size, host):
+        self.app = app
+        self.name = name
+        self.directory = directory
+        self.size = size
+        self.host = host
+        self.wakeup = threading.Event()
+        self.thread = threading.Thread(target=self.refill, daemon=True)
+
+    def top_up(self):
+        """Brings up environments until the pool is back to size, counting
+        the ones already in env_pool, and returns the seconds to wait before
+        checking again"""
+
+        with self.app.app_context():
+            conn = db.get_connection()
+            missing = self.size - db.count_pooled_envs(conn, self.name, self.host.name)
+            if not images.available(self.name, self.host):
+                missing = 0
+
+            for _ in range(missing):
+                try:
+                    port, client_config, end_cmd = docker.compose_up_vpn(
+                        self.directory, docker.make_labels(self.name), self.host
+                    )
+                except docker.ERRORS:
+                    traceback.print_exc()
+                    return RETRY_DELAY
+                db.add_pooled_env(
+                    conn,
+                    self.name,
+                    port,
+                    client_config,
+                    end_cmd,
+                    self.directory,
+                    self.host.name,
+                )
+                conn.commit()
+        return DEFAULT_EVICT_INTERVAL
+
+    def refill(self):
+        """Runs forever in a background thread, bringing up environments until
+        the pool is back to size"""
+
+        while True:
+            delay = self.top_up()
+            self.wakeup.wait(delay)
+            self.wakeup.clear()
+
+
+def stop(end_cmd, host):
+    """Stops a warm container that will never be handed out"""
+
+    try:
+        docker.end(end_cmd, None, host)
+    except docker.ERRORS:
+        traceback.print_exc()
+
+
+def configure(app, challenge):
+    """Starts a pool on every host for a challenge module if it sets POOL_SIZE,
+    a WarmPool if it has an IMAGE or a ComposePool if it has a COMPOSE_DIR.
+    Calling this more than once for the same challenge is harmless."""
+
+    size = getattr(challenge, "POOL_SIZE", 0)
+    if not size:
+        return
+
+    for host in hosts.HOSTS:
+        if hasattr(challenge, "COMPOSE_DIR"):
+            if (challenge.NAME, host.name) in COMPOSE_POOLS:
+                continue
+            pool = ComposePool(app, challenge.NAME, challenge.COMPOSE_DIR, size, host)
+            COMPOSE_POOLS[(challenge.NAME, host.name)] = pool
+            pool.thread.start()
+            continue
+
+        if (challenge.IMAGE, host.name) in POOLS:
+            continue
+
+        pool = WarmPool(
+            challenge.IMAGE,
+            challenge.PORT,
+            size,
+            getattr(challenge, "POOL_MAX_AGE", DEFAULT_MAX_AGE),
+            getattr(challenge, "POOL_EVICT_INTERVAL", DEFAULT_EVICT_INTERVAL),
+            docker.make_labels(challenge.NAME),
+            host,
+        )
+        POOLS[(challenge.IMAGE, host.name)] = pool
+        pool.thread.start()
+
+
+def run_with_port(image, container_port, labels=None):
+    """A drop in replacement for docker.run_with_port that hands out a warm
+    container on the host from hosts.using() when one is available and only
+    starts one on demand if not"""
+
+    host = hosts.current()
+    pool = POOLS.get((image, host.name))
+    if pool:
+        entry = pool.take()
+        if entry:
+            return entry
+    return docker.run_with_port(
+        image, container_port, labels, host, capacity.LIMITS.get(image)
+    )
+
+
+def claim_env(conn, name, directory, labels=None):
+    """Claims a pooled compose environment for a challenge on the host from
+    hosts.using(), bringing one up on demand if the pool is empty. Returns
+    (port, client_config, end_cmd) where client_config has no Endpoint yet."""
+
+    host = hosts.current()
+    row = None
+    # the DELETE starts a write transaction even when nothing matches, so only
+    # run it when there's something to claim and roll a miss back rather than
+    # hold the write lock for the whole of compose up
+    if db.count_pooled_envs(conn, name, host.name):
+        row = db.claim_pooled_env(conn, name, host.name)
+        if not row:
+            conn.rollback()
+    pool = COMPOSE_POOLS.get((name, host.name))
+    if pool:
+        pool.wakeup.set()
+    if row:
+        return (row["port"], row["client_config"], row["end_cmd"])
+    return docker.compose_up_vpn(directory, labels, host)
+
+
+def warm_end_cmds():
+    """Returns the end_cmds of every warm container that hasn't been handed
+    out yet"""
+
+    end_cmds = []
+    for pool in list(POOLS.values()):
+        with pool.lock:
+            end_cmds.extend(end_cmd for _, _, end_cmd in pool.ready)
+    return end_cmds
+
+
+def released(name):
+    """Called after a challenge has been torn down. Wakes its compose pool so
+    the freed resources (Docker only has so many network address pools) are
+    used to replenish it right away instead of after a retry delay."""
+
+    for (pool_name, _), pool in list(COMPOSE_POOLS.items()):
+        if pool_name == name:
+            pool.wakeup.set()
+
+
+@atexit.register
+def drain_all():
+    """Stops all warm containers when the app exits so they aren't leaked"""
+
+    for pool in POOLS.values():
+        pool.drain()
@@ -0,0 +1,143 @@
+"""Hands out host ports for challenge containers from a fixed range so Docker
+doesn't have to pick them (and we don't have to ask it which one it picked).
+The ports in use by a range are all in PORT_RANGE, which makes them easy to
+firewall."""
+
+import collections
+import os
+import sqlite3
+import threading
+import time
+import traceback
+
+import db
+
+PORT_RANGE = os.getenv("PORT_RANGE", "20000-29999")  # inclusive
+RETRY_DELAY = 1  # seconds to wait before retrying a failed write
+
+
+class NoFreePorts(Exception):
+    """Raised when every port in the range is allocated"""
+
+
+class PortAllocator:
+    """A bitmap of the ports in a range, one byte per port. Ports are handed out
+    round robin so a port that was just freed isn't reused right away. Once
+    load() has been called every change is also written to the ports table by
+    a background thread, so they survive a restart of the app. Writing them
+    in the background means allocating or freeing a port never waits on a
+    caller's own open transaction."""
+
+    def __init__(self, port_range):
+        first, last = port_range.split("-")
+        self.first = int(first)
+        self.used = bytearray(int(last) - self.first + 1)
+        self.owners = {}  # owner -> list of ports
+        self.since = {}  # owner -> when its first port was allocated
+        self.next = 0
+        self.lock = threading.Lock()
+        self.app = None
+        self.pending = collections.deque()  # (port, owner) to add or (None, owner) to free
+        self.wakeup = threading.Event()
+        self.thread = None
+
+    def load(self, app):
+        """Reads the ports that are already allocated from the DB and starts
+        the thread that records new ones"""
+
+        with self.lock:
+            self.app = app
+            self.pending.clear()
+            self.used = bytearray(len(self.used))
+            self.owners = {}
+            self.since = {}
+            now = time.time()
+            with app.app_context():
+                for row in db.get_ports(db.get_connection()):
+                    index = row["port"] - self.first
+                    if 0 <= index < len(self.used):
+                        self.used[index] = 1
+                    self.owners.setdefault(row["owner"], []).append(row["port"])
+                    self.since[row["owner"]] = now
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.persist, daemon=True)
+                self.thread.start()
+
+    def allocate(self, owner):
+        """Returns a free port and marks it as used by owner, a container or
+        compose project name"""
+
+        with self.lock:
+            index = self.used.find(0, self.next)
+            if index == -1:
+                index = self.used.find(0, 0, self.next)
+            if index == -1:
+                raise NoFreePorts(PORT_RANGE)
+            self.used[index] = 1
+            self.next = (index + 1) % len(self.used)
+            port = self.first + index
+            self.owners.setdefault(owner, []).append(port)
+            self.since.setdefault(owner, time.time())
+            if self.app is not None:
+                self.pending.append((port, owner))
+        self.wakeup.set()
+        return port
+
+    def release(self, owner):
+        """Frees every port used by owner. Unknown owners are ignored."""
+
+        with self.lock:
+            ports = self.owners.pop(owner, [])
+            self.since.pop(owner, None)
+            for port in ports:
+                index = port - self.first
+                if 0 <= index < len(self.used):
+                    self.used[index] = 0
+            if ports and self.app is not None:
+                self.pending.append((None, owner))
+        self.wakeup.set()
+
+    def persist(self):
+        """Runs forever in a background thread, writing allocations to the
+        ports table in batches"""
+
+        while True:
+            self.wakeup.wait()
+            self.wakeup.clear()
+            with self.lock:
+                changes = list(self.pending)
+                self.pending.clear()
+                app = self.app
+            if not changes:
+                continue
+            try:
+                with app.app_context():
+                    conn = db.get_connection()
+                    for port, owner in changes:
+                        if port is None:
+                            db.del_ports(conn, owner)
+                        else:
+                            db.add_port(conn, port, owner)
+                    conn.commit()
+            except sqlite3.Error:
+                # try again with the next batch
+                traceback.print_exc()
+                with self.lock:
+                    self.pending.extendleft(reversed(changes))
+                time.sleep(RETRY_DELAY)
+
+    def owned_before(self, cutoff):
+        """Returns the owners that were allocated ports before cutoff, in
+        seconds since the epoch. Ports read by load() count as allocated when
+        they were read, since the DB doesn't say."""
+
+        with self.lock:
+            return [owner for owner, since in self.since.items() if since < cutoff]
+
+    def in_use(self):
+        """Returns the number of allocated ports"""
+
+        return self.used.count(1)
+
+
+PORTS = PortAllocator(PORT_RANGE)
@@ -0,0 +1,49 @@
+"""Challenge prompts are stored as a template name and the parameters to render
+it with instead of as HTML. Rows stay small, and a fixed template applies to
+challenges that are already running. Rendered prompts are cached since many
+users share the same parameters."""
+
+import collections
+import functools
+import json
+
+from flask import render_template
+
+RENDER_CACHE_SIZE = 256
+
+Prompt = collections.namedtuple("Prompt", "template params")
+
+
+def prompt(template, **params):
+    """What a challenge's start() returns as its prompt, a template in
+    challenges/templates and the (JSON serializable) parameters for it"""
+
+    return Prompt(template, params)
+
+
+def dump(challenge_prompt):
+    """Returns the (html, template, params) columns to store for a prompt,
+    with params as JSON. Older challenges that return rendered HTML are
+    stored as they are."""
+
+    if isinstance(challenge_prompt, Prompt):
+        params = json.dumps(
+            challenge_prompt.params, sort_keys=True, separators=(",", ":")
+        )
+        return "", challenge_prompt.template, params
+    return challenge_prompt, None, None
+
+
+def load(challenge_row):
+    """Returns the HTML prompt for a row of the challenges table"""
+
+    if challenge_row["template"]:
+        return render(challenge_row["template"], challenge_row["params"])
+    return challenge_row["prompt"]
+
+
+@functools.lru_cache(maxsize=RENDER_CACHE_SIZE)
+def render(template, params):
+    """Renders a stored prompt"""
+
+    return render_template(template, **json.loads(params))
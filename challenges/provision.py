@@ -0,0 +1,108 @@
+"""Runs challenge start functions on a bounded pool of worker threads so
+starting a challenge doesn't tie up the web worker. The route adds a
+provisioning row to the challenges table and the job fills in the prompt and
+end_cmd when start() returns, or records the error if it fails."""
+
+import os
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+import db
+from admin.users import invalidate
+from challenges import capacity, docker, hosts, images, pool, prompts
+from metrics import CHALLENGE_START
+
+WORKERS = int(os.getenv("PROVISION_WORKERS", "4"))
+QUEUE_LIMIT = int(os.getenv("PROVISION_QUEUE", "32"))  # jobs waiting for a worker
+
+# what students see when starting fails, the details are only logged
+START_FAILED = "Something went wrong while starting this challenge, please try it again."
+
+_executor = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix="provision")
+_slots = threading.BoundedSemaphore(WORKERS + QUEUE_LIMIT)
+
+
+class QueueFull(Exception):
+    """Raised when there are already too many provisioning jobs"""
+
+
+def submit(app, challenge_id, user_id, challenge, hostname):
+    """Queues a job to run challenge.start() for the challenges row
+    challenge_id. Raises QueueFull if too many jobs are already queued."""
+
+    if not _slots.acquire(blocking=False):
+        raise QueueFull()
+    _executor.submit(run, app, challenge_id, user_id, challenge, hostname)
+
+
+def launch(app, conn, user_id, challenge, hostname):
+    """Adds a provisioning row for a user's challenge and queues the job to
+    start it. Raises QueueFull (after removing the row) if too many jobs are
+    already queued."""
+
+    challenge_id = db.add_provisioning_challenge(
+        conn, user_id, challenge.NAME, challenge.FLAG
+    )
+    conn.commit()
+
+    try:
+        submit(app, challenge_id, user_id, challenge, hostname)
+    except QueueFull:
+        db.del_challenge(conn, user_id)
+        conn.commit()
+        raise
+    invalidate(user_id)
+
+
+def run(app, challenge_id, user_id, challenge, hostname):
+    """Runs a provisioning job in a worker thread. The challenge is placed on
+    the least loaded host that has its images and room for it, and students
+    are told to connect to that host instead of the range's hostname when it
+    has its own."""
+
+    try:
+        with app.app_context():
+            conn = db.get_connection()
+            try:
+                candidates = [
+                    candidate
+                    for candidate in hosts.HOSTS
+                    if images.available(challenge.NAME, candidate)
+                ]
+                host = hosts.place(
+                    conn,
+                    challenge_id,
+                    candidates,
+                    lambda host: capacity.has_room(conn, challenge.NAME, host),
+                )
+                with CHALLENGE_START.time(challenge.NAME), hosts.using(host):
+                    prompt, end_cmd, cwd = challenge.start(
+                        conn, user_id, host.public or hostname
+                    )
+            except Exception as error:  # pylint: disable=broad-exception-caught
+                print(f"Starting {challenge.NAME} for user {user_id} failed")
+                traceback.print_exc()
+                conn.rollback()
+                # Docker's errors can name hosts and paths, ours are for students
+                message = str(error) if isinstance(error, hosts.NoHost) else START_FAILED
+                db.fail_challenge(conn, challenge_id, message)
+                conn.commit()
+                return
+
+            html, template, params = prompts.dump(prompt)
+            finished = db.finish_challenge(
+                conn, challenge_id, html, template, params, end_cmd, cwd
+            )
+            conn.commit()
+
+            # the user stopped the challenge (or was logged out) while it was
+            # starting, so nobody owns what we just started
+            if not finished:
+                if end_cmd:
+                    docker.end(end_cmd, cwd, host)
+                pool.released(challenge.NAME)
+    except docker.ERRORS:
+        traceback.print_exc()
+    finally:
+        _slots.release()
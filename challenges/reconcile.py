@@ -0,0 +1,141 @@
+"""Brings Docker and the DB back in line after a crash or a failed end_cmd.
+Containers and compose projects labelled with our RANGE_INSTANCE that nothing
+refers to are removed, and challenges whose containers are gone are marked as
+failed so the user can start them again. Each Docker engine in hosts.HOSTS is
+checked on its own. Host ports whose owner is gone from the DB and every
+engine are freed."""
+
+import time
+import traceback
+
+import db
+from challenges import docker, hosts, pool
+from challenges.ports import PORTS
+
+GRACE = 120  # seconds a new container may go unclaimed, it may still be starting
+RECONCILE_INTERVAL = 300  # seconds between runs
+COMPOSE_PROJECT = "com.docker.compose.project"
+
+
+def container_owner(container):
+    """Returns the compose project of a container from the container list, or
+    its name if it isn't part of one"""
+
+    labels = container.get("Labels") or {}
+    return labels.get(COMPOSE_PROJECT) or container["Names"][0].lstrip("/")
+
+
+def missing(end_cmd, present):
+    """Returns whether what an end_cmd stops is known to be gone"""
+
+    if not end_cmd:
+        return False
+    owner = docker.owner(end_cmd)
+    return owner is not None and owner not in present
+
+
+def reconcile(startup=False):
+    """Diffs a single listing of every container on each host against the
+    challenges and env_pool tables and the warm pools. At startup challenges
+    that were still provisioning are failed, since their jobs died with the
+    old process, and every port nothing owns is freed without waiting for
+    GRACE."""
+
+    conn = db.get_connection()
+    rows = db.get_challenge_envs(conn)
+    if startup:
+        stuck = [row["id"] for row in rows if row["state"] == db.STATE_PROVISIONING]
+        db.fail_challenges(conn, stuck, "The range restarted while this was starting")
+        conn.commit()
+
+    # read what we know about before listing, so anything started in between
+    # is either too new to be an orphan or already in the listing
+    envs = db.get_pooled_envs(conn)
+    known = {docker.owner(row["end_cmd"]) for row in rows + envs if row["end_cmd"]}
+    known.update(docker.owner(end_cmd) for end_cmd in pool.warm_end_cmds())
+    allocated = PORTS.owned_before(time.time() if startup else time.time() - GRACE)
+
+    present = set()
+    listed = True
+    for host in hosts.HOSTS:
+        # rows from a host that isn't configured any more belong to the first
+        host_rows = [row for row in rows if hosts.get(row["host"]) is host]
+        host_envs = [env for env in envs if hosts.get(env["host"]) is host]
+        host_present = reconcile_host(conn, host, known, host_rows, host_envs)
+        if host_present is None:
+            listed = False
+        else:
+            present.update(host_present)
+
+    # a port's owner could be on a host that couldn't be listed
+    if listed:
+        owners = known | present
+        freed = [owner for owner in allocated if owner not in owners]
+        for owner in freed:
+            PORTS.release(owner)
+        if freed:
+            print(f"Reconciled ports: freed the ports of {len(freed)} missing owners")
+
+
+def reconcile_host(conn, host, known, rows, envs):
+    """Reconciles one host, known is the owner of every environment the range
+    knows about on any host. Returns the owners present on the host, or None
+    if it couldn't be listed."""
+
+    try:
+        containers = host.client.list_containers()
+    except docker.ERRORS:
+        traceback.print_exc()
+        return None
+
+    present = set()
+    for container in containers:
+        present.add(container_owner(container))
+        present.add(container["Id"][:12])  # old end_cmds use the short id
+
+    # ours, old enough to have been claimed, and not claimed
+    cutoff = time.time() - GRACE
+    orphans = {}
+    for container in containers:
+        labels = container.get("Labels") or {}
+        if labels.get(docker.LABEL_INSTANCE) != docker.INSTANCE:
+            continue
+        owner = container_owner(container)
+        if owner in known or container["Id"][:12] in known:
+            continue
+        if container["Created"] > cutoff:
+            continue
+        orphans[owner] = COMPOSE_PROJECT in labels
+
+    for owner, compose in orphans.items():
+        end_cmd = f"docker compose -p {owner} down" if compose else f"docker stop {owner}"
+        try:
+            docker.end(end_cmd, None, host)
+        except docker.ERRORS:
+            traceback.print_exc()
+
+    stale = [
+        row["id"]
+        for row in rows
+        if row["state"] == db.STATE_READY and missing(row["end_cmd"], present)
+    ]
+    db.fail_challenges(conn, stale, "The environment for this challenge is gone")
+
+    gone = [env["id"] for env in envs if missing(env["end_cmd"], present)]
+    db.del_pooled_envs(conn, gone)
+    conn.commit()
+
+    if orphans or stale or gone:
+        print(
+            f"Reconciled Docker on {host.name}: removed {len(orphans)} orphans,"
+            f" failed {len(stale)} challenges, dropped {len(gone)} pooled"
+            " environments"
+        )
+    return present
+
+
+def reconcile_job(app):
+    """Runs reconcile() in an app context for the background scheduler"""
+
+    with app.app_context():
+        reconcile()
@@ -0,0 +1,126 @@
+"""Finds challenges by looking for challenges/*/challenge.py. Their settings
+(NAME, FLAG, DESCRIPTION, IMAGE, POOL_SIZE, ...) are read from the source as
+a manifest, so a challenge module is only imported the first time it is
+started."""
+
+import ast
+import importlib
+import operator
+import os
+import re
+import threading
+
+DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+# operators allowed in a manifest value, ex: POOL_MAX_AGE = 30 * 60
+OPERATORS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.FloorDiv: operator.floordiv,
+}
+
+_UNKNOWN = object()  # a setting whose value needs the module to be imported
+
+
+def evaluate(node):
+    """Evaluates a constant expression from a manifest, raising ValueError if
+    it's anything more than literals and arithmetic"""
+
+    if isinstance(node, ast.BinOp) and type(node.op) in OPERATORS:
+        return OPERATORS[type(node.op)](evaluate(node.left), evaluate(node.right))
+    return ast.literal_eval(node)
+
+
+def read_manifest(path):
+    """Returns the UPPERCASE settings assigned at the top level of a
+    challenge.py without importing it. Settings that aren't constant
+    expressions are returned as _UNKNOWN."""
+
+    with open(path, encoding="utf-8") as source:
+        tree = ast.parse(source.read(), path)
+
+    manifest = {}
+    for statement in tree.body:
+        if not isinstance(statement, ast.Assign):
+            continue
+        for target in statement.targets:
+            if isinstance(target, ast.Name) and target.id.isupper():
+                try:
+                    manifest[target.id] = evaluate(statement.value)
+                except (ValueError, TypeError, SyntaxError, ZeroDivisionError):
+                    manifest[target.id] = _UNKNOWN
+    return manifest
+
+
+class Challenge:
+    """Stands in for a challenge module. Settings come from the manifest and
+    anything else (like start) imports the module. Challenges that set
+    STATIC = True have the same prompt for everyone, so it is rendered once
+    per hostname (students are pointed at the host their challenge runs on)
+    and reused."""
+
+    def __init__(self, module_name, manifest, directory=None):
+        self.module_name = module_name
+        self.manifest = manifest
+        self.directory = directory
+        self.module = None
+        self.static_results = {}  # start() results keyed by hostname
+        self.lock = threading.Lock()
+
+    def __repr__(self):
+        return f"<Challenge {self.module_name}>"
+
+    def load(self):
+        """Imports the challenge module if it hasn't been already"""
+
+        with self.lock:
+            if self.module is None:
+                self.module = importlib.import_module(self.module_name)
+            return self.module
+
+    def __getattr__(self, name):
+        manifest = self.__dict__.get("manifest", {})
+        if name in manifest and manifest[name] is not _UNKNOWN:
+            return manifest[name]
+        # a setting that isn't in the manifest isn't in the module either
+        if name.isupper() and name not in manifest:
+            raise AttributeError(name)
+        return getattr(self.load(), name)
+
+    def start(self, conn, user_id, hostname):
+        """Calls the module's start(), or returns the cached result for a
+        static challenge on this hostname"""
+
+        module = self.load()
+        if not self.manifest.get("STATIC"):
+            return module.start(conn, user_id, hostname)
+        with self.lock:
+            if hostname not in self.static_results:
+                self.static_results[hostname] = module.start(conn, user_id, hostname)
+            return self.static_results[hostname]
+
+
+def natural_key(name):
+    """Sorts challenge10 after challenge9"""
+
+    return [int(part) if part.isdigit() else part for part in re.split(r"(\d+)", name)]
+
+
+def discover(directory=DIRECTORY, package=__package__):
+    """Returns a Challenge for every directory with a challenge.py, in natural
+    order of their directory names"""
+
+    challenges = []
+    for name in sorted(os.listdir(directory), key=natural_key):
+        path = os.path.join(directory, name, "challenge.py")
+        if os.path.isfile(path):
+            challenges.append(
+                Challenge(
+                    f"{package}.{name}.challenge",
+                    read_manifest(path),
+                    os.path.dirname(path),
+                )
+            )
+    return challenges
@@ -1,23 +1,43 @@
 """Challenge endpoints for starting/stopping/displaying challenges"""
 
 from urllib.parse import urlparse
-import subprocess
 
-from flask import render_template, request, Blueprint, redirect, url_for, abort
+from flask import (
+    render_template,
+    request,
+    Blueprint,
+    redirect,
+    url_for,
+    abort,
+    current_app,
+)
 from flask_login import login_required, current_user
 
 import db
-from challenges.forms import ChallengeForm
-
-import challenges.challenge1.challenge as challenge1
-import challenges.challenge2.challenge as challenge2
-import challenges.challenge3.challenge as challenge3
-import challenges.challenge4.challenge as challenge4
-import challenges.challenge5.challenge as challenge5
+from admin.users import invalidate
+from challenges.forms import ChallengeForm, QueueForm
+from challenges import (
+    admission,
+    docker,
+    hosts,
+    idle,
+    images,
+    pool,
+    prompts,
+    provision,
+    registry,
+    throttle,
+)
+from leaderboard.routes import publish_capture
 
-AVAILABLE_CHALLENGES = [challenge1, challenge2, challenge3, challenge4, challenge5]
+# every challenges/*/challenge.py, see challenges/registry.py
+AVAILABLE_CHALLENGES = registry.discover()
 
-PROCESS_TIMEOUT = 30
+# what /list_challenges shows, it doesn't change while the app is running
+CHALLENGE_LIST = [
+    {"id": index, "name": chal.NAME, "description": chal.DESCRIPTION}
+    for index, chal in enumerate(AVAILABLE_CHALLENGES)
+]
 
 challenges_bp = Blueprint(
     "challenges",
@@ -28,32 +48,30 @@ challenges_bp = Blueprint(
 )
 
 
-def stop_challenge(conn, user_id, end_cmd, cwd):
+def stop_challenge(conn, user_id, name, end_cmd, cwd, host):
     """Utility function to stop an active challenge and remove it from the DB"""
 
     if end_cmd:
-        subprocess.run(
-            end_cmd, shell=True, cwd=cwd, timeout=PROCESS_TIMEOUT, check=True
-        )
+        docker.end(end_cmd, cwd, hosts.get(host))
     db.del_challenge(conn, user_id)
     conn.commit()
+    invalidate(user_id)
+    pool.released(name)
+    admission.released()
 
 
 @challenges_bp.route("/list_challenges", methods=["GET"])
 @login_required
 def list_challenges():
-    """An endpoint that lists available challenges"""
-
-    chal_list = []
-    for index, chal in enumerate(AVAILABLE_CHALLENGES):
-        chal_list.append(
-            {
-                "id": index,
-                "name": chal.NAME,
-                "description": chal.DESCRIPTION,
-            }
-        )
-    return render_template("list_challenges.html", challenge_list=chal_list)
+    """An endpoint that lists available challenges, leaving out any whose
+    images aren't ready"""
+
+    challenge_list = [
+        chal
+        for chal in CHALLENGE_LIST
+        if images.available(AVAILABLE_CHALLENGES[chal["id"]].NAME)
+    ]
+    return render_template("list_challenges.html", challenge_list=challenge_list)
 
 
 @challenges_bp.route("/active_challenge", methods=["GET", "POST"])
@@ -64,76 +82,125 @@ def active_challenge():
 
     user_id = current_user.user_id
 
+    # turn away flag guesses that come too fast before they cost a query
+    if request.method == "POST" and "capture" in request.form:
+        wait = throttle.take(user_id, current_user.active_challenge)
+        if wait:
+            return (
+                render_template("slow_down.html", wait=wait),
+                429,
+                {"Retry-After": str(wait)},
+            )
+
     # check the DB for an active challenge
     conn = db.get_connection()
     challenge_row = db.get_challenge(conn, user_id)
 
     # make sure they have an active challenge
     if not challenge_row:
-        conn.close()
         abort(400)
 
     name = challenge_row["name"]
-    prompt = challenge_row["prompt"]
     flag = challenge_row["flag"]
     end_cmd = challenge_row["end_cmd"]
     cwd = challenge_row["cwd"]
+    host = challenge_row["host"]
+    state = challenge_row["state"]
+
+    # wake it up if it was paused for being idle
+    if state == db.STATE_READY:
+        idle.visited(conn, challenge_row)
 
     form = ChallengeForm()
     if form.validate_on_submit():
-        if form.capture.data:  # attempt to capture a flag
+        if form.capture.data and state == db.STATE_READY:  # attempt to capture a flag
             if flag == form.flag.data:  # is flag valid?
                 # has it not already been captured?
                 if not db.get_capture(conn, user_id, name):
                     db.capture_flag(conn, user_id, name)
-                    stop_challenge(conn, user_id, end_cmd, cwd)
-                    conn.commit()
-                    conn.close()
+                    conn.commit()  # don't hold the write lock while docker works
+                    stop_challenge(conn, user_id, name, end_cmd, cwd, host)
+                    publish_capture(conn, user_id, current_user.name, name)
                     current_user.active_challenge = None
                     return render_template("flag_captured.html", name=name)
                 form.flag.errors.append("Already captured!")
             else:
                 form.flag.errors.append("Flag is incorrect")
         elif form.stop.data:  # stop the active challenge
-            stop_challenge(conn, user_id, end_cmd, cwd)
-            conn.commit()
-            conn.close()
+            stop_challenge(conn, user_id, name, end_cmd, cwd, host)
             return redirect(url_for("challenges.list_challenges"))
 
-    conn.close()
+    # it's still starting (or failed to start)
+    if state != db.STATE_READY:
+        return render_template(
+            "provisioning.html", name=name, error=challenge_row["error"], form=form
+        )
+
     # show the invidual challenge
-    return render_template("active_challenge.html", prompt=prompt, form=form)
+    return render_template(
+        "active_challenge.html", prompt=prompts.load(challenge_row), form=form
+    )
 
 
-@login_required
 @challenges_bp.route("/start_challenge")
+@login_required
 def start_challenge():
-    """A route that starts a challenge and redirects to /challenges"""
+    """A route that queues a challenge to be started and redirects to
+    /active_challenge which shows its progress"""
 
     user_id = current_user.user_id
 
     # make sure they specified a valid challenge_id
     challenge_id = request.args.get("id", default=-1, type=int)
-    if challenge_id < 0 or challenge_id > len(AVAILABLE_CHALLENGES):
+    if challenge_id < 0 or challenge_id >= len(AVAILABLE_CHALLENGES):
         abort(400)
     challenge = AVAILABLE_CHALLENGES[challenge_id]
+    if not images.available(challenge.NAME):
+        abort(503)
 
     # make sure they don't already have an active challenge
     conn = db.get_connection()
     if db.get_challenge(conn, user_id):
-        conn.close()
         abort(403)
 
     hostname = urlparse(request.base_url).hostname
 
-    # run the start function
-    prompt, end_cmd, cwd = challenge.start(conn, user_id, hostname)
-
-    # add the challenge to the DB
-    db.add_challenge(
-        conn, user_id, challenge.NAME, prompt, end_cmd, cwd, challenge.FLAG
-    )
-    conn.commit()
-    conn.close()
+    # start it now if there's room, otherwise wait in line for it
+    try:
+        place = admission.request(
+            current_app._get_current_object(),  # pylint: disable=protected-access
+            conn,
+            user_id,
+            challenge,
+            hostname,
+        )
+    except provision.QueueFull:
+        return render_template("toomany.html"), 503
+    if place:
+        return redirect(url_for("challenges.queue"))
 
     return redirect(url_for("challenges.active_challenge"))
+
+
+@challenges_bp.route("/queue", methods=["GET", "POST"])
+@login_required
+def queue():
+    """Shows a user where they are in line for a challenge until it starts and
+    lets them leave the queue"""
+
+    user_id = current_user.user_id
+
+    form = QueueForm()
+    if form.validate_on_submit():
+        admission.leave(user_id)
+        return redirect(url_for("challenges.list_challenges"))
+
+    # it was started while they were waiting
+    conn = db.get_connection()
+    if db.get_challenge(conn, user_id):
+        return redirect(url_for("challenges.active_challenge"))
+
+    status = admission.status(user_id)
+    if status is None:
+        return redirect(url_for("challenges.list_challenges"))
+    return render_template("toomany.html", status=status, form=form)
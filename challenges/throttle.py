@@ -0,0 +1,68 @@
+"""Limits how fast each user can submit flags for a challenge, so nobody can
+brute force one or tie up the DB trying. Every (user, challenge) has a token
+bucket held in memory that refills at FLAG_RATE tokens a minute up to
+FLAG_BURST, both of which a challenge module can set. A submission takes a
+token and is rejected when there isn't one."""
+
+import collections
+import math
+import threading
+import time
+
+DEFAULT_RATE = 6  # flag submissions a minute
+DEFAULT_BURST = 5  # submissions that can be made at once after a break
+MAX_BUCKETS = 10000  # least recently used buckets past this are dropped
+
+LIMITS = {}  # (rate a second, burst) keyed by challenge name
+REJECTED = collections.Counter()  # rejected submissions keyed by challenge name
+
+# (user_id, challenge name): [tokens, last refill], least recently used first
+_buckets = collections.OrderedDict()
+_lock = threading.Lock()
+
+
+def configure(challenges):
+    """Records the FLAG_RATE and FLAG_BURST of a list of challenge modules,
+    raising ValueError if either isn't positive"""
+
+    for challenge in challenges:
+        rate = getattr(challenge, "FLAG_RATE", DEFAULT_RATE)
+        burst = getattr(challenge, "FLAG_BURST", DEFAULT_BURST)
+        if rate <= 0 or burst < 1:
+            raise ValueError(
+                f"{challenge.NAME} needs a FLAG_RATE above 0 and a FLAG_BURST of at "
+                f"least 1, not {rate} and {burst}"
+            )
+        LIMITS[challenge.NAME] = (rate / 60, burst)
+
+
+def take(user_id, name):
+    """Takes a token for a flag submission. Returns 0 if it's allowed or the
+    number of seconds until it would be."""
+
+    rate, burst = LIMITS.get(name, (DEFAULT_RATE / 60, DEFAULT_BURST))
+    now = time.monotonic()
+    key = (user_id, name)
+    with _lock:
+        bucket = _buckets.get(key)
+        if bucket is None:
+            bucket = _buckets[key] = [burst, now]
+            if len(_buckets) > MAX_BUCKETS:
+                _buckets.popitem(last=False)
+        else:
+            _buckets.move_to_end(key)
+            bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            return 0
+        REJECTED[name] += 1
+        return max(1, math.ceil((1 - bucket[0]) / rate))
+
+
+def rejected():
+    """Returns the rejected submissions for each challenge so far"""
+
+    with _lock:
+        return dict(REJECTED)
@@ -1,25 +1,152 @@
 """Database functions"""
 
+import functools
+import json
+import os
+import re
 import sqlite3
-from flask import current_app
+import time
+from flask import current_app, g
+
+from metrics import DB_QUERY
+
+# states of a row in the challenges table
+STATE_PROVISIONING = "provisioning"
+STATE_READY = "ready"
+STATE_FAILED = "failed"
+
+BUSY_TIMEOUT = 5000  # milliseconds to wait for another connection's write lock
+
+# functions called with (user_id, deadline) when a change to a user's
+# automatic logout time is committed, deadline is in seconds since the epoch or
+# None if it was cleared
+_auto_logout_listeners = []
+
+
+def on_auto_logout_change(listener):
+    """Registers a function to be told about automatic logout time changes"""
+
+    if listener not in _auto_logout_listeners:
+        _auto_logout_listeners.append(listener)
+
+
+def _auto_logout_changed(conn, user_id, deadline):
+    """Holds an automatic logout time change until conn commits, so listeners
+    never see one that's rolled back or that readers can't see yet"""
+
+    conn.auto_logout_changes.append((int(user_id), deadline))
+
+
+@functools.lru_cache(maxsize=256)
+def query_name(sql):
+    """Names a statement for metrics by its verb and table, ex: SELECT users"""
+
+    words = sql.split(None, 1)
+    if not words:
+        return ""
+    table = re.search(
+        r"\b(?:FROM|INTO|UPDATE|ON|TABLE(?:\s+IF\s+NOT\s+EXISTS)?)\s+(\w+)",
+        sql,
+        re.IGNORECASE,
+    )
+    return words[0].rstrip(";").upper() + (" " + table.group(1) if table else "")
+
+
+class TimedCursor(sqlite3.Cursor):
+    """A cursor that records how long each statement takes in DB_QUERY"""
+
+    def execute(self, sql, parameters=()):
+        with DB_QUERY.time(query_name(sql)):
+            return super().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        with DB_QUERY.time(query_name(sql)):
+            return super().executemany(sql, seq_of_parameters)
+
+
+class TimedConnection(sqlite3.Connection):
+    """A connection whose cursors are TimedCursors. It tells the automatic
+    logout listeners about changes once they're committed."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.auto_logout_changes = []  # (user_id, deadline) since the last commit
+
+    def commit(self):
+        super().commit()
+        changes, self.auto_logout_changes = self.auto_logout_changes, []
+        for user_id, deadline in changes:
+            for listener in _auto_logout_listeners:
+                listener(user_id, deadline)
+
+    def rollback(self):
+        super().rollback()
+        self.auto_logout_changes = []
+
+    def cursor(self, factory=TimedCursor):  # pylint: disable=arguments-differ
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):  # pylint: disable=arguments-differ
+        return self.cursor().execute(sql, parameters)
+
+
+def init_app(app):
+    """Sets up the DB config for an app and closes connections when app
+    contexts end. Setting DB_TRACE in the environment prints every SQL
+    statement."""
+
+    app.config["DB_FILE"] = os.getenv("DB_FILE")
+    app.config["DB_TRACE"] = bool(os.getenv("DB_TRACE"))
+    app.teardown_appcontext(close_connection)
 
 
 def get_connection():
-    """Gets a connection to the database stored in db_name"""
-    
-    conn = sqlite3.connect(current_app.config['DB_FILE'])
+    """Gets the connection to the database stored in DB_FILE for the current
+    app context (a request or a background job), opening it if needed. It is
+    closed automatically when the app context ends."""
+
+    if "db_conn" not in g:
+        g.db_conn = connect(current_app)
+    return g.db_conn
+
+
+def connect(app, **kwargs):
+    """Opens a new connection to an app's database. Most code should use
+    get_connection() instead, this is for the few things that need a
+    connection of their own outside of an app context."""
+
+    conn = sqlite3.connect(app.config["DB_FILE"], factory=TimedConnection, **kwargs)
     conn.row_factory = sqlite3.Row
-    conn.set_trace_callback(print)
+    # WAL lets readers carry on while the scheduler is writing
+    conn.execute("PRAGMA journal_mode=WAL;")
+    conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT};")
+    conn.execute("PRAGMA synchronous=NORMAL;")
+    if app.config.get("DB_TRACE"):
+        conn.set_trace_callback(print)
     return conn
 
 
+def close_connection(exception=None):  # pylint: disable=unused-argument
+    """Closes the connection for the current app context, if there is one"""
+
+    conn = g.pop("db_conn", None)
+    if conn is not None:
+        conn.close()
+
+
 def init(conn):
-    """Initializes a database, dropping previous tables if they exist"""
+    """Initializes a database, dropping previous tables if they exist. The
+    original schema is created and then migrated to the current version."""
 
     cur = conn.cursor()
 
     cur.executescript(
         """
+        DROP TABLE IF EXISTS env_pool;
+        DROP TABLE IF EXISTS scores;
+        DROP TABLE IF EXISTS leaderboard_version;
+        DROP TABLE IF EXISTS ports;
+
         DROP TABLE IF EXISTS challenges;
 
         CREATE TABLE challenges (
@@ -52,10 +179,196 @@ def init(conn):
           FOREIGN KEY(user_id) REFERENCES users(id)
         );
 
+        PRAGMA user_version = 0;
+    """
+    )
+    migrate(conn)
+
+
+def _columns(cur, table):
+    """Gets the names of the columns in a table"""
+
+    return [row[1] for row in cur.execute(f"PRAGMA table_info({table});")]
+
+
+def _migrate_challenge_states(cur):
+    """Adds the provisioning state of challenges and the env_pool table. DBs
+    created before migrations existed may already have them."""
+
+    columns = _columns(cur, "challenges")
+    if "state" not in columns:
+        cur.execute(
+            "ALTER TABLE challenges ADD COLUMN state TEXT NOT NULL DEFAULT 'ready';"
+        )
+    if "error" not in columns:
+        cur.execute("ALTER TABLE challenges ADD COLUMN error TEXT;")
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS env_pool (
+          id INTEGER PRIMARY KEY AUTOINCREMENT,
+          name TEXT NOT NULL,
+          port TEXT NOT NULL,
+          client_config TEXT NOT NULL,
+          end_cmd TEXT NOT NULL,
+          cwd TEXT
+        );
+    """
+    )
+
+
+def _migrate_auto_logout_index(cur):
+    """Indexes the automatic logout time used to find expired users"""
+
+    cur.execute("CREATE INDEX users_auto_logout_time ON users(auto_logout_time);")
+
+
+def _migrate_epoch_timestamps(cur):
+    """Stores automatic logout times as integer seconds since the epoch
+    instead of text, so they can be compared without date functions"""
+
+    cur.execute(
+        """
+        UPDATE users SET auto_logout_time=CAST(STRFTIME('%s', auto_logout_time) AS INTEGER)
+        WHERE auto_logout_time IS NOT NULL;
+    """
+    )
+
+
+def _migrate_capture_indexes(cur):
+    """Indexes captures by challenge name (the primary key already covers
+    lookups by user) and challenges by name for counting active ones"""
+
+    cur.execute("CREATE INDEX captures_name ON captures(name, user_id);")
+    cur.execute("CREATE INDEX challenges_name ON challenges(name);")
+
+
+def _migrate_scores(cur):
+    """Adds a scores table kept up to date by capture_flag so the leaderboard
+    doesn't have to aggregate captures, and a version number that changes
+    whenever the leaderboard does"""
+
+    cur.execute(
+        """
+        CREATE TABLE scores (
+          user_id INTEGER PRIMARY KEY,
+          total INTEGER NOT NULL DEFAULT 0,
+          last_capture INTEGER,
+          FOREIGN KEY(user_id) REFERENCES users(id)
+        );
+    """
+    )
+    cur.execute(
+        """
+        INSERT INTO scores (user_id, total)
+        SELECT user_id, COUNT(*) FROM captures GROUP BY user_id;
+    """
+    )
+    cur.execute("CREATE INDEX scores_total ON scores(total DESC, last_capture);")
+    cur.execute(
+        """
+        CREATE TABLE leaderboard_version (
+          id INTEGER PRIMARY KEY CHECK (id=0),
+          version INTEGER NOT NULL
+        );
+    """
+    )
+    cur.execute("INSERT INTO leaderboard_version (id, version) VALUES (0, 0);")
+
+
+def _migrate_ports(cur):
+    """Adds a ports table recording which host ports the port allocator has
+    handed out, and to what container or compose project"""
+
+    cur.execute(
+        """
+        CREATE TABLE ports (
+          port INTEGER PRIMARY KEY,
+          owner TEXT NOT NULL
+        );
+    """
+    )
+    cur.execute("CREATE INDEX ports_owner ON ports(owner);")
+
+
+def _migrate_prompt_templates(cur):
+    """Adds template and params columns to challenges so prompts can be stored
+    as a template reference instead of rendered HTML"""
+
+    cur.execute("ALTER TABLE challenges ADD COLUMN template TEXT;")
+    cur.execute("ALTER TABLE challenges ADD COLUMN params TEXT;")
+
+
+def _migrate_hosts(cur):
+    """Adds a host column to challenges and env_pool recording which Docker
+    engine their environment runs on. Everything so far ran on DOCKER_HOST,
+    see challenges/hosts.py."""
+
+    cur.execute("ALTER TABLE challenges ADD COLUMN host TEXT;")
+    cur.execute("ALTER TABLE env_pool ADD COLUMN host TEXT;")
+    cur.execute("UPDATE challenges SET host='local';")
+    cur.execute("UPDATE env_pool SET host='local';")
+
+
+def _migrate_activity(cur):
+    """Adds when a challenge was last used and whether its environment is
+    paused to challenges"""
+
+    cur.execute("ALTER TABLE challenges ADD COLUMN last_active INTEGER;")
+    cur.execute("ALTER TABLE challenges ADD COLUMN paused INTEGER NOT NULL DEFAULT 0;")
+
+
+def _migrate_score_times(cur):
+    """Fills in last_capture for scores backfilled from captures, which was
+    left NULL and so won every tie. Captures don't record when they happened,
+    so the rowid of each user's latest capture stands in for it. That keeps
+    them in the order they captured and, being far below any epoch time,
+    ahead of ties with everyone who captured after the upgrade."""
+
+    cur.execute(
+        """
+        UPDATE scores SET last_capture=(
+          SELECT MAX(rowid) FROM captures WHERE captures.user_id=scores.user_id
+        )
+        WHERE last_capture IS NULL;
     """
     )
 
 
+# Each migration upgrades the DB by one version (stored in PRAGMA user_version).
+# Only ever add to the end of this list.
+MIGRATIONS = [
+    _migrate_challenge_states,
+    _migrate_auto_logout_index,
+    _migrate_epoch_timestamps,
+    _migrate_capture_indexes,
+    _migrate_scores,
+    _migrate_ports,
+    _migrate_prompt_templates,
+    _migrate_hosts,
+    _migrate_activity,
+    _migrate_score_times,
+]
+
+
+def migrate(conn):
+    """Upgrades a database in place by running any migrations it hasn't had,
+    each in its own transaction"""
+
+    cur = conn.cursor()
+    version = cur.execute("PRAGMA user_version;").fetchone()[0]
+
+    for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        print(f"Migrating database to version {number} ({migration.__name__})")
+        cur.execute("BEGIN;")
+        try:
+            migration(cur)
+            cur.execute(f"PRAGMA user_version = {number};")
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+        conn.commit()
+
+
 def add_challenge(conn, user_id, name, prompt, end_cmd, cwd, flag):
     """Adds an active challenge to the challenges table"""
 
@@ -66,6 +379,168 @@ def add_challenge(conn, user_id, name, prompt, end_cmd, cwd, flag):
     )
 
 
+def add_provisioning_challenge(conn, user_id, name, flag):
+    """Adds a challenge that is still starting to the challenges table and
+    returns its id"""
+
+    cur = conn.cursor()
+    cur.execute(
+        "INSERT INTO challenges (user_id, name, prompt, flag, state) VALUES (?, ?, '', ?, ?);",
+        (user_id, name, flag, STATE_PROVISIONING),
+    )
+    return cur.lastrowid
+
+
+def finish_challenge(conn, challenge_id, prompt, template, params, end_cmd, cwd):
+    """Marks a provisioning challenge as ready. Returns False if the row is
+    gone because the challenge was stopped while it was starting."""
+
+    cur = conn.cursor()
+    cur.execute(
+        """
+        UPDATE challenges
+        SET prompt=?, template=?, params=?, end_cmd=?, cwd=?, state=?, last_active=?
+        WHERE id=? AND state=?;
+    """,
+        (
+            prompt,
+            template,
+            params,
+            end_cmd,
+            cwd,
+            STATE_READY,
+            int(time.time()),
+            challenge_id,
+            STATE_PROVISIONING,
+        ),
+    )
+    return cur.rowcount > 0
+
+
+def set_challenge_host(conn, challenge_id, host):
+    """Records the Docker engine a challenge was placed on"""
+
+    cur = conn.cursor()
+    cur.execute("UPDATE challenges SET host=? WHERE id=?;", (host, challenge_id))
+
+
+def count_placed_challenges(conn):
+    """Returns a dict of Docker engine to the number of challenges starting or
+    running on it"""
+
+    cur = conn.cursor()
+    res = cur.execute(
+        "SELECT host, COUNT(*) FROM challenges WHERE state != ? GROUP BY host;",
+        (STATE_FAILED,),
+    )
+    return dict(res.fetchall())
+
+
+def count_placed_by_name(conn):
+    """Returns a dict of (Docker engine, challenge name) to the number of
+    challenges starting or running"""
+
+    cur = conn.cursor()
+    res = cur.execute(
+        """
+        SELECT host, name, COUNT(*) FROM challenges WHERE state != ?
+        GROUP BY host, name;
+    """,
+        (STATE_FAILED,),
+    )
+    return {(host, name): count for host, name, count in res.fetchall()}
+
+
+def fail_challenge(conn, challenge_id, error):
+    """Records why a provisioning challenge failed to start"""
+
+    cur = conn.cursor()
+    cur.execute(
+        "UPDATE challenges SET state=?, error=? WHERE id=?;",
+        (STATE_FAILED, error, challenge_id),
+    )
+
+
+def fail_challenges(conn, challenge_ids, error):
+    """Marks several challenges as failed with the same error"""
+
+    cur = conn.cursor()
+    cur.executemany(
+        "UPDATE challenges SET state=?, error=? WHERE id=?;",
+        [(STATE_FAILED, error, challenge_id) for challenge_id in challenge_ids],
+    )
+
+
+def get_challenge_envs(conn):
+    """Gets the id, state, end_cmd and host of every active challenge"""
+
+    cur = conn.cursor()
+    res = cur.execute("SELECT id, state, end_cmd, host FROM challenges;")
+    return res.fetchall()
+
+
+def touch_challenge(conn, challenge_id):
+    """Records that a challenge is being used"""
+
+    cur = conn.cursor()
+    cur.execute(
+        "UPDATE challenges SET last_active=? WHERE id=?;",
+        (int(time.time()), challenge_id),
+    )
+
+
+def set_paused(conn, challenge_id, paused):
+    """Records whether a challenge's environment is paused"""
+
+    cur = conn.cursor()
+    cur.execute(
+        "UPDATE challenges SET paused=? WHERE id=?;", (int(paused), challenge_id)
+    )
+
+
+def pause_challenge(conn, challenge_id, cutoff):
+    """Marks a challenge's environment as paused if it hasn't been used since
+    cutoff, returning whether it was"""
+
+    cur = conn.cursor()
+    cur.execute(
+        "UPDATE challenges SET paused=1 WHERE id=? AND paused=0 AND last_active < ?;",
+        (challenge_id, cutoff),
+    )
+    return cur.rowcount > 0
+
+
+def get_running_envs(conn):
+    """Gets the id, end_cmd, cwd, host and last_active of every challenge with
+    an environment that is running and not paused"""
+
+    cur = conn.cursor()
+    res = cur.execute(
+        """
+        SELECT id, end_cmd, cwd, host, last_active FROM challenges
+        WHERE state=? AND paused=0 AND end_cmd IS NOT NULL;
+    """,
+        (STATE_READY,),
+    )
+    return res.fetchall()
+
+
+def count_paused_envs(conn):
+    """Returns a dict with the number of challenge environments that are
+    running and paused"""
+
+    cur = conn.cursor()
+    res = cur.execute(
+        """
+        SELECT paused, COUNT(*) FROM challenges
+        WHERE state=? AND end_cmd IS NOT NULL GROUP BY paused;
+    """,
+        (STATE_READY,),
+    )
+    counts = dict(res.fetchall())
+    return {"running": counts.get(0, 0), "paused": counts.get(1, 0)}
+
+
 def del_challenge(conn, user_id):
     """Deletes the active challenge based on user_id"""
 
@@ -73,6 +548,15 @@ def del_challenge(conn, user_id):
     cur.execute("DELETE FROM challenges WHERE user_id=?;", (user_id,))
 
 
+def del_challenges(conn, user_ids):
+    """Deletes the active challenges of several users"""
+
+    cur = conn.cursor()
+    cur.executemany(
+        "DELETE FROM challenges WHERE user_id=?;", [(user_id,) for user_id in user_ids]
+    )
+
+
 def get_challenge(conn, user_id):
     """Gets the active challenge based on user_id"""
 
@@ -81,6 +565,107 @@ def get_challenge(conn, user_id):
     return res.fetchone()
 
 
+def count_active_challenges(conn):
+    """Returns a dict of challenge name to the number of users that have it
+    starting or running. Failed challenges don't hold anything."""
+
+    cur = conn.cursor()
+    res = cur.execute(
+        "SELECT name, COUNT(*) FROM challenges WHERE state != ? GROUP BY name;",
+        (STATE_FAILED,),
+    )
+    return dict(res.fetchall())
+
+
+def get_ports(conn):
+    """Gets every allocated host port and its owner"""
+
+    cur = conn.cursor()
+    res = cur.execute("SELECT port, owner FROM ports;")
+    return res.fetchall()
+
+
+def add_port(conn, port, owner):
+    """Records that a host port has been allocated to an owner"""
+
+    cur = conn.cursor()
+    cur.execute(
+        "INSERT OR REPLACE INTO ports (port, owner) VALUES (?, ?);", (port, owner)
+    )
+
+
+def del_ports(conn, owner):
+    """Frees every host port allocated to an owner, returning them"""
+
+    cur = conn.cursor()
+    res = cur.execute("DELETE FROM ports WHERE owner=? RETURNING port;", (owner,))
+    return [row[0] for row in res.fetchall()]
+
+
+def count_logged_in_users(conn):
+    """Counts the users that are logged in"""
+
+    cur = conn.cursor()
+    res = cur.execute("SELECT COUNT(*) FROM users WHERE auto_logout_time IS NOT NULL;")
+    return res.fetchone()[0]
+
+
+def add_pooled_env(conn, name, port, client_config, end_cmd, cwd, host):
+    """Adds an environment that has been brought up ahead of time to the pool"""
+
+    cur = conn.cursor()
+    cur.execute(
+        "INSERT INTO env_pool (name, port, client_config, end_cmd, cwd, host) VALUES (?, ?, ?, ?, ?, ?);",
+        (name, port, client_config, end_cmd, cwd, host),
+    )
+
+
+def claim_pooled_env(conn, name, host):
+    """Removes the oldest pooled environment for a challenge on a Docker engine
+    from the pool and returns it, or None if the pool is empty"""
+
+    cur = conn.cursor()
+    res = cur.execute(
+        """
+        DELETE FROM env_pool
+        WHERE id=(
+          SELECT id FROM env_pool WHERE name=? AND host=? ORDER BY id LIMIT 1
+        )
+        RETURNING *;
+    """,
+        (name, host),
+    )
+    return res.fetchone()
+
+
+def count_pooled_envs(conn, name, host):
+    """Counts the pooled environments waiting for a challenge on a Docker
+    engine"""
+
+    cur = conn.cursor()
+    res = cur.execute(
+        "SELECT COUNT(*) FROM env_pool WHERE name=? AND host=?;", (name, host)
+    )
+    return res.fetchone()[0]
+
+
+def get_pooled_envs(conn):
+    """Gets the id, end_cmd and host of every pooled environment"""
+
+    cur = conn.cursor()
+    res = cur.execute("SELECT id, end_cmd, host FROM env_pool;")
+    return res.fetchall()
+
+
+def del_pooled_envs(conn, env_ids):
+    """Removes several environments from the pool"""
+
+    cur = conn.cursor()
+    cur.executemany(
+        "DELETE FROM env_pool WHERE id=?;", [(env_id,) for env_id in env_ids]
+    )
+
+
 def add_user(conn, name, password, role):
     """Adds a user to the user table"""
 
@@ -91,11 +676,32 @@ def add_user(conn, name, password, role):
     )
 
 
+def add_users(conn, users):
+    """Adds several (name, password, role) users to the user table"""
+
+    cur = conn.cursor()
+    cur.executemany("INSERT INTO users (name, password, role) VALUES (?, ?, ?);", users)
+
+
+def get_existing_user_names(conn, names):
+    """Returns the set of names in a list that are already used by users"""
+
+    cur = conn.cursor()
+
+    res = cur.execute(
+        "SELECT name FROM users WHERE name IN (SELECT value FROM json_each(?));",
+        (json.dumps(names),),
+    )
+    return {row["name"] for row in res}
+
+
 def del_user(conn, user_id):
     """Deletes a user from the user table"""
 
     cur = conn.cursor()
     cur.execute("DELETE FROM users WHERE id=?;", (user_id,))
+    cur.execute("DELETE FROM scores WHERE user_id=?;", (user_id,))
+    _bump_leaderboard_version(cur)
 
 
 def get_user(conn, user_id):
@@ -106,10 +712,27 @@ def get_user(conn, user_id):
     res = cur.execute(
         """
         SELECT id, name, role,
-        CAST(((JULIANDAY(auto_logout_time)-JULIANDAY('now')) * 24 * 60) AS INTEGER)
-        AS time_remaining
+        (auto_logout_time - ?) / 60 AS time_remaining
         FROM users
         WHERE id=?;
+    """,
+        (int(time.time()), user_id),
+    )
+    return res.fetchone()
+
+
+def get_user_session(conn, user_id):
+    """Retrieves what Flask-Login needs to know about a user on each request,
+    their automatic logout time and the name of their active challenge"""
+
+    cur = conn.cursor()
+
+    res = cur.execute(
+        """
+        SELECT users.id, users.name, users.role, users.auto_logout_time,
+        challenges.name AS active_challenge
+        FROM users LEFT JOIN challenges ON challenges.user_id=users.id
+        WHERE users.id=?;
     """,
         (user_id,),
     )
@@ -124,10 +747,10 @@ def get_all_users(conn):
     res = cur.execute(
         """
         SELECT id, name, role,
-        CAST(((JULIANDAY(auto_logout_time)-JULIANDAY('now')) * 24 * 60) AS INTEGER)
-        AS time_remaining
+        (auto_logout_time - ?) / 60 AS time_remaining
         FROM users;
-    """
+    """,
+        (int(time.time()),),
     )
     return res.fetchall()
 
@@ -149,6 +772,8 @@ def update_user(conn, user_id, name, role):
     cur = conn.cursor()
 
     cur.execute("UPDATE users SET name=?, role=? WHERE id=?;", (name, role, user_id))
+    # the name may be on the leaderboard
+    _bump_leaderboard_version(cur)
 
 
 def update_user_password(conn, user_id, password):
@@ -164,13 +789,11 @@ def set_auto_logout(conn, user_id, duration):
 
     cur = conn.cursor()
 
+    auto_logout_time = int(time.time()) + int(duration) * 60
     cur.execute(
-        """
-        UPDATE users
-        SET auto_logout_time=DATETIME('now', ? || ' minutes')
-        WHERE id=?;""",
-        (duration, user_id),
+        "UPDATE users SET auto_logout_time=? WHERE id=?;", (auto_logout_time, user_id)
     )
+    _auto_logout_changed(conn, user_id, auto_logout_time)
 
 
 def clear_auto_logout(conn, user_id):
@@ -179,15 +802,47 @@ def clear_auto_logout(conn, user_id):
     cur = conn.cursor()
 
     cur.execute("UPDATE users SET auto_logout_time=NULL WHERE id=?;", (user_id,))
+    _auto_logout_changed(conn, user_id, None)
 
 
-def get_expired_users(conn):
-    """Gets a list of users who are past their auto logout time"""
+def clear_auto_logouts(conn, user_ids):
+    """Sets the automatic logout time of several users to NULL"""
+
+    cur = conn.cursor()
+
+    cur.executemany(
+        "UPDATE users SET auto_logout_time=NULL WHERE id=?;",
+        [(user_id,) for user_id in user_ids],
+    )
+    for user_id in user_ids:
+        _auto_logout_changed(conn, user_id, None)
+
+
+def get_auto_logout_times(conn):
+    """Gets the automatic logout time of each logged in user"""
+
+    cur = conn.cursor()
+
+    res = cur.execute(
+        "SELECT id, auto_logout_time FROM users WHERE auto_logout_time IS NOT NULL;"
+    )
+    return res.fetchall()
+
+
+def get_expired_challenges(conn):
+    """Gets every user who is past their auto logout time along with their
+    active challenge, if they have one"""
 
     cur = conn.cursor()
 
     res = cur.execute(
-        "SELECT id FROM users WHERE auto_logout_time < CURRENT_TIMESTAMP;"
+        """
+        SELECT users.id AS user_id, challenges.name, challenges.end_cmd, challenges.cwd,
+          challenges.host
+        FROM users LEFT JOIN challenges ON challenges.user_id=users.id
+        WHERE users.auto_logout_time < ?;
+    """,
+        (int(time.time()),),
     )
     return res.fetchall()
 
@@ -203,27 +858,85 @@ def get_capture(conn, user_id, name):
     return res.fetchone()
 
 
+def _bump_leaderboard_version(cur):
+    """Marks any cached copies of the leaderboard as out of date"""
+
+    cur.execute("UPDATE leaderboard_version SET version=version+1 WHERE id=0;")
+
+
 def capture_flag(conn, user_id, name):
-    """Adds a captured flag to the captures table"""
+    """Adds a captured flag to the captures table and updates the user's score
+    in the same transaction"""
 
     cur = conn.cursor()
 
     cur.execute("INSERT INTO captures (user_id, name) VALUES (?, ?);", (user_id, name))
+    cur.execute(
+        """
+        INSERT INTO scores (user_id, total, last_capture) VALUES (?, 1, ?)
+        ON CONFLICT(user_id) DO UPDATE SET total=total+1, last_capture=excluded.last_capture;
+    """,
+        (user_id, int(time.time())),
+    )
+    _bump_leaderboard_version(cur)
+
+
+def get_leaderboard_version(conn):
+    """Gets a number that changes whenever the leaderboard does"""
+
+    cur = conn.cursor()
 
+    res = cur.execute("SELECT version FROM leaderboard_version WHERE id=0;")
+    return res.fetchone()[0]
 
-def get_leaderboard(conn):
-    """Gets the data needed to make a leaderboard display"""
+
+def get_score(conn, user_id):
+    """Gets the number of flags a user has captured"""
+
+    cur = conn.cursor()
+
+    res = cur.execute("SELECT total FROM scores WHERE user_id=?;", (user_id,))
+    row = res.fetchone()
+    return row["total"] if row else 0
+
+
+def count_scores(conn):
+    """Gets the number of users on the leaderboard"""
+
+    cur = conn.cursor()
+
+    res = cur.execute("SELECT COUNT(*) FROM scores;")
+    return res.fetchone()[0]
+
+
+def get_leaderboard(conn, limit, offset=0):
+    """Gets a page of the leaderboard, highest score first (ties go to whoever
+    got there first), with a list of the challenges each user captured"""
 
     cur = conn.cursor()
 
     res = cur.execute(
         """
-        SELECT users.name, GROUP_CONCAT(captures.name) AS captured, COUNT(user_id) AS total
-        FROM captures, users
-        WHERE user_id=users.id
-        GROUP BY user_id
-        ORDER BY total DESC;
-        """
+        SELECT users.id, users.name, scores.total
+        FROM scores JOIN users ON users.id=scores.user_id
+        ORDER BY scores.total DESC, scores.last_capture
+        LIMIT ? OFFSET ?;
+        """,
+        (limit, offset),
     )
-
-    return res.fetchall()
+    leaderboard = [
+        {"id": row["id"], "name": row["name"], "total": row["total"], "captured": []}
+        for row in res.fetchall()
+    ]
+
+    by_id = {row["id"]: row for row in leaderboard}
+    if by_id:
+        placeholders = ", ".join("?" * len(by_id))
+        res = cur.execute(
+            f"SELECT user_id, name FROM captures WHERE user_id IN ({placeholders}) ORDER BY name;",
+            list(by_id),
+        )
+        for row in res:
+            by_id[row["user_id"]]["captured"].append(row["name"])
+
+    return leaderboard
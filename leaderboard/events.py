@@ -0,0 +1,54 @@
+"""Fans leaderboard changes out to every browser watching the leaderboard"""
+
+import os
+import queue
+import threading
+
+BACKLOG = 64  # events a slow subscriber can fall behind by
+# open streams allowed at once, each one holds a server thread
+MAX_SUBSCRIBERS = int(os.getenv("LEADERBOARD_STREAMS", "16"))
+
+
+class Broadcaster:
+    """Each subscriber gets its own queue and publish() puts the same event in
+    all of them. A subscriber that falls too far behind is told to reload
+    instead. There can be at most limit subscribers, None for no limit."""
+
+    def __init__(self, limit=None):
+        self.subscribers = set()
+        self.limit = limit
+        self.lock = threading.Lock()
+
+    def subscribe(self):
+        """Returns a new queue that will receive events, or None if there are
+        already as many subscribers as the limit"""
+
+        subscription = queue.Queue(maxsize=BACKLOG)
+        with self.lock:
+            if self.limit is not None and len(self.subscribers) >= self.limit:
+                return None
+            self.subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        """Stops sending events to a queue"""
+
+        with self.lock:
+            self.subscribers.discard(subscription)
+
+    def publish(self, event, data):
+        """Sends an (event, data) pair to every subscriber"""
+
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for subscription in subscribers:
+            try:
+                subscription.put_nowait((event, data))
+            except queue.Full:
+                # they missed too much, drop the backlog and start over
+                with subscription.mutex:
+                    subscription.queue.clear()
+                subscription.put_nowait(("reload", {}))
+
+
+BROADCASTER = Broadcaster(MAX_SUBSCRIBERS)
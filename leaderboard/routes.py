@@ -1,20 +1,130 @@
 """Routes for the Leaderboard tab"""
 
-from flask import Blueprint, render_template
+import collections
+import json
+import queue
+import threading
+import time
+
+from flask import Blueprint, Response, render_template, request
 from flask_login import login_required
+from markupsafe import Markup
 
 import db
+from leaderboard.events import BROADCASTER
 
 leaderboard_bp = Blueprint("leaderboard", __name__, template_folder="templates")
 
+PER_PAGE = 50  # users per page of the leaderboard
+MAX_PER_PAGE = 500
+CACHE_SIZE = 32  # rendered pages to keep
+KEEPALIVE = 15  # seconds between comments on an idle event stream
+STREAM_LIFETIME = 10 * 60  # seconds before a stream ends and the browser reconnects
+REFRESH_INTERVAL = 60  # seconds between reloads for pages that can't get a stream
+
+# rendered leaderboard tables keyed by (page, per_page), each stored with the
+# leaderboard version it was rendered from so a new capture invalidates it
+_cache = collections.OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def render_table(conn, page, per_page):
+    """Renders a page of the leaderboard table, reusing the cached copy if the
+    leaderboard hasn't changed since it was rendered"""
+
+    version = db.get_leaderboard_version(conn)
+    key = (page, per_page)
+
+    with _cache_lock:
+        cached = _cache.get(key)
+        if cached and cached[0] == version:
+            _cache.move_to_end(key)
+            return cached[1]
+
+    offset = (page - 1) * per_page
+    rows = db.get_leaderboard(conn, per_page, offset)
+    table = render_template("leaderboard_table.html", leaderboard=rows, offset=offset)
+
+    with _cache_lock:
+        _cache[key] = (version, table)
+        _cache.move_to_end(key)
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+
+    return table
+
 
 @leaderboard_bp.route("/leaderboard", methods=["GET"])
 @login_required
 def leaderboard():
-    """This endpoint allows a user to see the leaderboard"""
+    """This endpoint allows a user to see the leaderboard. It takes an optional
+    page number and per_page, or top to only show the top N users."""
+
+    top = request.args.get("top", type=int)
+    if top:
+        page, per_page = 1, top
+    else:
+        page = request.args.get("page", default=1, type=int)
+        per_page = request.args.get("per_page", default=PER_PAGE, type=int)
+    page = max(page, 1)
+    per_page = min(max(per_page, 1), MAX_PER_PAGE)
 
     conn = db.get_connection()
+    table = render_table(conn, page, per_page)
+    pages = 1 if top else max(-(-db.count_scores(conn) // per_page), 1)
+
+    return render_template(
+        "leaderboard.html",
+        table=Markup(table),  # already escaped by leaderboard_table.html
+        page=page,
+        pages=pages,
+        per_page=per_page,
+        refresh_interval=REFRESH_INTERVAL,
+    )
+
+
+def publish_capture(conn, user_id, name, challenge_name):
+    """Pushes a capture to everyone watching the leaderboard. Call this after
+    the capture has been committed."""
+
+    BROADCASTER.publish(
+        "capture",
+        {
+            "name": name,
+            "challenge": challenge_name,
+            "total": db.get_score(conn, user_id),
+        },
+    )
+
+
+@leaderboard_bp.route("/leaderboard/events", methods=["GET"])
+@login_required
+def leaderboard_events():
+    """A Server-Sent Events stream of changes to the leaderboard so the page
+    can update itself instead of being reloaded. Past the limit on streams a
+    204 tells the browser not to reconnect and the page reloads itself every
+    REFRESH_INTERVAL instead."""
+
+    subscription = BROADCASTER.subscribe()
+    if subscription is None:
+        return "", 204
 
-    leaderboard_data = db.get_leaderboard(conn)
+    def stream():
+        try:
+            yield "retry: 5000\n\n"
+            end = time.monotonic() + STREAM_LIFETIME
+            while time.monotonic() < end:
+                try:
+                    event, data = subscription.get(timeout=KEEPALIVE)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+        finally:
+            BROADCASTER.unsubscribe(subscription)
 
-    return render_template("leaderboard.html", leaderboard=leaderboard_data)
+    return Response(
+        stream(),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
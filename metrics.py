@@ -0,0 +1,128 @@
+"""Prometheus style metrics without any dependencies. Histograms are updated
+as things happen and gauges are read when /metrics is scraped."""
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+# upper bounds in seconds, from a fast SQLite query to a slow compose up
+BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+REGISTRY = []
+
+
+def _format_labels(names, values, extra=None):
+    """Formats a label set as {name="value",...}"""
+
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Histogram:
+    """Counts observations into cumulative buckets for each set of label
+    values, along with their sum"""
+
+    def __init__(self, name, documentation, labels=(), buckets=BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = buckets
+        self.series = {}  # label values -> [bucket counts..., count, sum]
+        self.lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def observe(self, value, *label_values):
+        """Records one observation"""
+
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(label_values)
+            if series is None:
+                series = self.series[label_values] = [0] * (len(self.buckets) + 2)
+            series[index] += 1  # index == len(buckets) is the +Inf bucket
+            series[-1] += value
+
+    @contextmanager
+    def time(self, *label_values):
+        """Observes how long the body of a with statement takes"""
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *label_values)
+
+    def collect(self):
+        """Returns the lines for this histogram in the text format"""
+
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} histogram",
+        ]
+        with self.lock:
+            series = {key: list(value) for key, value in self.series.items()}
+        for label_values, counts in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                labels = _format_labels(self.labels, label_values, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labels, label_values)
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+            lines.append(f"{self.name}_sum{labels} {counts[-1]}")
+        return lines
+
+
+class Gauge:
+    """A value read by calling a function when metrics are collected. The
+    function returns a number, or a dict of label value tuples to numbers."""
+
+    def __init__(self, name, documentation, function, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.function = function
+        self.labels = labels
+        REGISTRY.append(self)
+
+    def collect(self):
+        """Returns the lines for this gauge in the text format"""
+
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} gauge",
+        ]
+        values = self.function()
+        if not isinstance(values, dict):
+            values = {(): values}
+        for label_values, value in sorted(values.items()):
+            labels = _format_labels(self.labels, label_values)
+            lines.append(f"{self.name}{labels} {value}")
+        return lines
+
+
+def render():
+    """Returns every metric in the Prometheus text format"""
+
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.collect())
+    return "\n".join(lines) + "\n"
+
+
+CHALLENGE_START = Histogram(
+    "challenge_start_seconds", "Time spent in challenge start()", ("challenge",)
+)
+DOCKER_API = Histogram(
+    "docker_api_seconds", "Docker Engine API requests", ("method", "endpoint")
+)
+DOCKER_COMMAND = Histogram(
+    "docker_command_seconds", "Docker CLI subprocesses", ("command",)
+)
+CLEANUP = Histogram("cleanup_seconds", "Runs of scheduler.cleanup()")
+PASSWORD = Histogram(
+    "password_seconds", "bcrypt hashing and checking", ("operation",)
+)
+DB_QUERY = Histogram("db_query_seconds", "SQLite statements", ("query",))
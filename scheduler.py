@@ -1,27 +1,161 @@
-"""The scheduler functions are used to perform maintenance tasks at regular
-intervals"""
+"""The scheduler functions are used to perform maintenance tasks when users'
+time runs out and at regular intervals"""
 
-import subprocess
+import heapq
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
 
 import db
+from challenges import admission, docker, hosts, pool
+from metrics import CLEANUP
 
-PROCESS_TIMEOUT = 30
+CLEANUP_WORKERS = 8  # challenges torn down at the same time
+SAFETY_INTERVAL = 10 * 60  # seconds between full scans for expired users
+GRACE = 1  # seconds after a deadline before the DB considers it expired
+RETRY_DELAY = 30  # seconds before trying again to stop a challenge that failed to stop
 
+_executor = ThreadPoolExecutor(
+    max_workers=CLEANUP_WORKERS, thread_name_prefix="cleanup"
+)
+
+
+def teardown(row):
+    """Stops the challenge in a row from db.get_expired_challenges, returning
+    whether it succeeded. Any error only fails this row, so it can't stop the
+    rest of the batch from being cleaned up."""
+
+    if not row["end_cmd"]:
+        return True
+    try:
+        docker.end(row["end_cmd"], row["cwd"], hosts.get(row["host"]))
+    except Exception:  # pylint: disable=broad-exception-caught
+        traceback.print_exc()
+        return False
+    return True
+
+
+@CLEANUP.time()
 def cleanup():
-    """This function is called every minute to clean up users that need to be
-    logged out. It also stops their challenge if they have one."""
+    """This function is called when a user's time runs out (and every so often
+    as a safety net) to clean up users that need to be logged out. It also
+    stops their challenge if they have one.
+
+    Challenges are torn down in parallel. Users whose challenge fails to stop
+    are left as they are and tried again after RETRY_DELAY."""
 
     conn = db.get_connection()
 
-    for user in db.get_expired_users(conn):
-        user_id = user["id"]
-        db.clear_auto_logout(conn, user_id)
-        challenge_row = db.get_challenge(conn, user_id)
-        if challenge_row:
-            end_cmd = challenge_row['end_cmd']
-            cwd = challenge_row['cwd']
-            if end_cmd:
-                subprocess.run(end_cmd, shell=True, cwd=cwd, timeout=PROCESS_TIMEOUT, check=True)
-            db.del_challenge(conn, user_id)
-        conn.commit()
-    conn.close()
+    rows = db.get_expired_challenges(conn)
+    results = _executor.map(teardown, rows)
+    done = []
+    failed = []
+    for row, stopped in zip(rows, results):
+        (done if stopped else failed).append(row)
+
+    user_ids = [row["user_id"] for row in done]
+    db.clear_auto_logouts(conn, user_ids)
+    db.del_challenges(conn, user_ids)
+    conn.commit()
+
+    for row in done:
+        if row["name"]:
+            pool.released(row["name"])
+    if done:
+        admission.released()
+    DEADLINES.retry([row["user_id"] for row in failed])
+
+
+def cleanup_job(app):
+    """Runs cleanup() in an app context for the background scheduler"""
+
+    with app.app_context():
+        cleanup()
+
+
+class Deadlines:
+    """A heap of automatic logout deadlines. A background thread sleeps until
+    the earliest one and then runs cleanup(), so users are logged out when
+    their time is up instead of on the next minute. It is kept up to date by
+    db.set_auto_logout and db.clear_auto_logout."""
+
+    def __init__(self):
+        self.app = None
+        self.heap = []  # (deadline, user_id), may contain stale entries
+        self.deadlines = {}  # user_id: deadline, the current ones
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self, app):
+        """Seeds the heap from the DB and starts the background thread"""
+
+        self.app = app
+        with app.app_context():
+            conn = db.get_connection()
+            rows = db.get_auto_logout_times(conn)
+        for row in rows:
+            self.update(row["id"], row["auto_logout_time"])
+        db.on_auto_logout_change(self.update)
+        if not self.thread.is_alive():
+            self.thread.start()
+
+    def update(self, user_id, deadline):
+        """Sets or clears (if deadline is None) the deadline for a user"""
+
+        with self.condition:
+            if deadline is None:
+                # the heap entry is skipped when it reaches the top
+                self.deadlines.pop(user_id, None)
+                return
+            deadline += GRACE
+            self.deadlines[user_id] = deadline
+            heapq.heappush(self.heap, (deadline, user_id))
+            if self.heap[0] == (deadline, user_id):
+                self.condition.notify()
+
+    def wait(self):
+        """Waits for the next deadline to pass, then pops every deadline that
+        has"""
+
+        with self.condition:
+            while True:
+                while self.heap and self.deadlines.get(self.heap[0][1]) != self.heap[0][0]:
+                    heapq.heappop(self.heap)
+                if self.heap and self.heap[0][0] <= time.time():
+                    break
+                timeout = self.heap[0][0] - time.time() if self.heap else None
+                self.condition.wait(timeout)
+
+            now = time.time()
+            while self.heap and self.heap[0][0] <= now:
+                deadline, user_id = heapq.heappop(self.heap)
+                # a stale entry mustn't drop the user's newer deadline
+                if self.deadlines.get(user_id) == deadline:
+                    del self.deadlines[user_id]
+
+    def retry(self, user_ids):
+        """Runs cleanup() again after RETRY_DELAY for users whose challenge
+        failed to stop, unless they already have a deadline coming up"""
+
+        deadline = time.time() + RETRY_DELAY
+        with self.condition:
+            for user_id in user_ids:
+                if user_id in self.deadlines:
+                    continue
+                self.deadlines[user_id] = deadline
+                heapq.heappush(self.heap, (deadline, user_id))
+            self.condition.notify()
+
+    def run(self):
+        """Runs forever in a background thread, cleaning up at each deadline"""
+
+        while True:
+            self.wait()
+            try:
+                cleanup_job(self.app)
+            except Exception:  # pylint: disable=broad-exception-caught
+                traceback.print_exc()
+
+
+DEADLINES = Deadlines()
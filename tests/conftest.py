@@ -4,13 +4,16 @@ import pytest
 from bs4 import BeautifulSoup
 
 from app import create_app
+from challenges import docker_api, hosts, images
+from fake_docker import FakeEngine
 
 TEST_DB_FILE = 'test.db'
 
 @pytest.fixture()
 def app():
-    if os.path.exists(TEST_DB_FILE):
-        os.remove(TEST_DB_FILE)
+    for path in (TEST_DB_FILE, TEST_DB_FILE + '-wal', TEST_DB_FILE + '-shm'):
+        if os.path.exists(path):
+            os.remove(path)
     os.environ['DB_FILE'] = TEST_DB_FILE
     app = create_app()
     app.config.update({
@@ -23,18 +26,55 @@ def app():
 def client(app):
     return app.test_client()
 
-@pytest.fixture()
-def admin_logged_in(client):
-    username = "admin"
-    password = os.getenv("DEFAULT_ADMIN_PASSWORD")
+def log_in(client, username, password):
+    """Posts the login form with a client, returning the response"""
 
     response = client.get('/login')
     soup = BeautifulSoup(response.text, features="html.parser")
     csrf_token = soup.find(id="csrf_token")['value']
-    response = client.post('/login', data={
+    return client.post('/login', data={
         "csrf_token": csrf_token, 
         "username"  : username,
         "password"  : password,})
+
+@pytest.fixture()
+def login():
+    return log_in
+
+@pytest.fixture()
+def admin_logged_in(client):
+    response = log_in(client, "admin", os.getenv("DEFAULT_ADMIN_PASSWORD"))
     assert response.status_code == 302
 
     yield client
+
+@pytest.fixture()
+def fake_engine(monkeypatch):
+    engine = FakeEngine()
+    client = docker_api.Client(engine.url)
+    monkeypatch.setattr(docker_api, '_client', client)
+
+    yield engine
+
+    client.close()
+    engine.stop()
+
+@pytest.fixture()
+def engines(monkeypatch):
+    """Two fake engines in hosts.HOSTS with every image ready"""
+
+    fakes = [FakeEngine(), FakeEngine()]
+    monkeypatch.setattr(
+        hosts,
+        "HOSTS",
+        hosts.parse(",".join(f"host{n}.example={e.url}" for n, e in enumerate(fakes))),
+    )
+    monkeypatch.setattr(images, "BUILD_IMAGES", False)
+    images.verify()
+
+    yield fakes
+
+    for host in hosts.HOSTS:
+        host.client.close()
+    for engine in fakes:
+        engine.stop()
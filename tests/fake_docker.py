@@ -0,0 +1,210 @@
+"""A fake Docker daemon that serves a subset of the Engine API over a unix
+socket, for testing challenges.docker_api without Docker"""
+
+import itertools
+import json
+import os
+import re
+import socketserver
+import struct
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+
+class FakeEngine(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Keeps containers in a dict and counts the connections it accepts"""
+
+    daemon_threads = True
+
+    def __init__(self, images=("challenge2", "challenge5", "wg_vpn")):
+        self.directory = tempfile.mkdtemp()
+        self.socket_path = os.path.join(self.directory, "docker.sock")
+        self.url = "unix://" + self.socket_path
+        self.images = set(images)
+        self.containers = {}
+        self.connections = 0
+        self.requests = []
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+        self.ports = itertools.count(32768)
+        super().__init__(self.socket_path, FakeHandler)
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Shuts the server down and removes the socket"""
+
+        self.shutdown()
+        self.server_close()
+        os.remove(self.socket_path)
+        os.rmdir(self.directory)
+
+
+def state_name(state):
+    """The State a container has in the container list"""
+
+    if state.get("Paused"):
+        return "paused"
+    return "running" if state["Running"] else "exited"
+
+
+class FakeHandler(BaseHTTPRequestHandler):
+    """Handles Engine API requests, keeping connections alive between them"""
+
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        pass
+
+    def address_string(self):
+        return "fake"
+
+    def send(self, status, body=b"", content_type="application/json"):
+        """Sends a response with a Content-Length so the connection stays open"""
+
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def route(self, method):
+        """Dispatches a request to a do_<action> method based on its path"""
+
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        length = int(self.headers.get("Content-Length") or 0)
+        body = json.loads(self.rfile.read(length)) if length else None
+        self.server.requests.append((method, url.path))
+
+        path = re.sub(r"^/v[0-9.]+", "", url.path)
+        if method == "GET" and path == "/containers/json":
+            return self.list()
+        if method == "GET" and path == "/images/json":
+            return self.list_images()
+        if method == "GET" and path == "/info":
+            return self.send(200, {"NCPU": 4, "MemTotal": 8 * 2**30})
+        match = re.fullmatch(r"/containers/([^/]+)(?:/(\w+))?", path)
+        if method == "POST" and path == "/containers/create":
+            return self.create(query, body)
+        if match:
+            name, action = match.groups()
+            container = self.find(name)
+            if container is None:
+                return self.send(404, {"message": f"No such container: {name}"})
+            return self.container_action(method, action or "", container, query)
+        return self.send(404, {"message": "page not found"})
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        self.route("GET")
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        self.route("POST")
+
+    def do_DELETE(self):  # pylint: disable=invalid-name
+        self.route("DELETE")
+
+    def find(self, name):
+        """Finds a container by full id, id prefix or name"""
+
+        for container in self.server.containers.values():
+            if container["Id"].startswith(name) or container["Name"] == name:
+                return container
+        return None
+
+    def list(self):
+        """GET /containers/json"""
+
+        return self.send(
+            200,
+            [
+                {
+                    "Id": container["Id"],
+                    "Names": ["/" + container["Name"]],
+                    "Labels": container["Config"].get("Labels") or {},
+                    "Created": container["Created"],
+                    "State": state_name(container["State"]),
+                }
+                for container in list(self.server.containers.values())
+            ],
+        )
+
+    def list_images(self):
+        """GET /images/json"""
+
+        return self.send(
+            200,
+            [
+                {"Id": f"sha256:{index:064x}", "RepoTags": [f"{image}:latest"], "Labels": None}
+                for index, image in enumerate(sorted(self.server.images))
+            ],
+        )
+
+    def create(self, query, body):
+        """POST /containers/create"""
+
+        if body["Image"] not in self.server.images:
+            return self.send(404, {"message": f"No such image: {body['Image']}"})
+        container_id = f"{next(self.server.ids):064x}"
+        name = query.get("name", [container_id[:12]])[0]
+        self.server.containers[container_id] = {
+            "Id": container_id,
+            "Name": name,
+            "Config": body,
+            "Created": int(time.time()),
+            "State": {"Running": False},
+            "NetworkSettings": {"Ports": {}},
+        }
+        return self.send(201, {"Id": container_id, "Warnings": []})
+
+    def container_action(self, method, action, container, query):
+        """Everything under /containers/{id}"""
+
+        state = container["State"]
+        if method == "POST" and action == "start":
+            if state["Running"]:
+                return self.send(304)
+            state["Running"] = True
+            bindings = container["Config"].get("HostConfig", {}).get("PortBindings")
+            for port, binding in (bindings or {}).items():
+                host_port = binding[0]["HostPort"] or str(next(self.server.ports))
+                container["NetworkSettings"]["Ports"][port] = [
+                    {"HostIp": "0.0.0.0", "HostPort": host_port},
+                    {"HostIp": "::", "HostPort": host_port},
+                ]
+            return self.send(204)
+        if method == "POST" and action in ("pause", "unpause"):
+            if state.get("Paused", False) == (action == "pause"):
+                return self.send(409, {"message": f"container is not {action}d"})
+            state["Paused"] = action == "pause"
+            return self.send(204)
+        if method == "GET" and action == "stats":
+            traffic = container.get("Traffic", 0)
+            return self.send(200, {"networks": {"eth0": {"rx_bytes": traffic, "tx_bytes": 0}}})
+        if method == "POST" and action == "stop":
+            if not state["Running"]:
+                return self.send(304)
+            state["Running"] = False
+            return self.send(204)
+        if method == "GET" and action == "json":
+            return self.send(200, container)
+        if method == "GET" and action == "logs":
+            payload = container.get("Logs", b"")
+            frame = struct.pack(">BxxxL", 1, len(payload)) + payload
+            return self.send(200, frame, "application/vnd.docker.raw-stream")
+        if method == "DELETE" and action == "":
+            if state["Running"] and query.get("force") != ["1"]:
+                return self.send(409, {"message": "container is running"})
+            del self.server.containers[container["Id"]]
+            return self.send(204)
+        return self.send(404, {"message": "page not found"})
@@ -0,0 +1,313 @@
+"""A load harness for the challenge lifecycle. Simulated users each get their
+own session and concurrently log in, start random challenges, submit flags
+and stop them. Latency percentiles per endpoint, errors and leaked
+environments are reported at the end.
+
+    python tests/load.py --users 100 --rounds 3 --backend fake
+
+The fake backend runs against FakeEngine in this process, so only single
+container challenges are used (compose needs the real docker CLI). The real
+backend uses the Docker daemon in DOCKER_HOST and every challenge."""
+
+import argparse
+import collections
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# pylint: disable=wrong-import-position
+import db
+from admin import passwords
+from challenges import docker, docker_api, hosts, images, pool
+from fake_docker import FakeEngine
+
+PASSWORD = "load-test"
+POLL_INTERVAL = 0.2  # seconds between checks on a starting challenge
+PROVISION_TIMEOUT = 60
+SETTLE_TIMEOUT = 30  # seconds to wait for teardowns to finish at the end
+MAX_RETRIES = 5
+MAX_RETRY_AFTER = 2  # seconds, we don't need to be that patient
+
+
+class FakeBackend:
+    """Runs challenges against an in-process FakeEngine"""
+
+    compose = False
+
+    def __init__(self):
+        self.engine = None
+        self.saved = None
+        self.build_images = None
+
+    def __enter__(self):
+        self.engine = FakeEngine()
+        self.saved = docker_api._client  # pylint: disable=protected-access
+        docker_api._client = docker_api.Client(self.engine.url)
+        # the fake engine's images are good enough, don't build real ones
+        self.build_images = images.BUILD_IMAGES
+        images.BUILD_IMAGES = False
+        return self
+
+    def __exit__(self, *exc_info):
+        docker_api._client.close()
+        docker_api._client = self.saved
+        images.BUILD_IMAGES = self.build_images
+        self.engine.stop()
+
+
+class DockerBackend:
+    """Runs challenges against the real Docker daemon"""
+
+    compose = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+BACKENDS = {"fake": FakeBackend, "docker": DockerBackend}
+
+
+class Stats:
+    """Latencies per endpoint and errors, shared by every simulated user"""
+
+    def __init__(self):
+        self.latencies = collections.defaultdict(list)
+        self.errors = collections.Counter()
+        self.busy = collections.Counter()  # 503s with Retry-After, retried
+        self.lock = threading.Lock()
+
+    def request(self, client, method, path, **kwargs):
+        """Makes a request through a test client and records how long it took,
+        counting server errors. Requests the server is too busy for are retried
+        after Retry-After, like a patient student would."""
+
+        endpoint = f"{method} {path.split('?')[0]}"
+        for _ in range(MAX_RETRIES):
+            start = time.perf_counter()
+            response = client.open(path, method=method, **kwargs)
+            elapsed = time.perf_counter() - start
+            with self.lock:
+                self.latencies[endpoint].append(elapsed)
+                if response.status_code == 503 and "Retry-After" in response.headers:
+                    self.busy[endpoint] += 1
+                elif response.status_code >= 500:
+                    self.errors[f"{endpoint} {response.status_code}"] += 1
+            if response.status_code != 503 or "Retry-After" not in response.headers:
+                break
+            time.sleep(min(int(response.headers["Retry-After"]), MAX_RETRY_AFTER))
+        return response
+
+    def error(self, message):
+        """Counts an error that isn't a bad status"""
+
+        with self.lock:
+            self.errors[message] += 1
+
+
+def percentile(values, fraction):
+    """Nearest rank percentile of a list of numbers"""
+
+    ordered = sorted(values)
+    return ordered[max(0, min(len(ordered) - 1, round(fraction * len(ordered)) - 1))]
+
+
+def wait_until_ready(stats, client, name, path):
+    """Follows a started challenge through the queue and provisioning, starting
+    from where /start_challenge redirected to. Returns whether it came up."""
+
+    deadline = time.monotonic() + PROVISION_TIMEOUT
+    while time.monotonic() < deadline:
+        response = stats.request(client, "GET", path)
+        if response.status_code == 302:
+            path = response.location
+            if path.endswith("/list_challenges"):  # dropped from the queue
+                stats.error(f"{name} left the queue")
+                return False
+            continue
+        if 'id="capture"' in response.text:
+            return True
+        if "failed to start" in response.text:
+            stats.error(f"{name} failed to start")
+            return False
+        time.sleep(POLL_INTERVAL)
+    stats.error(f"{name} timed out starting")
+    return False
+
+
+def simulate(app, stats, username, rounds, choices):
+    """One simulated user"""
+
+    client = app.test_client()
+    response = stats.request(
+        client, "POST", "/login", data={"username": username, "password": PASSWORD}
+    )
+    if response.status_code != 302:
+        stats.error("login failed")
+        return
+
+    for _ in range(rounds):
+        index, challenge = random.choice(choices)
+        response = stats.request(client, "GET", f"/start_challenge?id={index}")
+        if response.status_code != 302:
+            stats.error(f"{challenge.NAME} start returned {response.status_code}")
+            continue
+        if not wait_until_ready(stats, client, challenge.NAME, response.location):
+            stats.request(client, "POST", "/active_challenge", data={"stop": "1"})
+            stats.request(client, "POST", "/queue", data={"leave": "1"})
+            continue
+
+        # capture it the first time, a second capture is refused so just stop
+        response = stats.request(
+            client,
+            "POST",
+            "/active_challenge",
+            data={"flag": challenge.FLAG, "capture": "1"},
+        )
+        if "Already captured" in response.text:
+            stats.request(client, "POST", "/active_challenge", data={"stop": "1"})
+
+
+def leaked_environments(app, started):
+    """Waits for teardowns to settle and returns the names of containers (or
+    compose projects) this range started after `started` that nothing refers to
+    any more, and the number of challenges rows left behind"""
+
+    deadline = time.monotonic() + SETTLE_TIMEOUT
+    while True:
+        with app.app_context():
+            conn = db.get_connection()
+            rows = db.get_challenge_envs(conn)
+            known = {docker.owner(row["end_cmd"]) for row in rows if row["end_cmd"]}
+            known.update(docker.owner(env["end_cmd"]) for env in db.get_pooled_envs(conn))
+        known.update(docker.owner(end_cmd) for end_cmd in pool.warm_end_cmds())
+
+        leaked = set()
+        containers = [
+            container
+            for host in hosts.HOSTS
+            for container in host.client.list_containers()
+        ]
+        for container in containers:
+            labels = container.get("Labels") or {}
+            if labels.get(docker.LABEL_INSTANCE) != docker.INSTANCE:
+                continue
+            if container["Created"] < int(started):
+                continue
+            owner = labels.get("com.docker.compose.project") or container["Names"][0][1:]
+            if owner not in known:
+                leaked.add(owner)
+
+        if (not leaked and not rows) or time.monotonic() > deadline:
+            return sorted(leaked), len(rows)
+        time.sleep(1)
+
+
+def run(users=10, rounds=2, backend="fake"):
+    """Runs the harness and returns a report dict with latencies (endpoint ->
+    p50, p95, p99, count), errors, busy, leaked and leftover_rows. The DB is
+    DB_FILE if it's set, otherwise one in a temporary directory that is
+    removed afterwards."""
+
+    if os.getenv("DB_FILE"):
+        return measure(users, rounds, backend)
+    with tempfile.TemporaryDirectory() as directory:
+        os.environ["DB_FILE"] = os.path.join(directory, "load.db")
+        try:
+            return measure(users, rounds, backend)
+        finally:
+            del os.environ["DB_FILE"]
+
+
+def measure(users, rounds, backend):
+    """Runs the simulated users against the DB in DB_FILE, see run()"""
+
+    from app import create_app  # pylint: disable=import-outside-toplevel
+    from challenges.routes import AVAILABLE_CHALLENGES  # pylint: disable=import-outside-toplevel
+
+    os.environ.setdefault("SECRET_KEY", "load-test")
+    os.environ.setdefault("DEFAULT_ADMIN_PASSWORD", PASSWORD)
+    os.environ["BCRYPT_LOG_ROUNDS"] = "4"  # logins aren't what we're measuring
+
+    with BACKENDS[backend]() as docker_backend:
+        started = time.time()
+        app = create_app()
+        app.config.update(TESTING=True, WTF_CSRF_ENABLED=False)
+
+        choices = [
+            (index, challenge)
+            for index, challenge in enumerate(AVAILABLE_CHALLENGES)
+            if docker_backend.compose or not hasattr(challenge, "COMPOSE_DIR")
+            if images.available(challenge.NAME)
+        ]
+
+        usernames = [f"load{number}" for number in range(users)]
+        with app.app_context():
+            conn = db.get_connection()
+            pw_hash = passwords.generate_hash(PASSWORD)
+            db.add_users(conn, [(name, pw_hash, 0) for name in usernames])
+            conn.commit()
+
+        stats = Stats()
+        threads = [
+            threading.Thread(target=simulate, args=(app, stats, name, rounds, choices))
+            for name in usernames
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        leaked, leftover_rows = leaked_environments(app, started)
+
+    latencies = {
+        endpoint: (
+            percentile(values, 0.50),
+            percentile(values, 0.95),
+            percentile(values, 0.99),
+            len(values),
+        )
+        for endpoint, values in sorted(stats.latencies.items())
+    }
+    return {
+        "latencies": latencies,
+        "errors": dict(stats.errors),
+        "busy": dict(stats.busy),
+        "leaked": leaked,
+        "leftover_rows": leftover_rows,
+    }
+
+
+def main():
+    """Runs the harness from the command line and prints the report"""
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--rounds", type=int, default=2)
+    parser.add_argument("--backend", choices=sorted(BACKENDS), default="fake")
+    args = parser.parse_args()
+
+    report = run(args.users, args.rounds, args.backend)
+
+    print(f"{'endpoint':<32} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'count':>7}")
+    for endpoint, (p50, p95, p99, count) in report["latencies"].items():
+        print(
+            f"{endpoint:<32} {p50 * 1000:>9.1f} {p95 * 1000:>9.1f}"
+            f" {p99 * 1000:>9.1f} {count:>7}"
+        )
+    print()
+    print("errors:", report["errors"] or "none")
+    print("busy, retried:", report["busy"] or "none")
+    print("leaked environments:", report["leaked"] or "none")
+    print("leftover challenges rows:", report["leftover_rows"])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+import time
+
+import db
+from challenges import admission, provision
+from challenges.routes import AVAILABLE_CHALLENGES, stop_challenge
+
+CHALLENGE = next(chal for chal in AVAILABLE_CHALLENGES if chal.NAME == "Challenge 2")
+
+
+def wait_for(check, timeout=10):
+    """Polls check() until it returns something truthy"""
+
+    deadline = time.monotonic() + timeout
+    while not (result := check()):
+        assert time.monotonic() < deadline
+        time.sleep(0.1)
+    return result
+
+
+def test_queue(app, engines, monkeypatch):
+    """Tests that users past MAX_ACTIVE wait in order, keep their place when
+    provisioning is full and are started automatically when there's room"""
+
+    monkeypatch.setitem(admission.BUDGETS, CHALLENGE.NAME, 1)
+
+    with app.app_context():
+        conn = db.get_connection()
+        db.add_users(conn, [(f"user{n}", "x", 0) for n in range(3)])
+        first, second, third = [db.get_user_by_name(conn, f"user{n}")["id"] for n in range(3)]
+        for user_id in (first, second, third):
+            db.set_auto_logout(conn, user_id, 60)
+        conn.commit()
+
+        def ready(user_id):
+            conn.commit()  # see the provisioning job's writes
+            row = db.get_challenge(conn, user_id)
+            return row if row and row["state"] == db.STATE_READY else None
+
+        def request(user_id):
+            return admission.request(app, conn, user_id, CHALLENGE, "range.example")
+
+        # the first one fits, the rest wait in order
+        assert request(first) is None
+        assert request(second) == 1
+        assert request(third) == 2
+        assert request(second) == 1  # asking again doesn't lose their place
+        assert admission.queue_length() == 2
+        assert admission.status(second) == {"name": CHALLENGE.NAME, "position": 1, "wait": 20}
+        assert admission.status(third) == {"name": CHALLENGE.NAME, "position": 2, "wait": 40}
+        row = wait_for(lambda: ready(first))
+
+        # a slot frees up but provisioning is full, so they stay at the front
+        def launch(*args):
+            raise provision.QueueFull()
+
+        with monkeypatch.context() as patch:
+            patch.setattr(provision, "launch", launch)
+            stop_challenge(conn, first, row["name"], row["end_cmd"], row["cwd"], row["host"])
+            with admission._lock:
+                admission.admit(app, conn)
+            assert admission.status(second)["position"] == 1
+            assert admission.status(third)["position"] == 2
+
+        # once provisioning has room the next release starts them without
+        # them asking
+        admission.released()
+        row = wait_for(lambda: ready(second))
+        assert admission.status(second) is None
+        assert admission.status(third)["position"] == 1
+
+        admission.leave(third)
+        assert admission.status(third) is None
+        assert admission.queue_length() == 0
+
+        stop_challenge(conn, second, row["name"], row["end_cmd"], row["cwd"], row["host"])
+        assert db.get_challenge(conn, third) is None
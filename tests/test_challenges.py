@@ -1,45 +1,86 @@
+import time
+
+import pytest
 from bs4 import BeautifulSoup
 
+from challenges import provision
 from challenges.routes import AVAILABLE_CHALLENGES 
 
-def test_challenges(admin_logged_in):
-    """Tests each challenge in /list_challenges"""
+PROVISION_TIMEOUT = 60
+
+def start(client, start_challenge_link):
+    """Starts a challenge and polls /active_challenge until it's ready"""
+
+    response = client.get(start_challenge_link, follow_redirects=True)
+    deadline = time.monotonic() + PROVISION_TIMEOUT
+    while 'id="capture"' not in response.text:
+        assert "failed to start" not in response.text
+        assert time.monotonic() < deadline
+        time.sleep(0.5)
+        response = client.get('/active_challenge')
+    return response
+
+@pytest.mark.parametrize("index", range(len(AVAILABLE_CHALLENGES)))
+def test_challenges(admin_logged_in, engines, index):
+    """Tests starting, stopping, restarting and capturing each challenge on
+    the fake engines. Challenges whose images they don't have are skipped."""
 
+    name = AVAILABLE_CHALLENGES[index].NAME
     response = admin_logged_in.get('/list_challenges')
     assert response.status_code == 200
     list_challenges_soup = BeautifulSoup(response.text, 'html.parser')
-    for index, li in enumerate(list_challenges_soup.find_all('li')):
-        # try starting the challenge
-        start_challenge_link = li.contents[0]['href']
-        response = admin_logged_in.get(start_challenge_link, follow_redirects=True)
-        assert response.status_code == 200
-
-        # try stopping the challenge
-        challenge_soup = BeautifulSoup(response.text, 'html.parser')
-        csrf_token = challenge_soup.find(id='csrf_token')['value']
-        flag = challenge_soup.find(id='flag')['value']
-        stop = challenge_soup.find(id='stop')['value']
-        response = admin_logged_in.post('/active_challenge', data={
-            'csrf_token': csrf_token,
-            'flag': flag,
-            'stop': stop,
-        })
-        assert response.status_code == 302
-
-        # try starting the challenge again
-        response = admin_logged_in.get(start_challenge_link, follow_redirects=True)
-        assert response.status_code == 200
-
-        # try capturing the flag
-        challenge_soup = BeautifulSoup(response.text, 'html.parser')
-        csrf_token = challenge_soup.find(id='csrf_token')['value']
-        capture = challenge_soup.find(id='capture')['value']
-        response = admin_logged_in.post('/active_challenge', data={
-            'csrf_token': csrf_token,
-            'flag': AVAILABLE_CHALLENGES[index].FLAG,
-            'capture': capture,
-        })
-
-        # see if we got the success page
-        success_soup = BeautifulSoup(response.text, 'html.parser')
-        assert(success_soup.find('h1').contents[0] == "Congratulations!")
+    links = [li.contents[0]['href'] for li in list_challenges_soup.find_all('li')]
+    start_challenge_link = f'/start_challenge?id={index}'
+    if start_challenge_link not in links:
+        pytest.skip(f"{name} isn't listed, the fake engines don't have its images")
+
+    # try starting the challenge
+    response = start(admin_logged_in, start_challenge_link)
+    assert response.status_code == 200
+
+    # try stopping the challenge
+    challenge_soup = BeautifulSoup(response.text, 'html.parser')
+    csrf_token = challenge_soup.find(id='csrf_token')['value']
+    flag = challenge_soup.find(id='flag')['value']
+    stop = challenge_soup.find(id='stop')['value']
+    response = admin_logged_in.post('/active_challenge', data={
+        'csrf_token': csrf_token,
+        'flag': flag,
+        'stop': stop,
+    })
+    assert response.status_code == 302
+
+    # try starting the challenge again
+    response = start(admin_logged_in, start_challenge_link)
+    assert response.status_code == 200
+
+    # try capturing the flag
+    challenge_soup = BeautifulSoup(response.text, 'html.parser')
+    csrf_token = challenge_soup.find(id='csrf_token')['value']
+    capture = challenge_soup.find(id='capture')['value']
+    response = admin_logged_in.post('/active_challenge', data={
+        'csrf_token': csrf_token,
+        'flag': AVAILABLE_CHALLENGES[index].FLAG,
+        'capture': capture,
+    })
+
+    # see if we got the success page
+    success_soup = BeautifulSoup(response.text, 'html.parser')
+    assert(success_soup.find('h1').contents[0] == "Congratulations!")
+
+def test_start_failed(admin_logged_in, engines):
+    """Tests that students get a generic message when Docker fails instead of
+    its error"""
+
+    for engine in engines:
+        engine.images.clear()
+
+    response = admin_logged_in.get('/start_challenge?id=1', follow_redirects=True)
+    deadline = time.monotonic() + PROVISION_TIMEOUT
+    while 'failed to start' not in response.text:
+        assert time.monotonic() < deadline
+        time.sleep(0.5)
+        response = admin_logged_in.get('/active_challenge')
+
+    assert provision.START_FAILED in response.text
+    assert 'No such image' not in response.text
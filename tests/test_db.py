@@ -0,0 +1,88 @@
+import sqlite3
+
+import db
+
+
+def test_migrate_existing(tmp_path, monkeypatch, capsys):
+    """Tests upgrading a database made before migrations existed in place"""
+
+    conn = sqlite3.connect(tmp_path / "old.db")
+    conn.row_factory = sqlite3.Row
+
+    # the original schema, without running any migrations
+    with monkeypatch.context() as patch:
+        patch.setattr(db, "migrate", lambda conn: None)
+        db.init(conn)
+    conn.executemany(
+        "INSERT INTO users (name, password, role, auto_logout_time) VALUES (?, 'x', 0, ?);",
+        [("alice", "2024-01-01 00:00:00"), ("bob", "2024-01-01 01:30:00"), ("carol", None)],
+    )
+    conn.executemany(
+        "INSERT INTO captures (user_id, name) VALUES (?, ?);",
+        [(1, "Challenge 1"), (2, "Challenge 1"), (2, "Challenge 2"), (1, "Challenge 2")],
+    )
+    conn.commit()
+    capsys.readouterr()
+
+    db.migrate(conn)
+
+    times = conn.execute(
+        "SELECT auto_logout_time, typeof(auto_logout_time) FROM users ORDER BY id;"
+    ).fetchall()
+    assert [tuple(row) for row in times] == [
+        (1704067200, "integer"),
+        (1704072600, "integer"),
+        (None, "null"),
+    ]
+
+    indexes = {
+        row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type='index';")
+    }
+    assert {
+        "users_auto_logout_time",
+        "captures_name",
+        "challenges_name",
+        "scores_total",
+        "ports_owner",
+    } <= indexes
+
+    scores = conn.execute("SELECT user_id, total FROM scores ORDER BY user_id;").fetchall()
+    assert [tuple(row) for row in scores] == [(1, 2), (2, 2)]
+    assert db.get_leaderboard_version(conn) == 0
+
+    # ties go to whoever captured first, before or after the upgrade
+    db.capture_flag(conn, 3, "Challenge 1")
+    db.capture_flag(conn, 3, "Challenge 2")
+    conn.commit()
+    leaderboard = db.get_leaderboard(conn, 10)
+    assert [row["name"] for row in leaderboard] == ["bob", "alice", "carol"]
+
+    assert conn.execute("PRAGMA user_version;").fetchone()[0] == len(db.MIGRATIONS)
+    assert "Migrating database" in capsys.readouterr().out
+
+    # a second run has nothing to do
+    before = list(conn.iterdump())
+    db.migrate(conn)
+    assert list(conn.iterdump()) == before
+    assert capsys.readouterr().out == ""
+    conn.close()
+
+
+def test_init_existing(tmp_path):
+    """Tests that initializing a database that has already been migrated
+    starts it over instead of failing part way through the migrations"""
+
+    conn = sqlite3.connect(tmp_path / "range.db")
+    conn.row_factory = sqlite3.Row
+    db.init(conn)
+    db.capture_flag(conn, 1, "Challenge 1")
+    conn.execute("INSERT INTO ports (port, owner) VALUES (20000, 'abc');")
+    conn.commit()
+
+    db.init(conn)
+
+    assert conn.execute("PRAGMA user_version;").fetchone()[0] == len(db.MIGRATIONS)
+    for table in ("scores", "ports", "captures"):
+        assert conn.execute(f"SELECT COUNT(*) FROM {table};").fetchone()[0] == 0
+    assert db.get_leaderboard_version(conn) == 0
+    conn.close()
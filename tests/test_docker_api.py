@@ -0,0 +1,174 @@
+import types
+
+import pytest
+
+import db
+from challenges import capacity, docker, docker_api, reconcile
+from challenges.ports import PORTS
+
+
+def test_container_lifecycle(fake_engine):
+    """Tests create/start/ports/logs/stop/remove against the fake engine"""
+
+    client = docker_api.get_client()
+    container_id = client.create_container("challenge2", ports=[80, "51820/udp"])
+    client.start_container(container_id)
+
+    ports = client.get_ports(container_id)
+    assert set(ports) == {"80/tcp", "51820/udp"}
+    assert ports["80/tcp"] != ports["51820/udp"]
+
+    fake_engine.containers[container_id]["Logs"] = b"<ClientConfig>\nkey\n</ClientConfig>\n"
+    assert client.logs(container_id) == "<ClientConfig>\nkey\n</ClientConfig>\n"
+
+    client.stop_container(container_id)
+    client.stop_container(container_id)  # already stopped is fine
+    client.remove_container(container_id)
+    assert fake_engine.containers == {}
+
+
+def test_errors(fake_engine):
+    """Tests that API errors are raised with their status and message"""
+
+    client = docker_api.get_client()
+    with pytest.raises(docker_api.DockerError) as error:
+        client.create_container("not_built")
+    assert error.value.status == 404
+    assert "No such image" in error.value.message
+
+
+def test_connection_reuse(fake_engine):
+    """Tests that a single persistent connection is used for every request"""
+
+    for _ in range(3):
+        port, end_cmd = docker.run_with_port("challenge5", 80)
+        docker.end(end_cmd, None)
+
+    assert len(fake_engine.requests) == 3 * 4
+    assert fake_engine.connections == 1
+    assert fake_engine.containers == {}
+
+
+def test_reconnect(fake_engine):
+    """Tests that a pooled connection closed by the daemon is replaced"""
+
+    client = docker_api.get_client()
+    client.create_container("challenge2")
+    client.idle.queue[0].sock.close()
+    client.create_container("challenge2")
+    assert len(fake_engine.containers) == 2
+
+
+def test_run_with_port(fake_engine):
+    """Tests that run_with_port publishes a port from the allocator and frees
+    it when the container is stopped"""
+
+    port, end_cmd = docker.run_with_port("challenge2", 80)
+    name = end_cmd.split()[-1]
+    assert port == PORTS.owners[name][0]
+    container = next(iter(fake_engine.containers.values()))
+    assert container["NetworkSettings"]["Ports"]["80/tcp"][0]["HostPort"] == str(port)
+
+    docker.end(end_cmd, None)
+    assert name not in PORTS.owners
+
+    in_use = PORTS.in_use()
+    with pytest.raises(docker_api.DockerError):
+        docker.run_with_port("missing", 80)
+    assert PORTS.in_use() == in_use
+
+
+def test_reconcile(app, fake_engine):
+    """Tests that unclaimed containers are removed and challenges whose
+    container is gone are failed"""
+
+    client = docker_api.get_client()
+    orphan = client.create_container(
+        "challenge2", name="orphan", labels=docker.make_labels()
+    )
+    other = client.create_container("challenge2", name="not_ours")
+    fake_engine.containers[orphan]["Created"] -= reconcile.GRACE + 1
+    fake_engine.containers[other]["Created"] -= reconcile.GRACE + 1
+
+    with app.app_context():
+        conn = db.get_connection()
+        db.add_challenge(
+            conn, 1, "Challenge 2", "prompt", "docker stop vanished", None, "flag"
+        )
+        conn.commit()
+
+        reconcile.reconcile()
+
+        assert orphan not in fake_engine.containers
+        assert other in fake_engine.containers
+        assert db.get_challenge(conn, 1)["state"] == db.STATE_FAILED
+
+
+def test_limits(fake_engine):
+    """Tests that resource limits are set on new containers"""
+
+    limits = capacity.Limits(cpus=0.5, memory=128, pids=64)
+    port, end_cmd = docker.run_with_port("challenge2", 80, limits=limits)
+    host_config = next(iter(fake_engine.containers.values()))["Config"]["HostConfig"]
+    assert host_config["NanoCpus"] == 500_000_000
+    assert host_config["Memory"] == 128 * 2**20
+    assert host_config["PidsLimit"] == 64
+    docker.end(end_cmd, None)
+
+
+def test_limits_only(monkeypatch):
+    """Tests that a challenge with limits but no requests still has its
+    limits recorded, and isn't counted against capacity"""
+
+    for table in ("LIMITS", "REQUESTS", "RESERVED"):
+        monkeypatch.setattr(capacity, table, {})
+    challenge = types.SimpleNamespace(NAME="Forkbomb", IMAGE="forkbomb", PIDS_LIMIT=32)
+
+    capacity.configure([challenge])
+
+    assert capacity.LIMITS == {"forkbomb": capacity.Limits(None, None, 32)}
+    assert capacity.REQUESTS == {}
+    assert capacity.RESERVED == {}
+
+
+def test_compose_logs_fail(monkeypatch):
+    """Tests that a compose environment whose VPN config can't be read is
+    taken down and its port freed"""
+
+    commands = []
+    monkeypatch.setattr(docker, "run", lambda args, **kwargs: commands.append(args))
+
+    def logs(container_id):
+        raise docker_api.DockerError(500, "engine went away")
+
+    host = types.SimpleNamespace(env=dict, client=types.SimpleNamespace(logs=logs))
+    in_use = PORTS.in_use()
+
+    with pytest.raises(docker_api.DockerError):
+        docker.compose_up_vpn("challenges/challenge3", host=host)
+
+    assert [args[4] for args in commands] == ["up", "down"]
+    assert PORTS.in_use() == in_use
+    assert commands[0][3] not in PORTS.owners
+
+
+def test_reconcile_ports(app, fake_engine):
+    """Tests that ports whose owner is gone from the DB and Docker are freed
+    once they're older than GRACE"""
+
+    port, end_cmd = docker.run_with_port("challenge2", 80)
+    running = docker.owner(end_cmd)
+    PORTS.allocate("crashed")
+    PORTS.allocate("starting")
+    for owner in (running, "crashed"):
+        PORTS.since[owner] -= reconcile.GRACE + 1
+
+    with app.app_context():
+        reconcile.reconcile()
+
+    assert "crashed" not in PORTS.owners
+    assert "starting" in PORTS.owners
+    assert PORTS.owners[running] == [port]
+
+    docker.end(end_cmd, None)
+    PORTS.release("starting")
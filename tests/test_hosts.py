@@ -0,0 +1,70 @@
+import time
+
+import db
+from challenges import capacity, provision
+from challenges.routes import AVAILABLE_CHALLENGES, stop_challenge
+
+
+def start(app, count):
+    """Starts challenge 2 for count new users, returning their rows once
+    provisioning is done"""
+
+    with app.app_context():
+        conn = db.get_connection()
+        db.add_users(conn, [(f"user{n}", "x", 0) for n in range(count)])
+        conn.commit()
+
+        rows = []
+        for number in range(count):
+            user_id = db.get_user_by_name(conn, f"user{number}")["id"]
+            provision.launch(app, conn, user_id, AVAILABLE_CHALLENGES[1], "range.example")
+
+            deadline = time.monotonic() + 10
+            while db.get_challenge(conn, user_id)["state"] == db.STATE_PROVISIONING:
+                assert time.monotonic() < deadline
+                time.sleep(0.1)
+                conn.commit()  # see the provisioning job's writes
+            rows.append(db.get_challenge(conn, user_id))
+        return rows
+
+
+def test_placement(app, engines):
+    """Tests that challenges are spread across engines, that students are
+    pointed at the engine they're on and that they're stopped on it"""
+
+    rows = start(app, 3)
+
+    assert [row["host"] for row in rows] == [
+        "host0.example",
+        "host1.example",
+        "host0.example",
+    ]
+    assert [len(engine.containers) for engine in engines] == [2, 1]
+    with app.test_request_context():
+        assert "host1.example" in provision.prompts.load(rows[1])
+
+    row = rows[1]
+    with app.app_context():
+        conn = db.get_connection()
+        stop_challenge(
+            conn, row["user_id"], row["name"], row["end_cmd"], row["cwd"], row["host"]
+        )
+    assert [len(engine.containers) for engine in engines] == [2, 0]
+
+
+def test_capacity(app, engines, monkeypatch):
+    """Tests that challenges are only placed where they fit"""
+
+    # host1 has room for its warm pools and one more challenge 2
+    room = capacity.REQUESTS["Challenge 2"]
+    for reserved in capacity.RESERVED.values():
+        room = capacity.add(room, reserved)
+    monkeypatch.setitem(capacity._capacities, "host0.example", capacity.NOTHING)
+    monkeypatch.setitem(capacity._capacities, "host1.example", room)
+
+    first, second = start(app, 2)
+
+    assert first["host"] == "host1.example"
+    assert first["state"] == db.STATE_READY
+    assert second["state"] == db.STATE_FAILED
+    assert "room" in second["error"]
@@ -0,0 +1,47 @@
+import time
+
+import db
+from challenges import docker, idle
+
+
+def test_pause_and_resume(app, fake_engine):
+    """Tests that an idle environment is paused, that traffic keeps one
+    running and that viewing the challenge resumes it"""
+
+    _, end_cmd = docker.run_with_port("challenge2", 80)
+    container = next(iter(fake_engine.containers.values()))
+
+    with app.app_context():
+        conn = db.get_connection()
+        db.add_challenge(conn, 1, "Challenge 2", "prompt", end_cmd, None, "flag")
+        row = db.get_challenge(conn, 1)
+        db.touch_challenge(conn, row["id"])
+        conn.commit()
+
+        idle.check()  # records the traffic so far
+        assert not container["State"].get("Paused")
+
+        # no traffic, but it hasn't been idle long enough
+        idle.check()
+        assert not container["State"].get("Paused")
+
+        # traffic counts as activity
+        conn.execute("UPDATE challenges SET last_active=0;")
+        conn.commit()
+        container["Traffic"] = 1000
+        idle.check()
+        assert not container["State"].get("Paused")
+        assert db.get_challenge(conn, 1)["last_active"] > time.time() - 60
+
+        # idle for too long
+        conn.execute("UPDATE challenges SET last_active=0;")
+        conn.commit()
+        idle.check()
+        assert container["State"]["Paused"]
+        assert db.count_paused_envs(conn) == {"running": 0, "paused": 1}
+
+        idle.visited(conn, db.get_challenge(conn, 1))
+        assert not container["State"]["Paused"]
+        assert db.count_paused_envs(conn) == {"running": 1, "paused": 0}
+
+    docker.end(end_cmd, None)
@@ -0,0 +1,37 @@
+from challenges import images
+from challenges.registry import discover
+
+
+def test_verify(fake_engine, monkeypatch):
+    """Tests that images are checked with one listing and challenges are only
+    available once all of their images are"""
+
+    monkeypatch.setattr(images, "BUILD_IMAGES", False)
+    monkeypatch.setattr(images, "_states", {})
+    monkeypatch.setattr(images, "CONTEXTS", {})
+    monkeypatch.setattr(images, "REQUIRED", {})
+    fake_engine.requests.clear()
+
+    images.configure(discover())
+
+    assert fake_engine.requests == [("GET", "/v1.41/images/json")]
+    assert images.states() == {
+        ("local", "challenge2"): images.STATE_READY,
+        ("local", "challenge5"): images.STATE_READY,
+        ("local", "wg_vpn"): images.STATE_READY,
+        ("local", "dr_sneaky"): images.STATE_MISSING,
+    }
+    assert images.available("Challenge 1")
+    assert images.available("Challenge 2")
+    assert not images.available("Challenge 3")
+
+
+def test_context_hash(tmp_path):
+    """Tests that a build context's hash changes with its files"""
+
+    (tmp_path / "Dockerfile").write_text("FROM scratch\n")
+    before = images.context_hash(tmp_path)
+    assert images.context_hash(tmp_path) == before
+
+    (tmp_path / "Dockerfile").write_text("FROM alpine\n")
+    assert images.context_hash(tmp_path) != before
@@ -0,0 +1,129 @@
+import collections
+import queue
+
+import db
+from leaderboard import routes
+from leaderboard.events import BACKLOG, BROADCASTER, Broadcaster
+from leaderboard.routes import publish_capture, render_table
+
+
+def test_publish_capture(app):
+    """Tests that a capture is sent to every subscriber with the new total"""
+
+    first = BROADCASTER.subscribe()
+    second = BROADCASTER.subscribe()
+    try:
+        with app.app_context():
+            conn = db.get_connection()
+            db.capture_flag(conn, 1, "Challenge 1")
+            conn.commit()
+            publish_capture(conn, 1, "admin", "Challenge 1")
+
+        expected = ("capture", {"name": "admin", "challenge": "Challenge 1", "total": 1})
+        assert first.get_nowait() == expected
+        assert second.get_nowait() == expected
+    finally:
+        BROADCASTER.unsubscribe(first)
+        BROADCASTER.unsubscribe(second)
+
+
+def test_overflow_reloads():
+    """Tests that a subscriber that falls too far behind is told to reload"""
+
+    broadcaster = Broadcaster()
+    slow = broadcaster.subscribe()
+    for number in range(BACKLOG + 1):
+        broadcaster.publish("capture", {"total": number})
+
+    assert slow.get_nowait() == ("reload", {})
+    assert slow.empty()
+
+
+def test_subscriber_limit():
+    """Tests that subscribers past the limit are turned away until one leaves"""
+
+    broadcaster = Broadcaster(limit=1)
+    first = broadcaster.subscribe()
+    assert first is not None
+    assert broadcaster.subscribe() is None
+
+    broadcaster.unsubscribe(first)
+    assert broadcaster.subscribe() is not None
+
+
+def test_stream(admin_logged_in, monkeypatch):
+    """Tests that the event stream sends published events, unsubscribes when
+    it's closed and that streams past the limit get a 204"""
+
+    broadcaster = Broadcaster(limit=1)
+    monkeypatch.setattr("leaderboard.routes.BROADCASTER", broadcaster)
+
+    response = admin_logged_in.get("/leaderboard/events", buffered=False)
+    assert response.status_code == 200
+    assert response.mimetype == "text/event-stream"
+    chunks = iter(response.response)
+    assert next(chunks).startswith(b"retry:")
+
+    assert admin_logged_in.get("/leaderboard/events").status_code == 204
+
+    broadcaster.publish("capture", {"name": "admin", "challenge": "Challenge 1", "total": 1})
+    assert next(chunks) == (
+        b'event: capture\ndata: {"name": "admin", "challenge": "Challenge 1", "total": 1}\n\n'
+    )
+
+    response.close()
+    assert not broadcaster.subscribers
+    assert isinstance(broadcaster.subscribe(), queue.Queue)
+
+
+def test_scores_with_capture(app):
+    """Tests that a score only changes in the same transaction as its
+    capture"""
+
+    with app.app_context():
+        conn = db.get_connection()
+        version = db.get_leaderboard_version(conn)
+
+        db.capture_flag(conn, 1, "Challenge 1")
+        conn.rollback()
+        assert db.get_capture(conn, 1, "Challenge 1") is None
+        assert db.get_score(conn, 1) == 0
+        assert db.get_leaderboard_version(conn) == version
+
+        db.capture_flag(conn, 1, "Challenge 1")
+        conn.commit()
+        assert db.get_capture(conn, 1, "Challenge 1") is not None
+        assert db.get_score(conn, 1) == 1
+        assert db.get_leaderboard_version(conn) == version + 1
+
+
+def test_table_cache(app, monkeypatch):
+    """Tests that a rendered page is reused until a capture, rename or delete
+    changes the leaderboard"""
+
+    # pages cached from other tests' databases
+    monkeypatch.setattr(routes, "_cache", collections.OrderedDict())
+    with app.test_request_context():
+        conn = db.get_connection()
+        db.add_user(conn, "student", "x", 0)
+        conn.commit()
+        user_id = db.get_user_by_name(conn, "student")["id"]
+
+        table = render_table(conn, 1, 50)
+        assert render_table(conn, 1, 50) is table
+        assert "student" not in table
+
+        db.capture_flag(conn, user_id, "Challenge 1")
+        conn.commit()
+        table = render_table(conn, 1, 50)
+        assert "student" in table
+        assert render_table(conn, 1, 50) is table
+
+        db.update_user(conn, user_id, "pupil", 0)
+        conn.commit()
+        table = render_table(conn, 1, 50)
+        assert "pupil" in table and "student" not in table
+
+        db.del_user(conn, user_id)
+        conn.commit()
+        assert "pupil" not in render_table(conn, 1, 50)
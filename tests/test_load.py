@@ -0,0 +1,16 @@
+import load
+
+
+def test_load(monkeypatch, tmp_path):
+    """Runs a small load test against the fake Docker engine"""
+
+    monkeypatch.setenv("DB_FILE", str(tmp_path / "load.db"))
+    monkeypatch.setenv("BCRYPT_LOG_ROUNDS", "4")
+
+    report = load.run(users=5, rounds=2, backend="fake")
+
+    assert report["errors"] == {}
+    assert report["leaked"] == []
+    assert report["leftover_rows"] == 0
+    assert report["latencies"]["GET /start_challenge"][3] == 10
+    assert (tmp_path / "load.db").exists()  # DB_FILE is used when it's set
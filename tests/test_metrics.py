@@ -0,0 +1,26 @@
+import metrics
+
+
+def test_histogram():
+    """Tests that observations land in cumulative buckets"""
+
+    histogram = metrics.Histogram("test_seconds", "A test", ("kind",), (0.1, 1))
+    histogram.observe(0.05, "a")
+    histogram.observe(0.5, "a")
+    histogram.observe(5, "a")
+
+    lines = histogram.collect()
+    assert 'test_seconds_bucket{kind="a",le="0.1"} 1' in lines
+    assert 'test_seconds_bucket{kind="a",le="1"} 2' in lines
+    assert 'test_seconds_bucket{kind="a",le="+Inf"} 3' in lines
+    assert 'test_seconds_count{kind="a"} 3' in lines
+    metrics.REGISTRY.remove(histogram)
+
+
+def test_metrics_endpoint(client, admin_logged_in):
+    """Tests that admins can see the metrics"""
+
+    response = admin_logged_in.get("/metrics")
+    assert response.status_code == 200
+    assert "logged_in_users 1" in response.text
+    assert 'db_query_seconds_count{query="SELECT users"}' in response.text
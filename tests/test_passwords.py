@@ -0,0 +1,86 @@
+import os
+
+import db
+from admin import passwords
+
+
+def test_busy(client, login, monkeypatch):
+    """Tests that logins get a 503 with Retry-After when the pool is full"""
+
+    def check(pw_hash, password):
+        raise passwords.Busy()
+
+    monkeypatch.setattr(passwords, 'check', check)
+
+    response = login(client, 'admin', os.getenv('DEFAULT_ADMIN_PASSWORD'))
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '5'
+    assert 'try again' in response.text
+
+
+def test_rehash(app, client, login):
+    """Tests that a hash made with an old work factor is upgraded on login"""
+
+    app.config['BCRYPT_LOG_ROUNDS'] = 4
+    with app.app_context():
+        old_hash = db.get_user_by_name(db.get_connection(), 'admin')['password']
+        assert passwords.needs_rehash(old_hash)
+
+    response = login(client, 'admin', os.getenv('DEFAULT_ADMIN_PASSWORD'))
+    assert response.status_code == 302
+
+    with app.app_context():
+        new_hash = db.get_user_by_name(db.get_connection(), 'admin')['password']
+        assert new_hash.startswith('$2b$04$')
+        assert not passwords.needs_rehash(new_hash)
+
+
+def test_unknown_user(client, login, monkeypatch):
+    """Tests that a password is checked even when the user doesn't exist"""
+
+    checked = []
+    run = passwords._run
+
+    def spy(function, *args):
+        checked.append(function.__name__)
+        return run(function, *args)
+
+    monkeypatch.setattr(passwords, '_run', spy)
+
+    response = login(client, 'nobody', 'guess')
+    assert response.status_code == 200
+    assert 'Invalid username or password' in response.text
+    assert '_check' in checked
+
+
+def test_hash_many_batches(monkeypatch):
+    """Tests that bulk hashing goes through the pool a batch at a time, each
+    hash holding a slot, so there's always room left for logins"""
+
+    monkeypatch.setattr(passwords, 'WORKERS', 2)
+    slots = passwords.threading.BoundedSemaphore(3)
+    monkeypatch.setattr(passwords, '_slots', slots)
+    batches = []
+
+    def free():
+        count = 0
+        while slots.acquire(blocking=False):
+            count += 1
+        for _ in range(count):
+            slots.release()
+        return count
+
+    class Executor:
+        def map(self, function, batch, rounds):
+            batches.append(list(batch))
+            assert free() == 3 - len(batch)  # the rest are left for logins
+            return [f'hash of {password}' for password in batch]
+
+    monkeypatch.setattr(passwords, '_get_executor', Executor)
+
+    hashes = passwords.hash_many(['a', 'b', 'c', 'd', 'e'], 4)
+
+    assert batches == [['a', 'b'], ['c', 'd'], ['e']]
+    assert hashes == [f'hash of {password}' for password in 'abcde']
+    assert passwords.hash_many([], 4) == []
+    assert free() == 3
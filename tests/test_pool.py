@@ -0,0 +1,97 @@
+import itertools
+
+import db
+from challenges import docker, hosts, pool
+
+
+def test_warm_pool(app, engines):
+    """Tests that warm containers are handed out oldest first, replaced, and
+    stopped once they're older than max_age"""
+
+    engine = engines[0]
+    host = hosts.HOSTS[0]
+    warm = pool.WarmPool("challenge2", 80, 2, 60, 60, docker.make_labels("Challenge 2"), host)
+
+    assert warm.top_up() == 60
+    assert len(warm.ready) == 2
+    assert len(engine.containers) == 2
+    oldest = warm.ready[0]
+
+    # take hands out the oldest and wakes the refiller
+    assert warm.take() == oldest[1:]
+    assert warm.wakeup.is_set()
+    warm.top_up()
+    assert len(warm.ready) == 2
+    assert len(engine.containers) == 3
+
+    # the one left over from before is past max_age
+    started, port, end_cmd = warm.ready[0]
+    warm.ready[0] = (started - 61, port, end_cmd)
+    warm.evict()
+    assert len(warm.ready) == 1
+    assert len(engine.containers) == 2
+    warm.top_up()
+    assert len(warm.ready) == 2
+
+    # Docker failing backs off
+    engine.images.clear()
+    docker.end(warm.take()[1], None, host)
+    assert warm.top_up() == pool.RETRY_DELAY
+    assert len(warm.ready) == 1
+
+    warm.drain()
+    docker.end(oldest[2], None, host)
+    assert engine.containers == {}
+
+
+def test_compose_pool(app, engines, monkeypatch):
+    """Tests that pooled environments are kept in env_pool across a restart,
+    claimed oldest first and replenished"""
+
+    host = hosts.HOSTS[0]
+    counter = itertools.count()
+    up = []
+
+    def compose_up_vpn(directory, labels=None, host=None):
+        # nothing may hold the write lock while compose is running
+        other = db.connect(app)
+        other.execute("PRAGMA busy_timeout=0;")
+        other.execute("BEGIN IMMEDIATE;")
+        other.close()
+        number = next(counter)
+        up.append(number)
+        return (20000 + number, f"config{number}\n", f"docker compose -p env{number} down")
+
+    monkeypatch.setattr(docker, "compose_up_vpn", compose_up_vpn)
+
+    first = pool.ComposePool(app, "Pooled", "challenges/challenge3", 2, host)
+    assert first.top_up() == pool.DEFAULT_EVICT_INTERVAL
+    assert up == [0, 1]
+
+    # after a restart the environments in env_pool are still counted
+    second = pool.ComposePool(app, "Pooled", "challenges/challenge3", 2, host)
+    monkeypatch.setitem(pool.COMPOSE_POOLS, ("Pooled", host.name), second)
+    second.top_up()
+    assert up == [0, 1]
+
+    with app.app_context(), hosts.using(host):
+        conn = db.get_connection()
+        claimed = pool.claim_env(conn, "Pooled", "challenges/challenge3")
+        conn.commit()
+        assert claimed == ("20000", "config0\n", "docker compose -p env0 down")
+        assert second.wakeup.is_set()
+        assert db.count_pooled_envs(conn, "Pooled", host.name) == 1
+
+        second.top_up()
+        assert up == [0, 1, 2]
+        assert db.count_pooled_envs(conn, "Pooled", host.name) == 2
+
+        # environments on other hosts aren't handed out, one is brought up
+        with hosts.using(hosts.HOSTS[1]):
+            assert pool.claim_env(conn, "Pooled", "challenges/challenge3")[0] == 20003
+        assert db.count_pooled_envs(conn, "Pooled", host.name) == 2
+
+        # losing the last one to another claim between counting and claiming
+        with hosts.using(hosts.HOSTS[1]), monkeypatch.context() as patch:
+            patch.setattr(db, "count_pooled_envs", lambda conn, name, host: 1)
+            assert pool.claim_env(conn, "Pooled", "challenges/challenge3")[0] == 20004
@@ -0,0 +1,63 @@
+import threading
+import time
+import types
+
+from challenges import registry
+from challenges.routes import AVAILABLE_CHALLENGES
+
+
+def test_discover():
+    """Tests that challenges are found in order and their settings are read
+    without importing them"""
+
+    challenges = registry.discover()
+    assert [challenge.NAME for challenge in challenges] == [
+        f"Challenge {number}" for number in range(1, 6)
+    ]
+    assert challenges[1].POOL_MAX_AGE == 30 * 60
+    assert not hasattr(challenges[1], "COMPOSE_DIR")
+    assert challenges[2].COMPOSE_DIR == "challenges/challenge3"
+    assert all(challenge.module is None for challenge in challenges)
+
+    assert challenges[0].load().__name__ == "challenges.challenge1.challenge"
+    assert challenges[0].module is not None
+
+
+def test_static_start():
+    """Tests that a static challenge's start() runs once per hostname even
+    when several users start it at the same time"""
+
+    calls = []
+
+    def start(conn, user_id, hostname):
+        calls.append(hostname)
+        time.sleep(0.1)  # long enough for the other starts to catch up
+        return (f"prompt for {hostname}", None, None)
+
+    challenge = registry.Challenge("static", {"STATIC": True})
+    challenge.module = types.SimpleNamespace(start=start)
+
+    results = []
+    threads = [
+        threading.Thread(
+            target=lambda user_id: results.append(challenge.start(None, user_id, "a.example")),
+            args=(user_id,),
+        )
+        for user_id in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert calls == ["a.example"]
+    assert results == [("prompt for a.example", None, None)] * 4
+    assert challenge.start(None, 5, "b.example")[0] == "prompt for b.example"
+    assert calls == ["a.example", "b.example"]
+
+
+def test_start_bounds(admin_logged_in):
+    """Tests that a challenge id one past the end is rejected"""
+
+    response = admin_logged_in.get(f"/start_challenge?id={len(AVAILABLE_CHALLENGES)}")
+    assert response.status_code == 400
@@ -0,0 +1,115 @@
+import io
+import json
+
+import bcrypt
+import pytest
+from bs4 import BeautifulSoup
+
+import db
+from admin import roster
+from admin.users import ROLE_ADMIN, ROLE_USER
+
+CSV_ROSTER = (
+    "username,password,role\n"
+    "alice,,\n"
+    "bob,hunter22,admin\n"
+    "alice,again,\n"
+    ",nobody,\n"
+    "admin,,\n"
+)
+JSON_ROSTER = json.dumps([
+    {"username": "alice"},
+    {"username": "bob", "password": "hunter22", "role": "admin"},
+    {"username": "alice", "password": "again"},
+    {"password": "nobody"},
+    {"username": "admin"},
+])
+
+
+def test_parse():
+    """Tests that CSV and JSON rosters are read the same way"""
+
+    from_csv = roster.parse_roster("class.csv", ("\ufeff" + CSV_ROSTER).encode("utf-8"))
+    from_json = roster.parse_roster("class.JSON", JSON_ROSTER.encode("utf-8"))
+
+    assert from_csv == from_json
+    assert from_csv[:2] == [
+        {"username": "alice", "password": "", "role": ROLE_USER},
+        {"username": "bob", "password": "hunter22", "role": ROLE_ADMIN},
+    ]
+
+
+@pytest.mark.parametrize("filename, data, error", [
+    ("class.json", b'{"username": "alice"}', ValueError),
+    ("class.json", b'["alice"]', ValueError),
+    ("class.json", b'[{"username": ', ValueError),
+    ("class.csv", b"username\n\xff\xfe\n", UnicodeDecodeError),
+])
+def test_parse_errors(filename, data, error):
+    """Tests that files that aren't rosters raise errors"""
+
+    with pytest.raises(error):
+        roster.parse_roster(filename, data)
+
+
+def test_import(app):
+    """Tests the status of each row and that new users can log in with their
+    passwords"""
+
+    with app.app_context():
+        conn = db.get_connection()
+        results = roster.import_roster(conn, roster.parse_roster("class.csv", CSV_ROSTER), 4)
+        conn.commit()
+
+        assert [(result["username"], result["status"]) for result in results] == [
+            ("alice", "added"),
+            ("bob", "added"),
+            ("alice", "duplicate in roster"),
+            ("", "missing username"),
+            ("admin", "username already in use"),
+        ]
+        generated = results[0]["password"]
+        assert len(generated) == roster.PASSWORD_LENGTH
+        assert [result["password"] for result in results[1:]] == [""] * 4
+
+        alice = db.get_user_by_name(conn, "alice")
+        bob = db.get_user_by_name(conn, "bob")
+        assert bcrypt.checkpw(generated.encode("utf-8"), alice["password"].encode("utf-8"))
+        assert bcrypt.checkpw(b"hunter22", bob["password"].encode("utf-8"))
+        assert (alice["role"], bob["role"]) == (ROLE_USER, ROLE_ADMIN)
+
+
+def test_upload_error(admin_logged_in):
+    """Tests that a bad upload is reported on the form"""
+
+    response = admin_logged_in.get("/import_users")
+    csrf_token = BeautifulSoup(response.text, "html.parser").find(id="csrf_token")["value"]
+    response = admin_logged_in.post("/import_users", data={
+        "csrf_token": csrf_token,
+        "roster": (io.BytesIO(b"{}"), "class.json"),
+    })
+    assert response.status_code == 200
+    assert "Couldn&#39;t read roster" in response.text
+
+
+def test_cli(app, tmp_path):
+    """Tests flask admin import-users"""
+
+    app.config["BCRYPT_LOG_ROUNDS"] = 4
+    path = tmp_path / "class.json"
+    path.write_text(JSON_ROSTER)
+
+    result = app.test_cli_runner().invoke(args=["admin", "import-users", str(path)])
+
+    assert result.exit_code == 0
+    lines = result.output.splitlines()
+    assert lines[0] == "username,password,status"
+    assert lines[1].startswith("alice,") and lines[1].endswith(",added")
+    assert lines[2:] == [
+        "bob,,added",
+        "alice,,duplicate in roster",
+        ",,missing username",
+        "admin,,username already in use",
+    ]
+    with app.app_context():
+        assert db.get_user_by_name(db.get_connection(), "bob") is not None
@@ -0,0 +1,106 @@
+import time
+
+import db
+import scheduler
+from challenges import docker
+from scheduler import Deadlines, GRACE
+
+
+def test_deadlines_relogin():
+    """Tests that an old deadline expiring doesn't drop a user's new one when
+    they log out and back in"""
+
+    deadlines = Deadlines()
+    now = int(time.time())
+    deadlines.update(1, now - 20)
+    deadlines.update(2, now - 10)
+    deadlines.update(2, None)  # logged out
+    deadlines.update(2, now + 3600)  # and back in
+
+    deadlines.wait()
+    assert deadlines.deadlines == {2: now + 3600 + GRACE}
+
+
+def test_deadlines_extension():
+    """Tests that a user whose time was extended keeps the new deadline"""
+
+    deadlines = Deadlines()
+    now = int(time.time())
+    deadlines.update(1, now - 20)
+    deadlines.update(2, now - 10)
+    deadlines.update(2, now + 600)
+
+    deadlines.wait()
+    assert deadlines.deadlines == {2: now + 600 + GRACE}
+    assert deadlines.heap[0] == (now + 600 + GRACE, 2)
+
+
+def test_deadlines_same_time():
+    """Tests that users with the same deadline are all popped at once"""
+
+    deadlines = Deadlines()
+    now = int(time.time())
+    for user_id in range(1, 30):
+        deadlines.update(user_id, now - 5)
+    deadlines.update(30, now + 600)
+
+    deadlines.wait()
+    assert deadlines.deadlines == {30: now + 600 + GRACE}
+    assert deadlines.heap == [(now + 600 + GRACE, 30)]
+
+
+def test_cleanup_retries(app, monkeypatch):
+    """Tests that users whose challenge fails to stop are kept and tried again
+    after RETRY_DELAY"""
+
+    deadlines = Deadlines()
+    monkeypatch.setattr(scheduler, "DEADLINES", deadlines)
+
+    def end(end_cmd, cwd, host=None):
+        raise OSError("engine went away")
+
+    monkeypatch.setattr(scheduler.docker, "end", end)
+
+    with app.app_context():
+        conn = db.get_connection()
+        db.add_challenge(conn, 1, "Challenge 2", "prompt", "docker stop x", None, "flag")
+        conn.execute("UPDATE users SET auto_logout_time=? WHERE id=1;", (int(time.time()) - 60,))
+        conn.commit()
+
+        scheduler.cleanup()
+
+        assert db.get_challenge(conn, 1) is not None
+        assert 1 in deadlines.deadlines
+        assert deadlines.deadlines[1] > time.time() + scheduler.RETRY_DELAY - 5
+
+
+def test_cleanup_partial(app, fake_engine, monkeypatch):
+    """Tests that one teardown failing doesn't stop the others in the batch
+    from being cleaned up"""
+
+    monkeypatch.setattr(scheduler, "DEADLINES", Deadlines())
+
+    with app.app_context():
+        conn = db.get_connection()
+        db.add_users(conn, [(f"user{n}", "x", 0) for n in range(3)])
+        user_ids = [db.get_user_by_name(conn, f"user{n}")["id"] for n in range(3)]
+        end_cmds = [
+            docker.run_with_port("challenge2", 80)[1],
+            "docker stop 'unterminated",  # shlex can't split this
+            docker.run_with_port("challenge2", 80)[1],
+        ]
+        for user_id, end_cmd in zip(user_ids, end_cmds):
+            db.add_challenge(conn, user_id, "Challenge 2", "prompt", end_cmd, None, "flag")
+            conn.execute(
+                "UPDATE users SET auto_logout_time=? WHERE id=?;",
+                (int(time.time()) - 60, user_id),
+            )
+        conn.commit()
+
+        scheduler.cleanup()
+
+        assert db.get_challenge(conn, user_ids[0]) is None
+        assert db.get_challenge(conn, user_ids[1]) is not None
+        assert db.get_challenge(conn, user_ids[2]) is None
+        assert [row["user_id"] for row in db.get_expired_challenges(conn)] == [user_ids[1]]
+        assert fake_engine.containers == {}
@@ -0,0 +1,56 @@
+import types
+
+import pytest
+from bs4 import BeautifulSoup
+
+from challenges import throttle
+
+
+def test_take(monkeypatch):
+    """Tests that a bucket allows a burst and then refills at the rate"""
+
+    now = [1000.0]
+    monkeypatch.setattr(throttle.time, "monotonic", lambda: now[0])
+    monkeypatch.setitem(throttle.LIMITS, "Burst", (1, 3))  # a token a second
+
+    assert [throttle.take(1, "Burst") for _ in range(4)] == [0, 0, 0, 1]
+    assert throttle.take(2, "Burst") == 0  # buckets are per user
+
+    now[0] += 1
+    assert throttle.take(1, "Burst") == 0
+    assert throttle.take(1, "Burst") == 1
+
+
+@pytest.mark.parametrize("settings", [
+    {"FLAG_RATE": 0},
+    {"FLAG_RATE": -1},
+    {"FLAG_BURST": 0},
+    {"FLAG_BURST": 0.5},
+])
+def test_configure_invalid(settings):
+    """Tests that limits that would never let a flag through are rejected at
+    startup instead of failing submissions"""
+
+    challenge = types.SimpleNamespace(NAME="Broken", **settings)
+    with pytest.raises(ValueError):
+        throttle.configure([challenge])
+    assert "Broken" not in throttle.LIMITS
+
+
+def test_rejected_before_db(admin_logged_in):
+    """Tests that fast flag submissions are turned away with a 429"""
+
+    response = admin_logged_in.get('/list_challenges')
+    csrf_token = BeautifulSoup(response.text, 'html.parser').find(id='csrf_token')
+    data = {'flag': 'guess', 'capture': 'Capture'}
+    if csrf_token:
+        data['csrf_token'] = csrf_token['value']
+
+    statuses = [
+        admin_logged_in.post('/active_challenge', data=data).status_code
+        for _ in range(throttle.DEFAULT_BURST + 1)
+    ]
+
+    # there's no active challenge so the allowed ones are bad requests
+    assert statuses == [400] * throttle.DEFAULT_BURST + [429]
+    assert throttle.rejected()[None] >= 1
@@ -0,0 +1,127 @@
+import time
+import types
+
+import bcrypt
+from bs4 import BeautifulSoup
+
+import db
+from admin import users
+from challenges.routes import AVAILABLE_CHALLENGES
+
+
+def csrf_token(client, path):
+    """Gets the CSRF token from the form on a page"""
+
+    response = client.get(path)
+    return BeautifulSoup(response.text, 'html.parser').find(id='csrf_token')['value']
+
+
+def edit_user(admin, user_id, **data):
+    """Posts the edit user form as an admin"""
+
+    data.update({
+        'csrf_token': csrf_token(admin, f'/edit_user?id={user_id}'),
+        'user_id': user_id,
+        'role': 0,
+    })
+    response = admin.post('/edit_user', data=data)
+    assert response.status_code == 302
+
+
+def test_cache_invalidated(app, admin_logged_in, login, monkeypatch):
+    """Tests that cached users are reloaded after logging in and out, admin
+    edits and deletes and starting and stopping a challenge, without waiting
+    for CACHE_TTL, and that they are reloaded once it passes"""
+
+    # the clock only moves when the test says so
+    now = [time.time()]
+    monkeypatch.setattr(users, 'time', types.SimpleNamespace(time=lambda: now[0]))
+
+    with app.app_context():
+        conn = db.get_connection()
+        pw_hash = bcrypt.hashpw(b'password', bcrypt.gensalt(4)).decode('utf-8')
+        db.add_user(conn, 'student', pw_hash, users.ROLE_USER)
+        conn.commit()
+        user_id = db.get_user_by_name(conn, 'student')['id']
+
+    # requests get app contexts of their own, so this can't share theirs
+    def load():
+        with app.app_context():
+            return users.load_user(user_id)
+
+    def state():
+        with app.app_context():
+            return db.get_challenge(db.get_connection(), user_id)['state']
+
+    assert load() is None  # cached while logged out
+
+    student = app.test_client()
+    assert login(student, 'student', 'password').status_code == 302
+    assert load().name == 'student'
+
+    # a change that doesn't invalidate waits for the TTL
+    with app.app_context():
+        conn = db.get_connection()
+        conn.execute("UPDATE users SET name='renamed' WHERE id=?;", (user_id,))
+        conn.commit()
+    assert load().name == 'student'
+    now[0] += users.CACHE_TTL + 1
+    assert load().name == 'renamed'
+
+    edit_user(admin_logged_in, user_id, username='pupil')
+    assert load().name == 'pupil'
+
+    # starting and stopping a challenge
+    index = next(
+        index for index, chal in enumerate(AVAILABLE_CHALLENGES)
+        if chal.NAME == 'Challenge 1'
+    )
+    student.get(f'/start_challenge?id={index}')
+    assert load().active_challenge == 'Challenge 1'
+    deadline = time.monotonic() + 10
+    while state() == db.STATE_PROVISIONING:
+        assert time.monotonic() < deadline
+        time.sleep(0.1)
+    response = student.post('/active_challenge', data={
+        'csrf_token': csrf_token(student, '/active_challenge'),
+        'stop': 'Stop this Challenge',
+    })
+    assert response.status_code == 302
+    assert load().active_challenge is None
+
+    # logging out
+    response = student.post('/manage_profile', data={
+        'csrf_token': csrf_token(student, '/manage_profile'),
+        'logout': 'Log Out',
+    })
+    assert response.status_code == 302
+    assert load() is None
+
+    # an admin logging them out and deleting them
+    assert login(student, 'pupil', 'password').status_code == 302
+    assert load() is not None
+    edit_user(admin_logged_in, user_id, username='pupil', logout='Log Out')
+    assert load() is None
+
+    assert login(student, 'pupil', 'password').status_code == 302
+    assert load() is not None
+    edit_user(admin_logged_in, user_id, username='pupil', delete='Delete')
+    assert load() is None
+
+
+def test_listeners_after_commit(app, monkeypatch):
+    """Tests that automatic logout listeners only hear about committed
+    changes"""
+
+    monkeypatch.setattr(db, '_auto_logout_listeners', [])
+    heard = []
+    db.on_auto_logout_change(lambda user_id, deadline: heard.append(user_id))
+
+    with app.app_context():
+        conn = db.get_connection()
+        db.set_auto_logout(conn, 1, 60)
+        assert heard == []
+        conn.rollback()
+        db.clear_auto_logout(conn, 1)
+        conn.commit()
+    assert heard == [1]